@@ -6,16 +6,88 @@ Description:
 - Baudrate: 115200
 - 3 distances: d1, d2, d3
     - In format: (d1,d2,d3)
+    - Or tagged with the tokenID of the mobile: tokenID:(d1,d2,d3)
 - max distance: 128
+
+Usage:
+    python app.py [port] [--stats-interval S]
+    - port: COM port or pyserial URL (default: COM3)
+        - e.g. socket://localhost:7777 for the simulator (esp_rtls_simulator.py)
+    - --stats-interval: print p50/p99 latency per stage every S seconds
+        - Also printed on demand with SIGUSR1 (Linux/macOS) or Ctrl+Break (Windows)
+    - --rssi-sigma: RSSI noise in dB, for the covariance and the 95 % ellipse of each fix
+    - --zones: JSON file {"zone name": [[x, y], ...], ...}, prints enter/exit events of the mobiles
+        - And the occupancy of the zone on each event
+    - --proximity: radius in m, prints every second which mobiles are within it of each other
+    - --floorplan: JSON file {"raster": "plan.png", "origin": [x, y], "resolution": 0.05}
+        - Fixes in walls are snapped to free space, fixes through walls are rejected
+    - --bias: learn the RSSI bias of each station-mobile link online and correct it
+    - --ranging: likelihood tables (esp_rtls_ranging.py) instead of get_distance
+        - Distance = posterior mean, its standard deviation is used for the covariance
+    - --anchors: JSON file {"anchors": [[x, y, z], ...], "tag_height": 1.2}
+        - Replaces the anchor placement from calc_anchor_position
+        - With tag_height the ranges are projected on the floor plane before the 2D solve
+    - --api: port of the local HTTP API (esp_rtls_api.py), GET /mobiles and /mobiles/{id}
+    - --history: keep the track of the mobiles for GET /mobiles/{id}/history?start=&end=&points=
+    - --metrics: port of the Prometheus metrics, GET /metrics (may be the same port as --api)
+        - Lines, decode errors and fixes per mobile, latency per stage, cycle time, stale mobiles
+    - --stale: seconds without a fix after which a mobile counts as stale
+    - --snapshot: file (.npz) with the filtered distances, last positions, RSSI bias and anchors
+        - Restored on startup, written atomically every --snapshot-interval seconds and on exit
+    - --record: archive file (esp_rtls_archive.py) of the received RSSI samples
+    - --link-health: detect stuck, missing and shifted station links (esp_rtls_linkhealth.py)
+        - Flagged links are printed on change
+        - No station is excluded: a fix needs all 3 stations, so every fix is solved with all of them
 """
 
+import argparse
+import atexit
+import json
+import signal
+import time
 import serial
 import matplotlib.pyplot as plt
 import numpy as np
 import math
+from esp_rtls_positioning import *
+from esp_rtls_instrumentation import stage_timer
+from esp_rtls_zones import esp_rtls_zone_engine
+from esp_rtls_proximity import esp_rtls_proximity
+from esp_rtls_occupancy import esp_rtls_occupancy
+from esp_rtls_mapmatch import load_floorplan
+from esp_rtls_bias import esp_rtls_bias
+from esp_rtls_ranging import esp_rtls_ranging
+from esp_rtls_api import esp_rtls_state_index, esp_rtls_api
+from esp_rtls_history import esp_rtls_history
+from esp_rtls_metrics import esp_rtls_metrics
+from esp_rtls_snapshot import esp_rtls_snapshotter, load_snapshot, table_to_arrays, arrays_to_table
+from esp_rtls_archive import esp_rtls_archive_writer, RSSI_SAMPLE
+from esp_rtls_linkhealth import esp_rtls_link_health, FLAG_NAMES
+from esp_rtls_solvercache import esp_rtls_solver_cache
+
+# Arguments
+parser = argparse.ArgumentParser(description="Plot the position of the mobiles")
+parser.add_argument("port", nargs="?", default="COM3", help="COM port or pyserial URL")
+parser.add_argument("--stats-interval", type=float, default=0, help="Seconds between latency summaries (0 => off)")
+parser.add_argument("--rssi-sigma", type=float, default=2.0, help="RSSI noise in dB")
+parser.add_argument("--zones", default=None, help="JSON file with the zone polygons")
+parser.add_argument("--proximity", type=float, default=0, help="Contact radius in m (0 => off)")
+parser.add_argument("--floorplan", default=None, help="JSON file describing the floorplan raster")
+parser.add_argument("--bias", action="store_true", help="Estimate and correct the RSSI bias per link")
+parser.add_argument("--ranging", default=None, help="Ranging likelihood tables (.npz)")
+parser.add_argument("--anchors", default=None, help="JSON file with the 3D anchor positions")
+parser.add_argument("--api", type=int, default=0, help="Port of the local HTTP API (0 => off)")
+parser.add_argument("--history", action="store_true", help="Keep the history of the positions for the API")
+parser.add_argument("--metrics", type=int, default=0, help="Port of the Prometheus metrics (0 => off)")
+parser.add_argument("--stale", type=float, default=10, help="Seconds without a fix before a mobile is stale")
+parser.add_argument("--snapshot", default=None, help="Snapshot file of the tracker state (.npz)")
+parser.add_argument("--snapshot-interval", type=float, default=10, help="Seconds between snapshots")
+parser.add_argument("--record", default=None, help="Archive file of the received RSSI samples")
+parser.add_argument("--link-health", action="store_true", help="Report stations with stuck, missing or shifted RSSI")
+args = parser.parse_args()
 
 # Global variables
-ser = serial.Serial('COM3', 115200)
+ser = serial.serial_for_url(args.port, 115200)
 ser.flushInput()
 x1 = 0
 y1 = 0
@@ -37,30 +109,6 @@ ax.set_aspect('equal')
 ax.grid()
 
 # Functions
-def get_distance(rssi, rssi_at_1_meter=60, n=2.0):
-    distance = 10 ** (((-rssi_at_1_meter) - (-rssi)) / (10 * n))
-    
-    return distance
-
-def calc_anchor_position(x1,y1, d_1_2, d_1_3, d_2_3):
-    x2 = x1 - d_2_3/2
-    x3 = x1 + d_2_3/2
-    y2 = y1 - math.sqrt(d_1_2**2 - x2**2)
-    y3 = y1 - math.sqrt(d_1_3**2 - x3**2)
-    return x2, y2, x3, y3
-
-def get_position(x1, y1, x2, y2, x3, y3, d1, d2, d3):
-    
-    A = 2 * x2 - 2 * x1
-    B = 2 * y2 - 2 * y1
-    C = d1 ** 2 - d2 ** 2 - x1 ** 2 + x2 ** 2 - y1 ** 2 + y2 ** 2
-    D = 2 * x3 - 2 * x2
-    E = 2 * y3 - 2 * y2
-    F = d2 ** 2 - d3 ** 2 - x2 ** 2 + x3 ** 2 - y2 ** 2 + y3 ** 2
-    x = (C * E - F * B) / (E * A - B * D)
-    y = (C * D - A * F) / (B * D - A * E)
-    return x, y, d1, d2, d3
-
 def plot_position(x, y, x1, y1, x2, y2, x3, y3, d1, d2, d3):
     # draw the circles of the radius from the three anchors
         # With dotted line
@@ -78,6 +126,15 @@ def plot_position(x, y, x1, y1, x2, y2, x3, y3, d1, d2, d3):
     ax.scatter(x3, y3, c='b', marker='o')
     plt.pause(0.05)
     
+def plot_ellipse(x, y, covariance, gdop):
+    # 95 % confidence ellipse of the fix, faded out for poor geometry
+    from matplotlib.patches import Ellipse
+    major, minor, angle = confidence_ellipse(covariance[None])
+    alpha = float(np.clip(1 / gdop, 0.1, 1)) if np.isfinite(gdop) else 0.1
+    ellipse = Ellipse((x, y), 2 * major[0], 2 * minor[0], angle=math.degrees(angle[0]),
+                      color='black', fill=False, alpha=alpha)
+    ax.add_artist(ellipse)
+
 def clear_plot(x1, y1, x2, y2, x3, y3):
     ax.clear()
     # Calculate minimum and maximum of x and y
@@ -90,53 +147,240 @@ def clear_plot(x1, y1, x2, y2, x3, y3):
     ax.set_aspect('equal')
     ax.grid()
     
-def swap_position_of_2_anchors(x1, y1, x2, y2):
-    x1, x2 = x2, x1
-    y1, y2 = y2, y1
-    return x1, y1, x2, y2
-
-# Moving average filter
-def moving_average_filter(d, d_last):
-    d_filtered = (d + d_last) / 2
-    return d_filtered
-
-# Moving average on 3 distances
-def moving_average_on_3_distances(d1, d2, d3, d_1_last, d_2_last, d_3_last):
-    d1_filtered = moving_average_filter(d1, d_1_last)
-    d2_filtered = moving_average_filter(d2, d_2_last)
-    d3_filtered = moving_average_filter(d3, d_3_last)
-    return d1_filtered, d2_filtered, d3_filtered
-    
 x1 = 0
 y1 = 0
 
-d_1_last = 0
-d_2_last = 0
-d_3_last = 0
+# Last filtered distances per mobile: tokenID => (d_1_last, d_2_last, d_3_last)
+d_last = {}
+
+# Latency per stage of the main loop
+timer = stage_timer(["read", "decode", "distance", "solve", "render"], args.stats_interval)
+dump_stats = False
+
+def request_stats_dump(signum, frame):
+    global dump_stats
+    dump_stats = True
+
+if hasattr(signal, "SIGUSR1"):
+    signal.signal(signal.SIGUSR1, request_stats_dump)
+elif hasattr(signal, "SIGBREAK"):
+    signal.signal(signal.SIGBREAK, request_stats_dump)
+
+# Zones (geofences)
+zones = None
+occupancy = None
+if args.zones:
+    with open(args.zones) as file:
+        zones = esp_rtls_zone_engine(json.load(file))
+    occupancy = esp_rtls_occupancy(len(zones.names))
+
+# Map matching on the floorplan
+mapmatch = load_floorplan(args.floorplan) if args.floorplan else None
+
+# RSSI bias per link
+bias = esp_rtls_bias(3, 58, 2.5) if args.bias else None
+
+# Probabilistic ranging
+ranging = esp_rtls_ranging.load(args.ranging) if args.ranging else None
+
+# Latest state of the mobiles, served by the HTTP API on its own thread
+state_index = None
+history = None
+api = None
+if args.api:
+    state_index = esp_rtls_state_index()
+    history = esp_rtls_history() if args.history else None
+    api = esp_rtls_api(state_index, port=args.api, history=history)
+    api.start()
+
+# Metrics (counters are updated in the main loop, gauges when scraped)
+metrics = None
+last_fix = {}
+if args.metrics:
+    metrics = esp_rtls_metrics()
+    metrics.describe("esp_rtls_lines_total", "counter", "Lines read from the COM port")
+    metrics.describe("esp_rtls_decode_errors_total", "counter", "Lines that could not be decoded")
+    metrics.describe("esp_rtls_fixes_total", "counter", "Fixes per mobile")
+    metrics.describe("esp_rtls_stage_seconds", "histogram", "Latency per stage of the main loop")
+    metrics.describe("esp_rtls_cycle_seconds", "histogram", "Time between consecutive fixes of a mobile")
+    metrics.describe("esp_rtls_mobiles", "gauge", "Mobiles seen")
+    metrics.describe("esp_rtls_stale_mobiles", "gauge", "Mobiles without a fix for --stale seconds")
+    metrics.inc("esp_rtls_lines_total", value=0)
+    metrics.inc("esp_rtls_decode_errors_total", value=0)
+    for stage, histogram in timer.histograms.items():
+        metrics.add_histogram("esp_rtls_stage_seconds", histogram, ("stage", stage))
+    metrics.gauge("esp_rtls_mobiles", lambda: len(last_fix))
+    metrics.gauge("esp_rtls_stale_mobiles", lambda: sum(
+        time.monotonic() - t > args.stale for t in list(last_fix.values())
+    ))
+    cycle_histogram = metrics.histogram("esp_rtls_cycle_seconds")
+    if api is not None and args.metrics == args.api:
+        api.add_route("/metrics", metrics.handle)
+    else:
+        metrics_api = esp_rtls_api(esp_rtls_state_index(), port=args.metrics)
+        metrics_api.add_route("/metrics", metrics.handle)
+        metrics_api.start()
+
+# Proximity between mobiles, on the last position of each mobile: tokenID => (x, y)
+proximity = esp_rtls_proximity(args.proximity) if args.proximity > 0 else None
+last_position = {}
+next_proximity = time.monotonic()
 
 x2, y2, x3, y3 = calc_anchor_position(x1, y1, 6, 6, 6)
+anchors_3d = None
+tag_height = None
+if args.anchors:
+    anchors_3d, tag_height, _ = load_anchors(args.anchors)
+    (x1, y1), (x2, y2), (x3, y3) = anchors_3d[:3, :2].tolist()
+
+# Recording of the RSSI samples (chunks are compressed and written every 4096 samples)
+recorder = None
+if args.record:
+    recorder = esp_rtls_archive_writer(args.record, "rssi")
+    atexit.register(recorder.close)
+    sample = np.zeros(1, dtype=RSSI_SAMPLE)
+
+# Link health per station-mobile link
+link_health = esp_rtls_link_health(3) if args.link_health else None
+link_flags = {}
+
+# Warm restart from the last snapshot
+snapshotter = None
+if args.snapshot:
+    snapshot = load_snapshot(args.snapshot)
+    if snapshot is not None:
+        d_last = arrays_to_table(snapshot["d_last_tokenIDs"], snapshot["d_last"])
+        last_position = arrays_to_table(snapshot["position_tokenIDs"], snapshot["position"])
+        if bias is not None and "bias" in snapshot:
+            bias.restore(snapshot["bias_tokenIDs"], snapshot["bias"], snapshot["bias_P"])
+        if not args.anchors:
+            (x1, y1), (x2, y2), (x3, y3) = snapshot["anchors"][:3, :2].tolist()
+        print("snapshot restored: ", len(d_last), "mobiles")
+    snapshotter = esp_rtls_snapshotter(args.snapshot, args.snapshot_interval)
+
+# Pseudo-inverse of the trilateration system per subset of the anchors
+solver_cache = esp_rtls_solver_cache([[x1, y1], [x2, y2], [x3, y3]])
+
+def take_snapshot():
+    d_last_tokenIDs, d_last_values = table_to_arrays(d_last, 3)
+    position_tokenIDs, position_values = table_to_arrays(last_position, 2)
+    state = {
+        "d_last_tokenIDs": d_last_tokenIDs,
+        "d_last": d_last_values,
+        "position_tokenIDs": position_tokenIDs,
+        "position": position_values,
+        "anchors": anchors_3d if anchors_3d is not None else np.array([[x1, y1], [x2, y2], [x3, y3]]),
+    }
+    if bias is not None:
+        state["bias_tokenIDs"], state["bias"], state["bias_P"] = bias.state()
+    snapshotter.submit(state)
+
+def final_snapshot():
+    take_snapshot()
+    snapshotter.close()
+
+if snapshotter is not None:
+    atexit.register(final_snapshot)
+
 # Main
 while True:
+    timer.start()
     ser_bytes = ser.readline()
-    decoded_bytes = ser_bytes[0:len(ser_bytes)-2].decode("utf-8")
-    print(decoded_bytes)
-    if decoded_bytes != "":
-        decoded_bytes = decoded_bytes[1:-1]
-        d1, d2, d3 = decoded_bytes.split(",")
-        d1 = get_distance(int(d1),58,2.5)
-        d2 = get_distance(int(d2),58,2.5)
-        d3 = get_distance(int(d3),58,2.5)
+    timer.lap("read")
+    try:
+        decoded_bytes = ser_bytes[0:len(ser_bytes)-2].decode("utf-8")
+        print(decoded_bytes)
+        parsed = parse_line(decoded_bytes)
+    except ValueError:
+        # Garbled line (e.g. cut off while the port was opened)
+        parsed = None
+        if metrics is not None:
+            metrics.inc("esp_rtls_decode_errors_total")
+    if metrics is not None:
+        metrics.inc("esp_rtls_lines_total")
+    if parsed is not None:
+        tokenID, d1, d2, d3 = parsed
+        timer.lap("decode")
+        if recorder is not None:
+            sample[0] = (time.time(), tokenID, (d1, d2, d3))
+            recorder.append(sample)
+        rssi = [d1, d2, d3]
+        if link_health is not None:
+            flags = link_health.update(time.monotonic(), [tokenID], [rssi])[0][0].tolist()
+            if flags != link_flags.get(tokenID, [0, 0, 0]):
+                print("link health = ", tokenID, [
+                    [name for bit, name in FLAG_NAMES.items() if flag & bit] for flag in flags
+                ])
+            link_flags[tokenID] = flags
+        if bias is not None:
+            d1, d2, d3 = bias.correct([tokenID], [rssi])[0]
+        if ranging is not None:
+            (d1, d2, d3), variance = ranging.distance(ranging.link_index([tokenID] * 3, [1, 2, 3]), [d1, d2, d3])
+            sigma_d = np.sqrt(variance)
+        else:
+            d1 = get_distance(d1,58,2.5)
+            d2 = get_distance(d2,58,2.5)
+            d3 = get_distance(d3,58,2.5)
+            sigma_d = distance_sigma([d1, d2, d3], args.rssi_sigma, 2.5)
+        if tag_height is not None:
+            # Range in the floor plane, its noise grows by d / d_horizontal
+            d = np.array([d1, d2, d3])
+            d_horizontal = np.maximum(horizontal_distances(anchors_3d[:3], d[None], tag_height)[0], 0.01)
+            sigma_d = np.asarray(sigma_d) * d / d_horizontal
+            d1, d2, d3 = d_horizontal
+        d_1_last, d_2_last, d_3_last = d_last.get(tokenID, (0, 0, 0))
         d1, d2, d3 = moving_average_on_3_distances(d1, d2, d3, d_1_last, d_2_last, d_3_last)
-        d_1_last, d_2_last, d_3_last = d1, d2, d3
+        d_last[tokenID] = (d1, d2, d3)
         print("d1 = ", d1)
         print("d2 = ", d2)
         print("d3 = ", d3)
+        timer.lap("distance")
         if d1 != 0 and d2 != 0 and d3 != 0:
-            x, y, d1, d2, d3 = get_position(x1, y1, x2, y2, x3, y3, d1, d2, d3)
+            x, y = solver_cache.solve_one((d1, d2, d3))
+            covariance, gdop = get_position_covariance(
+                [[x1, y1], [x2, y2], [x3, y3]], [[x, y]], [sigma_d]
+            )
+            if bias is not None:
+                bias.update([tokenID], [rssi], [[x1, y1], [x2, y2], [x3, y3]], [[x, y]])
+            if mapmatch is not None:
+                matched, accepted, penalty = mapmatch.update([tokenID], [[x, y]])
+                x, y = matched[0]
+                print("map match = ", bool(accepted[0]), penalty[0])
             print("x = ", x)
             print("y = ", y)
+            print("gdop = ", gdop[0])
+            if zones is not None:
+                occupancy.update(time.monotonic(), [tokenID], *zones.classify([[x, y]]))
+                for event in zones.update([tokenID], [[x, y]]):
+                    zone = zones.names.index(event[1])
+                    print("zone = ", event, "occupancy = ", occupancy.occupancy(zone))
+            last_position[tokenID] = (x, y)
+            if metrics is not None:
+                now = time.monotonic()
+                metrics.inc("esp_rtls_fixes_total", tokenID)
+                if tokenID in last_fix:
+                    cycle_histogram.record(int((now - last_fix[tokenID]) * 1e9))
+                last_fix[tokenID] = now
+            if state_index is not None:
+                state_index.update([tokenID], [[x, y]], covariance, [rssi])
+                if history is not None:
+                    history.append(time.time(), [tokenID], [[x, y]])
+            timer.lap("solve")
+            # Ellipse first: plot_position draws (plt.pause) and clear_plot removes all artists
+            plot_ellipse(x, y, covariance[0], gdop[0])
             plot_position(x, y, x1, y1, x2, y2, x3, y3, d1, d2, d3)
             clear_plot(x1, y1, x2, y2, x3, y3)
+            timer.lap("render")
+    if proximity is not None and time.monotonic() >= next_proximity and last_position:
+        next_proximity = time.monotonic() + 1
+        (pairs, durations), _ = proximity.update(list(last_position.keys()), list(last_position.values()), time.monotonic())
+        for (token_a, token_b), duration in zip(pairs.tolist(), durations.tolist()):
+            print("contact = ", token_a, token_b, round(duration, 1))
+    if timer.due() or dump_stats:
+        dump_stats = False
+        print(timer.summary())
+    if snapshotter is not None and snapshotter.due():
+        take_snapshot()
 #     try:
 #         ser_bytes = ser.readline()
 #         decoded_bytes = ser_bytes[0:len(ser_bytes)-2].decode("utf-8")
@@ -0,0 +1,154 @@
+"""
+Benchmarks of the stages of the host positioning pipeline in app.py
+
+Description:
+- Each benchmark round processes one ring cycle: one line per mobile
+- Stages: parse_line, get_distance, moving_average_on_3_distances, get_position,
+  esp_rtls_solver_cache (one fix at a time as in app.py, and batched as in the pipeline)
+- Full pipeline: all stages per line, as in the main loop of app.py
+- Data: synthetic (esp_rtls_simulator.py) or recorded (ESP_RTLS_RECORDING)
+- Mobiles: 1, 10, 100 and 1000
+"""
+
+import os
+import pytest
+import numpy as np
+from esp_rtls_positioning import *
+from esp_rtls_simulator import esp_rtls_simulator
+from esp_rtls_solvercache import esp_rtls_solver_cache
+
+N_MOBILES = [1, 10, 100, 1000]
+RECORDING = os.environ.get("ESP_RTLS_RECORDING")
+
+x1, y1 = 0, 0
+x2, y2, x3, y3 = calc_anchor_position(x1, y1, 6, 6, 6)
+
+
+def synthetic_lines(n_mobiles):
+    simulator = esp_rtls_simulator(n_mobiles, seed=1)
+    return simulator.lines(tagged=True).splitlines()
+
+
+def recorded_lines(n_mobiles):
+    # Recorded lines are re-tagged round robin, so one recorded mobile can feed many
+    with open(RECORDING) as file:
+        samples = [parse_line(line) for line in file]
+    samples = [sample for sample in samples if sample is not None]
+    return [
+        str(i + 1) + ":(" + ", ".join(str(r) for r in samples[i % len(samples)][1:]) + ")"
+        for i in range(n_mobiles)
+    ]
+
+
+@pytest.fixture(params=["synthetic", "recorded"])
+def lines_factory(request):
+    if request.param == "recorded" and not RECORDING:
+        pytest.skip("ESP_RTLS_RECORDING not set")
+    return synthetic_lines if request.param == "synthetic" else recorded_lines
+
+
+def run(benchmark, function, n_mobiles):
+    """Benchmark function and record throughput and latency percentiles of a ring cycle"""
+    result = benchmark(function)
+    data = sorted(benchmark.stats.stats.data)
+    benchmark.extra_info["n_mobiles"] = n_mobiles
+    benchmark.extra_info["samples_per_s"] = n_mobiles / benchmark.stats.stats.median
+    benchmark.extra_info["p50_us"] = data[int(0.50 * (len(data) - 1))] * 1e6
+    benchmark.extra_info["p99_us"] = data[int(0.99 * (len(data) - 1))] * 1e6
+    return result
+
+
+@pytest.mark.parametrize("n_mobiles", N_MOBILES)
+def test_parse_line(benchmark, lines_factory, n_mobiles):
+    lines = lines_factory(n_mobiles)
+    samples = run(benchmark, lambda: [parse_line(line) for line in lines], n_mobiles)
+    assert len(samples) == n_mobiles
+
+
+@pytest.mark.parametrize("n_mobiles", N_MOBILES)
+def test_get_distance(benchmark, lines_factory, n_mobiles):
+    samples = [parse_line(line) for line in lines_factory(n_mobiles)]
+
+    def stage():
+        return [
+            (get_distance(r1, 58, 2.5), get_distance(r2, 58, 2.5), get_distance(r3, 58, 2.5))
+            for _, r1, r2, r3 in samples
+        ]
+
+    assert len(run(benchmark, stage, n_mobiles)) == n_mobiles
+
+
+@pytest.mark.parametrize("n_mobiles", N_MOBILES)
+def test_moving_average_on_3_distances(benchmark, lines_factory, n_mobiles):
+    distances = [
+        (get_distance(r1, 58, 2.5), get_distance(r2, 58, 2.5), get_distance(r3, 58, 2.5))
+        for _, r1, r2, r3 in (parse_line(line) for line in lines_factory(n_mobiles))
+    ]
+
+    def stage():
+        return [moving_average_on_3_distances(d1, d2, d3, d1, d2, d3) for d1, d2, d3 in distances]
+
+    assert len(run(benchmark, stage, n_mobiles)) == n_mobiles
+
+
+@pytest.mark.parametrize("n_mobiles", N_MOBILES)
+def test_get_position(benchmark, lines_factory, n_mobiles):
+    distances = [
+        (get_distance(r1, 58, 2.5), get_distance(r2, 58, 2.5), get_distance(r3, 58, 2.5))
+        for _, r1, r2, r3 in (parse_line(line) for line in lines_factory(n_mobiles))
+    ]
+
+    def stage():
+        return [get_position(x1, y1, x2, y2, x3, y3, d1, d2, d3) for d1, d2, d3 in distances]
+
+    assert len(run(benchmark, stage, n_mobiles)) == n_mobiles
+
+
+@pytest.mark.parametrize("n_mobiles", N_MOBILES)
+def test_solver_cache_one(benchmark, lines_factory, n_mobiles):
+    distances = [
+        (get_distance(r1, 58, 2.5), get_distance(r2, 58, 2.5), get_distance(r3, 58, 2.5))
+        for _, r1, r2, r3 in (parse_line(line) for line in lines_factory(n_mobiles))
+    ]
+    solver_cache = esp_rtls_solver_cache([[x1, y1], [x2, y2], [x3, y3]])
+
+    def stage():
+        return [solver_cache.solve_one(d) for d in distances]
+
+    assert len(run(benchmark, stage, n_mobiles)) == n_mobiles
+
+
+@pytest.mark.parametrize("n_mobiles", N_MOBILES)
+def test_solver_cache_batch(benchmark, lines_factory, n_mobiles):
+    distances = np.array([
+        (get_distance(r1, 58, 2.5), get_distance(r2, 58, 2.5), get_distance(r3, 58, 2.5))
+        for _, r1, r2, r3 in (parse_line(line) for line in lines_factory(n_mobiles))
+    ])
+    solver_cache = esp_rtls_solver_cache([[x1, y1], [x2, y2], [x3, y3]])
+
+    assert len(run(benchmark, lambda: solver_cache.solve(distances), n_mobiles)) == n_mobiles
+
+
+@pytest.mark.parametrize("n_mobiles", N_MOBILES)
+def test_full_pipeline(benchmark, lines_factory, n_mobiles):
+    lines = [line.encode() + b"\r\n" for line in lines_factory(n_mobiles)]
+    d_last = {}
+    solver_cache = esp_rtls_solver_cache([[x1, y1], [x2, y2], [x3, y3]])
+
+    def pipeline():
+        # Same steps as the main loop of app.py, without printing and plotting
+        positions = []
+        for ser_bytes in lines:
+            decoded_bytes = ser_bytes[0:len(ser_bytes)-2].decode("utf-8")
+            tokenID, d1, d2, d3 = parse_line(decoded_bytes)
+            d1 = get_distance(d1, 58, 2.5)
+            d2 = get_distance(d2, 58, 2.5)
+            d3 = get_distance(d3, 58, 2.5)
+            d_1_last, d_2_last, d_3_last = d_last.get(tokenID, (0, 0, 0))
+            d1, d2, d3 = moving_average_on_3_distances(d1, d2, d3, d_1_last, d_2_last, d_3_last)
+            d_last[tokenID] = (d1, d2, d3)
+            if d1 != 0 and d2 != 0 and d3 != 0:
+                positions.append(solver_cache.solve_one((d1, d2, d3)))
+        return positions
+
+    assert len(run(benchmark, pipeline, n_mobiles)) == n_mobiles
@@ -0,0 +1,35 @@
+"""
+Benchmarks of the host positioning pipeline (pytest-benchmark)
+
+Usage (headless, no COM port needed):
+    pytest V4/benchmarks/bench_pipeline.py
+    pytest V4/benchmarks/bench_pipeline.py --benchmark-json=bench.json
+    pytest-benchmark compare bench_old.json bench.json
+
+Recorded data:
+    Set ESP_RTLS_RECORDING to a capture of the COM port (one line per sample)
+"""
+
+import os
+import sys
+
+# The host modules live next to app.py
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+def pytest_terminal_summary(terminalreporter):
+    """Print throughput and latency percentiles of a ring cycle per benchmark"""
+    session = terminalreporter.config._benchmarksession
+    if not session.benchmarks:
+        return
+    terminalreporter.write_sep("-", "throughput and ring cycle latency percentiles")
+    for bench in session.benchmarks:
+        info = bench.extra_info
+        terminalreporter.write_line(
+            "{:<60} {:>12.0f} samples/s   p50 {:>10.1f} us   p99 {:>10.1f} us".format(
+                bench.fullname.split("::")[-1],
+                info["samples_per_s"],
+                info["p50_us"],
+                info["p99_us"],
+            )
+        )
@@ -0,0 +1,165 @@
+"""
+Local HTTP query API on the latest state of the mobiles
+
+Description:
+- Latest-state index keyed by tokenID: position, covariance, last seen time and RSSI per link
+    - The ingest loop replaces the immutable record of a mobile (one dict assignment, no lock)
+    - Readers get a consistent record without ever blocking the ingest loop
+- HTTP server (http.server.ThreadingHTTPServer) on a daemon thread, JSON responses:
+    - GET /mobiles                    => All mobiles
+    - GET /mobiles/{id}               => One mobile (O(1) lookup)
+    - GET /mobiles/{id}/history?start=T&end=T&points=N (N >= 3, else 400)
+                                      => Downsampled track (only with an esp_rtls_history)
+- More routes can be added with add_route (e.g. metrics)
+- Binds to localhost by default
+
+Usage:
+    index = esp_rtls_state_index()
+    api = esp_rtls_api(index, port=8080)
+    api.start()
+    index.update(tokenIDs, positions, covariance, rssi)
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+
+class esp_rtls_state_index:
+    """
+    Description: Latest state per mobile, written by one thread and read by many
+
+    Methods:
+    - update(tokenIDs, positions, covariance, rssi, t) => Replace the records of the mobiles
+    - get(tokenID) => Record of a mobile or None
+    - all() => Records of all mobiles
+    """
+
+    def __init__(self):
+        self.__records = {}
+
+    def update(self, tokenIDs, positions, covariance=None, rssi=None, t=None):
+        """
+        Args:
+            tokenIDs    [List] => TokenIDs of the mobiles (M,)
+            positions   [ndarray (M, 2)] => Positions
+            covariance  [ndarray (M, 2, 2)] => Covariance of the positions (None in the record if not finite)
+            rssi        [ndarray (M, K)] => RSSI per station (as send by the stations)
+            t           [Float] => Time of the fixes (time.time(), default now)
+        """
+        t = time.time() if t is None else t
+        positions = np.asarray(positions, dtype=float).tolist()
+        if covariance is None:
+            covariance = [None] * len(tokenIDs)
+        else:
+            # Degenerate geometry (inf) is not valid JSON
+            covariance = np.asarray(covariance, dtype=float)
+            finite = np.isfinite(covariance).all(axis=(1, 2)).tolist()
+            covariance = [cov if ok else None for cov, ok in zip(covariance.tolist(), finite)]
+        rssi = [None] * len(tokenIDs) if rssi is None else np.asarray(rssi).tolist()
+        for tokenID, position, cov, link_rssi in zip(tokenIDs, positions, covariance, rssi):
+            self.__records[tokenID] = {
+                "tokenID": tokenID,
+                "position": position,
+                "covariance": cov,
+                "last_seen": t,
+                "rssi": link_rssi,
+            }
+
+    def get(self, tokenID):
+        return self.__records.get(tokenID)
+
+    def all(self):
+        return list(self.__records.values())
+
+
+class esp_rtls_api:
+    """
+    Description: HTTP server of the state index on a background thread
+
+    Attributes:
+    - index    [esp_rtls_state_index] => Latest state of the mobiles
+    - history  [esp_rtls_history] => History for the track queries (None => no history route)
+    - address  [Tuple] => (host, port) the server is bound to
+
+    Methods:
+    - add_route(path, handler) => handler(query) returns (status, content type, body)
+    - start() => Serve on a daemon thread
+    - stop() => Shut the server down
+    """
+
+    def __init__(self, index, host="127.0.0.1", port=8080, history=None):
+        self.index = index
+        self.history = history
+        self.__routes = {}
+        api = self
+
+        class handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, content_type, body = api.handle(self.path)
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.__server = ThreadingHTTPServer((host, port), handler)
+        self.__server.daemon_threads = True
+        self.address = self.__server.server_address
+        self.__thread = None
+
+    def add_route(self, path, handler):
+        self.__routes[path] = handler
+
+    def start(self):
+        self.__thread = threading.Thread(target=self.__server.serve_forever, name="esp_rtls_api", daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+
+    def handle(self, path):
+        """
+        Args:
+            path  [String] => Request path with query string
+
+        Returns:
+            status [Integer], content type [String], body [Bytes]
+        """
+        url = urlsplit(path)
+        query = parse_qs(url.query)
+        parts = [part for part in url.path.split("/") if part]
+        try:
+            if url.path in self.__routes:
+                return self.__routes[url.path](query)
+            if parts == ["mobiles"]:
+                return self.__json(200, {"now": time.time(), "mobiles": self.index.all()})
+            if len(parts) >= 2 and parts[0] == "mobiles":
+                tokenID = int(parts[1])
+                if len(parts) == 2:
+                    record = self.index.get(tokenID)
+                    if record is None:
+                        return self.__json(404, {"error": "unknown mobile " + str(tokenID)})
+                    return self.__json(200, dict(record, now=time.time()))
+                if parts[2:] == ["history"] and self.history is not None:
+                    t, xy = self.history.query(
+                        tokenID,
+                        float(query.get("start", ["-inf"])[0]),
+                        float(query.get("end", ["inf"])[0]),
+                        int(query.get("points", ["1000"])[0]),
+                    )
+                    return self.__json(200, {"tokenID": tokenID, "t": t.tolist(), "position": xy.tolist()})
+        except ValueError as error:
+            return self.__json(400, {"error": str(error)})
+        return self.__json(404, {"error": "not found"})
+
+    def __json(self, status, data):
+        return status, "application/json", json.dumps(data).encode("utf-8")
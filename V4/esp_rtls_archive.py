@@ -0,0 +1,303 @@
+"""
+Chunk-compressed, randomly accessible archive of RSSI samples or positions
+
+Description:
+- Records are stored in chunks of chunk_size records, each chunk compressed on its own
+  (zlib or lzma from the standard library)
+- Inside a chunk the records are stored by column, encoded to compress well:
+    - t: microseconds, delta to the previous record
+        - The chunk index and the query bounds use the same quantized times, so a bound equal
+          to a recorded time includes that record
+    - rssi: one uint8 column per station
+    - x, y: millimetres, delta to the previous record of the same mobile
+    - Integer columns are byte-shuffled (all lowest bytes, then the next bytes, ...)
+- File layout:
+    - Header: magic, version, kind (rssi / position), codec
+    - Chunks: chunk header (t_min, t_max, records, compressed bytes) + compressed payload
+    - Index: (t_min, t_max, offset, records) per chunk
+    - Footer: offset of the index, number of chunks, magic
+- A time range query reads the index and decompresses only the chunks that overlap it
+- Files without an index (writer not closed) are recovered by walking the chunk headers
+
+Usage:
+    with esp_rtls_archive_writer("capture.esa", "rssi") as writer:
+        writer.append(records)
+    records = esp_rtls_archive_reader("capture.esa").query(t_start, t_end)
+
+    python esp_rtls_archive.py pack samples.csv capture.esa --kind rssi
+    python esp_rtls_archive.py unpack capture.esa samples.csv [--start T] [--end T]
+"""
+
+import argparse
+import csv
+import lzma
+import os
+import struct
+import sys
+import zlib
+import numpy as np
+
+# Record types
+RSSI_SAMPLE = np.dtype([("t", "f8"), ("tokenID", "i8"), ("rssi", "u1", (3,))])
+POSITION_SAMPLE = np.dtype([("t", "f8"), ("tokenID", "i8"), ("position", "f8", (2,))])
+KINDS = {"rssi": (0, RSSI_SAMPLE), "position": (1, POSITION_SAMPLE)}
+CODECS = {"zlib": 0, "lzma": 1}
+
+_MAGIC = b"ESPRTLSA"
+_VERSION = 1
+_HEADER = struct.Struct("<8sHBB")
+_CHUNK = struct.Struct("<ddII")
+_INDEX = struct.Struct("<ddQI")
+_FOOTER = struct.Struct("<QI8s")
+_PAYLOAD = struct.Struct("<qI")
+
+
+def _quantize(t):
+    """Times as stored: rounded to microseconds (infinite bounds unchanged)"""
+    t = np.asarray(t, dtype=float)
+    return np.where(np.isfinite(t), np.rint(t * 1e6) / 1e6, t)
+
+
+def _shuffle(values):
+    """Bytes of an integer column, grouped by byte position"""
+    values = np.ascontiguousarray(values)
+    return values.view(np.uint8).reshape(len(values), -1).T.tobytes()
+
+
+def _unshuffle(data, dtype, n):
+    dtype = np.dtype(dtype)
+    return np.frombuffer(data, dtype=np.uint8).reshape(dtype.itemsize, n).T.copy().view(dtype).reshape(n)
+
+
+def _group_delta(values, tokenIDs, inverse=False):
+    """Delta to the previous record of the same mobile (inverse: cumulative sum)"""
+    order = np.argsort(tokenIDs, kind="stable")
+    tokens = tokenIDs[order]
+    start = np.ones(len(tokens), dtype=bool)
+    start[1:] = tokens[1:] != tokens[:-1]
+    v = values[order]
+    if inverse:
+        total = np.cumsum(v, axis=0)
+        first = np.nonzero(start)[0]
+        offset = total[first] - v[first]
+        v = total - offset[np.cumsum(start) - 1]
+    else:
+        v = v.copy()
+        v[1:][~start[1:]] -= values[order][:-1][~start[1:]]
+    out = np.empty_like(values)
+    out[order] = v
+    return out
+
+
+def encode_chunk(records, kind):
+    t = np.rint(records["t"] * 1e6).astype(np.int64)
+    base = int(t[0]) if len(t) else 0
+    tokenIDs = records["tokenID"].astype(np.int64)
+    parts = [_PAYLOAD.pack(base, len(records)), _shuffle(np.diff(t, prepend=base)), _shuffle(tokenIDs)]
+    if kind == "rssi":
+        parts.append(np.ascontiguousarray(records["rssi"].T).tobytes())
+    else:
+        millimetres = np.rint(records["position"] * 1000).astype(np.int64)
+        delta = _group_delta(millimetres, tokenIDs)
+        parts.append(_shuffle(delta[:, 0]) + _shuffle(delta[:, 1]))
+    return b"".join(parts)
+
+
+def decode_chunk(payload, kind):
+    base, n = _PAYLOAD.unpack_from(payload)
+    offset = _PAYLOAD.size
+    records = np.empty(n, dtype=KINDS[kind][1])
+    records["t"] = (np.cumsum(_unshuffle(payload[offset : offset + 8 * n], np.int64, n)) + base) / 1e6
+    offset += 8 * n
+    tokenIDs = _unshuffle(payload[offset : offset + 8 * n], np.int64, n)
+    records["tokenID"] = tokenIDs
+    offset += 8 * n
+    if kind == "rssi":
+        records["rssi"] = np.frombuffer(payload[offset : offset + 3 * n], dtype=np.uint8).reshape(3, n).T
+    else:
+        x = _unshuffle(payload[offset : offset + 8 * n], np.int64, n)
+        y = _unshuffle(payload[offset + 8 * n : offset + 16 * n], np.int64, n)
+        records["position"] = _group_delta(np.stack([x, y], axis=1), tokenIDs, inverse=True) / 1000
+    return records
+
+
+class esp_rtls_archive_writer:
+    """
+    Description: Appends records to an archive, one compressed chunk per chunk_size records
+
+    Methods:
+    - append(records) => Add records (RSSI_SAMPLE or POSITION_SAMPLE, or anything with the same fields)
+    - flush() => Write the buffered records as a chunk
+    - close() => Flush and write the index and footer
+    """
+
+    def __init__(self, filename, kind="rssi", codec="zlib", chunk_size=4096, level=6):
+        self.kind = kind
+        self.codec = codec
+        self.chunk_size = chunk_size
+        self.level = level
+        self.dtype = KINDS[kind][1]
+        self.__file = open(filename, "wb")
+        self.__file.write(_HEADER.pack(_MAGIC, _VERSION, KINDS[kind][0], CODECS[codec]))
+        self.__buffer = np.empty(chunk_size, dtype=self.dtype)
+        self.__n = 0
+        self.__index = []
+
+    def append(self, records):
+        records = np.asarray(records)
+        start = 0
+        while start < len(records):
+            take = min(len(records) - start, self.chunk_size - self.__n)
+            for name in self.dtype.names:
+                self.__buffer[name][self.__n : self.__n + take] = records[name][start : start + take]
+            self.__n += take
+            start += take
+            if self.__n == self.chunk_size:
+                self.flush()
+
+    def flush(self):
+        if self.__n == 0:
+            return
+        records = self.__buffer[: self.__n]
+        payload = encode_chunk(records, self.kind)
+        if self.codec == "zlib":
+            payload = zlib.compress(payload, self.level)
+        else:
+            payload = lzma.compress(payload, preset=self.level)
+        t = _quantize(records["t"])
+        t_min, t_max = float(t.min()), float(t.max())
+        offset = self.__file.tell()
+        self.__file.write(_CHUNK.pack(t_min, t_max, self.__n, len(payload)))
+        self.__file.write(payload)
+        self.__index.append((t_min, t_max, offset, self.__n))
+        self.__n = 0
+
+    def close(self):
+        if self.__file.closed:
+            return
+        self.flush()
+        index_offset = self.__file.tell()
+        for entry in self.__index:
+            self.__file.write(_INDEX.pack(*entry))
+        self.__file.write(_FOOTER.pack(index_offset, len(self.__index), _MAGIC))
+        self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class esp_rtls_archive_reader:
+    """
+    Description: Time range queries on an archive
+
+    Attributes:
+    - kind     [String] => "rssi" or "position"
+    - index    [ndarray (chunks, 4)] => t_min, t_max, offset, records per chunk
+
+    Methods:
+    - query(t_start, t_end) => Records with t_start <= t <= t_end
+    - chunks(t_start, t_end) => Indices of the chunks that overlap the range
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as file:
+            magic, version, kind, codec = _HEADER.unpack(file.read(_HEADER.size))
+            if magic != _MAGIC or version != _VERSION:
+                raise ValueError(filename + " is not an archive (version " + str(_VERSION) + ")")
+            self.kind = [name for name, (code, _) in KINDS.items() if code == kind][0]
+            self.codec = [name for name, code in CODECS.items() if code == codec][0]
+            self.index = self.__read_index(file)
+        self.__t_min = self.index[:, 0]
+        self.__t_max = self.index[:, 1]
+
+    def __len__(self):
+        return int(self.index[:, 3].sum())
+
+    def chunks(self, t_start=-np.inf, t_end=np.inf):
+        t_start, t_end = float(_quantize(t_start)), float(_quantize(t_end))
+        return np.nonzero((self.__t_max >= t_start) & (self.__t_min <= t_end))[0]
+
+    def query(self, t_start=-np.inf, t_end=np.inf):
+        parts = [np.empty(0, dtype=KINDS[self.kind][1])]
+        t_start, t_end = float(_quantize(t_start)), float(_quantize(t_end))
+        with open(self.filename, "rb") as file:
+            for chunk in self.chunks(t_start, t_end).tolist():
+                file.seek(int(self.index[chunk, 2]))
+                _, _, _, length = _CHUNK.unpack(file.read(_CHUNK.size))
+                payload = file.read(length)
+                payload = zlib.decompress(payload) if self.codec == "zlib" else lzma.decompress(payload)
+                records = decode_chunk(payload, self.kind)
+                parts.append(records[(records["t"] >= t_start) & (records["t"] <= t_end)])
+        return np.concatenate(parts)
+
+    def __read_index(self, file):
+        size = file.seek(0, os.SEEK_END)
+        if size >= _HEADER.size + _FOOTER.size:
+            file.seek(size - _FOOTER.size)
+            index_offset, n_chunks, magic = _FOOTER.unpack(file.read(_FOOTER.size))
+            if magic == _MAGIC and index_offset + n_chunks * _INDEX.size + _FOOTER.size == size:
+                file.seek(index_offset)
+                data = file.read(n_chunks * _INDEX.size)
+                return np.array(list(_INDEX.iter_unpack(data)), dtype=float).reshape(n_chunks, 4)
+        # No footer: walk the chunk headers, up to the last complete chunk
+        index = []
+        offset = _HEADER.size
+        while offset + _CHUNK.size <= size:
+            file.seek(offset)
+            t_min, t_max, n, length = _CHUNK.unpack(file.read(_CHUNK.size))
+            if offset + _CHUNK.size + length > size:
+                break
+            index.append((t_min, t_max, offset, n))
+            offset += _CHUNK.size + length
+        return np.array(index, dtype=float).reshape(len(index), 4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack CSV recordings into an archive and back")
+    commands = parser.add_subparsers(dest="command", required=True)
+    pack = commands.add_parser("pack", help="CSV => archive")
+    pack.add_argument("csv", help="rssi: t, tokenID, rssi1, rssi2, rssi3 / position: t, tokenID, x, y")
+    pack.add_argument("archive", help="Archive file")
+    pack.add_argument("--kind", choices=list(KINDS), default="rssi", help="Kind of records")
+    pack.add_argument("--codec", choices=list(CODECS), default="zlib", help="Compression")
+    pack.add_argument("--chunk-size", type=int, default=4096, help="Records per chunk")
+    unpack = commands.add_parser("unpack", help="Archive => CSV")
+    unpack.add_argument("archive", help="Archive file")
+    unpack.add_argument("csv", help="Output CSV ('-' => stdout)")
+    unpack.add_argument("--start", type=float, default=-np.inf, help="Start of the range in s")
+    unpack.add_argument("--end", type=float, default=np.inf, help="End of the range in s")
+    args = parser.parse_args()
+
+    if args.command == "pack":
+        with open(args.csv, newline="") as file:
+            rows = [row for row in csv.reader(file) if row and not row[0].startswith("t")]
+        data = np.array(rows, dtype=float).reshape(len(rows), -1)
+        records = np.empty(len(data), dtype=KINDS[args.kind][1])
+        records["t"] = data[:, 0]
+        records["tokenID"] = data[:, 1]
+        records["rssi" if args.kind == "rssi" else "position"] = data[:, 2:]
+        with esp_rtls_archive_writer(args.archive, args.kind, args.codec, args.chunk_size) as writer:
+            writer.append(records)
+        size = os.path.getsize(args.archive)
+        print("records =", len(records), "ratio =", round(os.path.getsize(args.csv) / max(size, 1), 1))
+    else:
+        reader = esp_rtls_archive_reader(args.archive)
+        records = reader.query(args.start, args.end)
+        file = sys.stdout if args.csv == "-" else open(args.csv, "w", newline="")
+        writer = csv.writer(file)
+        if reader.kind == "rssi":
+            writer.writerow(["t", "tokenID", "rssi1", "rssi2", "rssi3"])
+        else:
+            writer.writerow(["t", "tokenID", "x", "y"])
+        for t, tokenID, values in records.tolist():
+            writer.writerow([t, tokenID] + list(values))
+        if file is not sys.stdout:
+            file.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Online per-link RSSI bias estimation with recursive least squares
+
+Description:
+- Every station-mobile pair (link) has its own offset to the log-distance model
+  (antenna orientation, body shadowing), one rssi_at_1_meter can't capture it
+- Model per link: rssi = rssi_at_1_meter + 10 n log10(d) + bias
+- Residual of a sample: e = measured RSSI - bias - RSSI predicted from the solved position
+- The solved position absorbs every residual in the span of the Jacobian H (K x 2) of the
+  RSSI to the position, only the part in its left null space N (K x K-2) says something
+  about the biases: y = N^T e
+- The biases of the links of a mobile are tracked with recursive least squares on y,
+  with forgetting factor lambda:
+    - S = N^T P N + r I            (r: residual variance in dB^2)
+    - G = P N S^-1
+    - bias = bias + G y
+    - P = (P - G N^T P) / lambda   (diagonal capped at p_max, against wind-up)
+- Needs K >= 3 stations, and movement of the mobile (the geometry changes N)
+- The correction is applied before the distance conversion: rssi - bias
+- All link state is kept in compact arrays (mobile row x station), updated vectorized
+
+Usage:
+    bias = esp_rtls_bias(n_stations=3)
+    rssi = bias.correct(tokenIDs, rssi)
+    ...get_distance, get_positions...
+    bias.update(tokenIDs, rssi_measured, anchors, positions)
+"""
+
+import numpy as np
+from esp_rtls_positioning import RSSI_AT_1_METER, PATH_LOSS_EXPONENT
+from esp_rtls_rows import esp_rtls_rows
+
+
+class esp_rtls_bias:
+    """
+    Description: RLS estimate of the RSSI bias of each link
+
+    Attributes:
+    - n_stations        [Integer] => Number of stations
+    - forgetting        [Float] => Forgetting factor lambda (0 < lambda <= 1)
+    - r                 [Float] => Variance of the residuals in dB^2
+    - max_bias          [Float] => Bias estimates are limited to +-max_bias dB
+    - links             [esp_rtls_rows] => Rows of the mobiles and their arrays:
+        - bias          [ndarray (rows, n_stations)] => Bias per link in dB
+        - P             [ndarray (rows, n_stations, n_stations)] => Covariance of the bias estimates per mobile
+
+    Methods:
+    - correct(tokenIDs, rssi) => RSSI with the bias of the links removed
+    - update(tokenIDs, rssi, anchors, positions, valid) => RLS update from the solved positions
+    - state() => tokenIDs, bias and P of the known links (for snapshots)
+    - restore(tokenIDs, bias, P) => Continue from a state
+    """
+
+    def __init__(
+        self,
+        n_stations,
+        rssi_at_1_meter=RSSI_AT_1_METER,
+        n=PATH_LOSS_EXPONENT,
+        forgetting=0.995,
+        r=16.0,
+        p_0=25.0,
+        p_max=100.0,
+        max_bias=20.0,
+    ):
+        self.n_stations = n_stations
+        self.rssi_at_1_meter = rssi_at_1_meter
+        self.n = n
+        self.forgetting = forgetting
+        self.r = r
+        self.p_0 = p_0
+        self.p_max = p_max
+        self.max_bias = max_bias
+        self.links = esp_rtls_rows(capacity=8)
+        self.links.add("bias", (n_stations,))
+        self.links.add("P", (n_stations, n_stations), fill=np.eye(n_stations) * p_0)
+
+    def correct(self, tokenIDs, rssi):
+        """
+        Args:
+            tokenIDs  [List] => TokenIDs of the mobiles (M,)
+            rssi      [ndarray (M, K)] => Measured RSSI
+
+        Returns:
+            [ndarray (M, K)] => RSSI minus the bias of the links
+        """
+        rows = self.links.get(tokenIDs)
+        return np.asarray(rssi, dtype=float) - self.links.bias[rows]
+
+    def update(self, tokenIDs, rssi, anchors, positions, valid=None):
+        """
+        Args:
+            tokenIDs   [List] => TokenIDs of the mobiles (M,)
+            rssi       [ndarray (M, K)] => Measured RSSI (not corrected)
+            anchors    [ndarray (K, 2)] => Positions of the stations
+            positions  [ndarray (M, 2)] => Solved positions
+            valid      [ndarray (M,) bool] => Fixes to learn from (e.g. gdop below a threshold)
+        """
+        rows = self.links.get(tokenIDs)
+        positions = np.asarray(positions, dtype=float)
+        delta = positions[:, None, :] - np.asarray(anchors, dtype=float)[None, :, :]
+        distance = np.maximum(np.hypot(delta[..., 0], delta[..., 1]), 0.1)
+        predicted = self.rssi_at_1_meter + 10 * self.n * np.log10(distance)
+        e = np.asarray(rssi, dtype=float) - self.links.bias[rows] - predicted
+
+        ok = np.all(np.isfinite(e), axis=1)
+        if valid is not None:
+            ok &= np.asarray(valid, dtype=bool)
+        if self.n_stations < 3 or not ok.any():
+            return
+        rows, e, delta, distance = rows[ok], e[ok], delta[ok], distance[ok]
+
+        # Left null space of the Jacobian of the RSSI to the position
+        H = delta / distance[..., None] ** 2
+        N = np.linalg.svd(H)[0][:, :, 2:]
+        Nt = N.transpose(0, 2, 1)
+        y = np.einsum("mqk,mk->mq", Nt, e)
+
+        # RLS update
+        P = self.links.P[rows]
+        S = Nt @ P @ N + self.r * np.eye(N.shape[2])
+        G = np.linalg.solve(S, Nt @ P).transpose(0, 2, 1)
+        bias = self.links.bias[rows] + np.einsum("mkq,mq->mk", G, y)
+        P = (P - G @ Nt @ P) / self.forgetting
+        diagonal = np.einsum("mkk->mk", P)
+        scale = np.sqrt(np.maximum(diagonal / self.p_max, 1))
+        P = P / scale[:, :, None] / scale[:, None, :]
+        self.links.bias[rows] = np.clip(bias, -self.max_bias, self.max_bias)
+        self.links.P[rows] = P
+
+    def state(self):
+        """
+        Returns:
+            tokenIDs [ndarray (N,)], bias [ndarray (N, n_stations)], P [ndarray (N, n_stations, n_stations)]
+        """
+        tokenIDs = np.array(list(self.links.rows.keys()), dtype=np.int64)
+        rows = np.array(list(self.links.rows.values()), dtype=np.int64)
+        return tokenIDs, self.links.bias[rows], self.links.P[rows]
+
+    def restore(self, tokenIDs, bias, P):
+        rows = self.links.get(np.asarray(tokenIDs).tolist())
+        self.links.bias[rows] = bias
+        self.links.P[rows] = P
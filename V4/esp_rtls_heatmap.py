@@ -0,0 +1,119 @@
+"""
+Incremental heatmap of where the mobiles spend time, with multi-resolution tiles
+
+Description:
+- Each fix is added to a fixed-resolution NumPy grid (level 0)
+    - Weighted by its uncertainty: weight / (1 + variance / resolution^2)
+      (variance = trace(covariance) / 2, see get_position_covariance)
+    - So fixes that are less precise than a cell count less
+- Coarser levels (cell size x2 per level) are kept up to date with the same fixes
+    - Cell of level k = cell of level 0 >> k, no rebuild needed
+- Optional time decay with a half-life:
+    - Fixes are stored scaled by exp(lambda * (t - t_ref)), reading scales back by exp(-lambda * (t_now - t_ref))
+    - So decay costs nothing per fix; the grids are rescaled only when the scale grows too large
+- Rendering a level costs O(pixels), not O(fixes)
+
+Usage:
+    heatmap = esp_rtls_heatmap(origin=(-10, -10), size=(20, 20), resolution=0.25)
+    heatmap.add(positions, covariance, t)
+    image = heatmap.image(level=2, t=t)
+"""
+
+import math
+import numpy as np
+
+# Rescale the grids when the stored scale exceeds exp(_MAX_EXPONENT)
+_MAX_EXPONENT = 50.0
+
+
+class esp_rtls_heatmap:
+    """
+    Description: Heatmap accumulator with pyramid levels and optional time decay
+
+    Attributes:
+    - origin       [ndarray (2,)] => Position of the lower left corner in m
+    - resolution   [Float] => Cell size of level 0 in m
+    - shape        [Tuple] => (ny, nx) of level 0
+    - levels       [List] => Grids, level k has cell size resolution * 2^k
+    - half_life    [Float] => Half-life of the decay in s (None => no decay)
+
+    Methods:
+    - add(positions, covariance, t, weight) => Add fixes
+    - image(level, t) => Heatmap of a level at time t
+    - reset() => Clear all levels
+    """
+
+    def __init__(self, origin, size, resolution=0.25, n_levels=4, half_life=None):
+        self.origin = np.asarray(origin, dtype=float)
+        self.resolution = resolution
+        nx = int(math.ceil(size[0] / resolution))
+        ny = int(math.ceil(size[1] / resolution))
+        self.shape = (ny, nx)
+        self.levels = [
+            np.zeros(((ny + (1 << k) - 1) >> k, (nx + (1 << k) - 1) >> k))
+            for k in range(n_levels)
+        ]
+        self.half_life = half_life
+        self.__decay = math.log(2) / half_life if half_life else 0.0
+        self.__t_ref = None
+
+    def reset(self):
+        for grid in self.levels:
+            grid[:] = 0
+        self.__t_ref = None
+
+    def add(self, positions, covariance=None, t=0.0, weight=1.0):
+        """
+        Args:
+            positions   [ndarray (M, 2)] => Fixes
+            covariance  [ndarray (M, 2, 2)] => Covariance of the fixes (None => weight only)
+            t           [Float] => Time of the fixes in s (for the decay)
+            weight      [Float or ndarray (M,)] => Weight of the fixes (e.g. time since the previous fix)
+        """
+        positions = np.asarray(positions, dtype=float)
+        w = np.broadcast_to(np.asarray(weight, dtype=float), (len(positions),))
+        if covariance is not None:
+            variance = (covariance[:, 0, 0] + covariance[:, 1, 1]) / 2
+            w = w / (1 + np.nan_to_num(variance, nan=np.inf, posinf=np.inf) / self.resolution ** 2)
+        if self.__decay:
+            w = w * self.__scale(t)
+
+        cell = np.floor((positions - self.origin) / self.resolution).astype(np.int64)
+        ny, nx = self.shape
+        inside = (cell[:, 0] >= 0) & (cell[:, 0] < nx) & (cell[:, 1] >= 0) & (cell[:, 1] < ny) & (w > 0)
+        ix, iy, w = cell[inside, 0], cell[inside, 1], w[inside]
+        for k, grid in enumerate(self.levels):
+            np.add.at(grid, (iy >> k, ix >> k), w)
+
+    def image(self, level=0, t=None):
+        """
+        Args:
+            level  [Integer] => Pyramid level (0 => finest)
+            t      [Float] => Time for the decay (None => time of the last rescale)
+
+        Returns:
+            [ndarray (ny_k, nx_k)] => Weighted time spent per cell, row 0 at the lowest y
+        """
+        grid = self.levels[level]
+        if not self.__decay or self.__t_ref is None or t is None:
+            return grid.copy()
+        return grid * math.exp(-self.__decay * (t - self.__t_ref))
+
+    def extent(self, level=0):
+        """(x_min, x_max, y_min, y_max) of a level, for matplotlib imshow"""
+        ny, nx = self.levels[level].shape
+        cell = self.resolution * (1 << level)
+        return (self.origin[0], self.origin[0] + nx * cell, self.origin[1], self.origin[1] + ny * cell)
+
+    def __scale(self, t):
+        """Scale of a fix at time t relative to t_ref, rescaling the grids if needed"""
+        if self.__t_ref is None:
+            self.__t_ref = t
+        exponent = self.__decay * (t - self.__t_ref)
+        if exponent > _MAX_EXPONENT:
+            factor = math.exp(-exponent)
+            for grid in self.levels:
+                grid *= factor
+            self.__t_ref = t
+            exponent = 0.0
+        return math.exp(exponent)
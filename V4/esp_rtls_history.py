@@ -0,0 +1,243 @@
+"""
+History of the positions of the mobiles, with downsampled trajectory queries
+
+Description:
+- Fixes are appended per mobile to growing arrays (t, x, y), sorted by time
+- Rollup levels are kept up to date while appending:
+    - Level k + 1 keeps one point per block of `factor` points of level k
+    - The point kept is the one with the largest triangle to the first and last point
+      of its block, so corners of the track survive
+    - Level 0 holds all fixes, level k about n / factor^k
+- Query of a mobile and time range with a point budget:
+    - The finest level with at most oversample * budget points in the range is used
+      (two binary searches per level)
+    - That slice is reduced to the budget with Largest-Triangle-Three-Buckets (LTTB)
+      on the (x, y) track, buckets of equal numbers of points
+    - The first and last fix in the range are always kept
+    - So a query costs O(log n + oversample * budget), whatever the length of the range
+- Recordings (CSV, sorted by time): t, tokenID, x, y
+
+Usage:
+    history = esp_rtls_history()
+    history.append(t, tokenIDs, positions)
+    t, xy = history.query(tokenID, t_start, t_end, max_points=1000)
+
+    python esp_rtls_history.py session.csv tokenID [--start T] [--end T] [--points N]
+"""
+
+import argparse
+import csv
+import sys
+import numpy as np
+
+
+def lttb(t, xy, n_out):
+    """
+    Largest-Triangle-Three-Buckets downsampling of a track
+
+    Args:
+        t      [ndarray (N,)] => Time of the points
+        xy     [ndarray (N, 2)] => Positions
+        n_out  [Integer] => Number of points to keep (>= 3)
+
+    Returns:
+        [ndarray (n_out,)] => Indices of the points kept (first and last included)
+    """
+    if n_out < 3:
+        raise ValueError("at least 3 points are needed (first, last and one inner point)")
+    n = len(t)
+    if n_out >= n:
+        return np.arange(n)
+    # Bucket edges of the n - 2 inner points
+    edges = 1 + (np.arange(n_out - 1) * (n - 2)) // (n_out - 2)
+    edges[-1] = n - 1
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = xy[0]
+    for i in range(n_out - 2):
+        start, stop = edges[i], edges[i + 1]
+        # Third vertex: mean of the next bucket (the last point for the last bucket)
+        next_stop = edges[i + 2] if i + 2 < len(edges) else n
+        c = xy[stop:next_stop].mean(axis=0) if next_stop > stop else xy[-1]
+        bucket = xy[start:stop]
+        area = np.abs((a[0] - c[0]) * (bucket[:, 1] - a[1]) - (a[0] - bucket[:, 0]) * (c[1] - a[1]))
+        best = start + int(np.argmax(area))
+        selected[i + 1] = best
+        a = xy[best]
+    return selected
+
+
+class _track:
+    """Growing arrays of one level of one mobile"""
+
+    def __init__(self, capacity=64):
+        self.t = np.empty(capacity)
+        self.xy = np.empty((capacity, 2))
+        self.n = 0
+
+    def extend(self, t, xy):
+        n = self.n + len(t)
+        if n > len(self.t):
+            capacity = max(n, 2 * len(self.t))
+            self.t = np.concatenate([self.t[: self.n], np.empty(capacity - self.n)])
+            self.xy = np.concatenate([self.xy[: self.n], np.empty((capacity - self.n, 2))])
+        self.t[self.n : n] = t
+        self.xy[self.n : n] = xy
+        self.n = n
+
+
+class esp_rtls_history:
+    """
+    Description: Per-mobile position history with rollup levels and LTTB queries
+
+    Attributes:
+    - factor       [Integer] => Points of a level per point of the next level
+    - n_levels     [Integer] => Number of levels (level 0 = all fixes)
+    - oversample   [Integer] => Points per budget point handed to LTTB
+
+    Methods:
+    - append(t, tokenIDs, positions) => Add the fixes of a frame
+    - query(tokenID, t_start, t_end, max_points) => Downsampled track
+    - count(tokenID, t_start, t_end, level) => Number of stored points in a range
+    - tokenIDs() => Mobiles in the history
+    """
+
+    def __init__(self, factor=8, n_levels=6, oversample=4):
+        self.factor = factor
+        self.n_levels = n_levels
+        self.oversample = oversample
+        self.__levels = {}
+        # Points of level k already rolled up into level k + 1, per mobile
+        self.__rolled = {}
+
+    def append(self, t, tokenIDs, positions):
+        """
+        Args:
+            t          [Float or ndarray (M,)] => Time of the fixes in s (not decreasing per mobile)
+            tokenIDs   [List] => TokenIDs of the mobiles (M,)
+            positions  [ndarray (M, 2)] => Positions
+        """
+        t = np.broadcast_to(np.asarray(t, dtype=float), (len(tokenIDs),))
+        positions = np.asarray(positions, dtype=float)
+        for i, tokenID in enumerate(tokenIDs):
+            self.extend(tokenID, t[i : i + 1], positions[i : i + 1])
+
+    def extend(self, tokenID, t, xy):
+        """
+        Args:
+            tokenID  [Integer] => TokenID of the mobile
+            t        [ndarray (N,)] => Time of the fixes, sorted
+            xy       [ndarray (N, 2)] => Positions
+        """
+        levels = self.__levels.get(tokenID)
+        if levels is None:
+            levels = [_track() for _ in range(self.n_levels)]
+            self.__levels[tokenID] = levels
+            self.__rolled[tokenID] = [0] * self.n_levels
+        rolled = self.__rolled[tokenID]
+        levels[0].extend(t, xy)
+        for k in range(self.n_levels - 1):
+            level = levels[k]
+            n_blocks = (level.n - rolled[k]) // self.factor
+            if n_blocks == 0:
+                break
+            stop = rolled[k] + n_blocks * self.factor
+            t_kept, xy_kept = self.__rollup(level.t[rolled[k] : stop], level.xy[rolled[k] : stop])
+            levels[k + 1].extend(t_kept, xy_kept)
+            rolled[k] = stop
+
+    def query(self, tokenID, t_start=-np.inf, t_end=np.inf, max_points=1000):
+        """
+        Args:
+            tokenID     [Integer] => TokenID of the mobile
+            t_start     [Float] => Start of the range in s (included)
+            t_end       [Float] => End of the range in s (included)
+            max_points  [Integer] => Point budget (>= 3)
+
+        Returns:
+            t [ndarray (N,)], xy [ndarray (N, 2)] with N <= max_points
+        """
+        if max_points < 3:
+            raise ValueError("points must be at least 3, got " + str(max_points))
+        levels = self.__levels.get(tokenID)
+        if levels is None:
+            return np.zeros(0), np.zeros((0, 2))
+        first, last = self.__range(levels[0], t_start, t_end)
+        if last == first:
+            return np.zeros(0), np.zeros((0, 2))
+        for level in levels:
+            start, stop = self.__range(level, t_start, t_end)
+            if stop - start <= self.oversample * max_points:
+                break
+        t = level.t[start:stop]
+        xy = level.xy[start:stop]
+        if level is not levels[0]:
+            # The first and last fix of the range are always part of the track
+            t = np.concatenate([levels[0].t[first : first + 1], t, levels[0].t[last - 1 : last]])
+            xy = np.concatenate([levels[0].xy[first : first + 1], xy, levels[0].xy[last - 1 : last]])
+        selected = lttb(t, xy, max_points)
+        return t[selected], xy[selected]
+
+    def count(self, tokenID, t_start=-np.inf, t_end=np.inf, level=0):
+        levels = self.__levels.get(tokenID)
+        if levels is None:
+            return 0
+        start, stop = self.__range(levels[level], t_start, t_end)
+        return stop - start
+
+    def tokenIDs(self):
+        return list(self.__levels.keys())
+
+    def __range(self, level, t_start, t_end):
+        t = level.t[: level.n]
+        return np.searchsorted(t, t_start, side="left"), np.searchsorted(t, t_end, side="right")
+
+    def __rollup(self, t, xy):
+        """One point per block: largest triangle with the first and last point of the block"""
+        blocks = xy.reshape(-1, self.factor, 2)
+        a = blocks[:, :1, :]
+        c = blocks[:, -1:, :]
+        area = np.abs(
+            (a[..., 0] - c[..., 0]) * (blocks[..., 1] - a[..., 1])
+            - (a[..., 0] - blocks[..., 0]) * (c[..., 1] - a[..., 1])
+        )
+        index = np.arange(len(blocks)) * self.factor + np.argmax(area, axis=1)
+        return t[index], xy[index]
+
+
+def load_recording(filename, history=None):
+    """History from a CSV recording: t, tokenID, x, y (sorted by t)"""
+    history = history or esp_rtls_history()
+    per_token = {}
+    with open(filename, newline="") as file:
+        for row in csv.reader(file):
+            if row and not row[0].startswith("t"):
+                per_token.setdefault(int(row[1]), []).append((float(row[0]), float(row[2]), float(row[3])))
+    for tokenID, rows in per_token.items():
+        data = np.array(rows)
+        history.extend(tokenID, data[:, 0], data[:, 1:])
+    return history
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Downsampled trajectory of a mobile from a recording")
+    parser.add_argument("recording", help="CSV: t, tokenID, x, y (sorted by t)")
+    parser.add_argument("tokenID", type=int, help="TokenID of the mobile")
+    parser.add_argument("--start", type=float, default=-np.inf, help="Start of the range in s")
+    parser.add_argument("--end", type=float, default=np.inf, help="End of the range in s")
+    parser.add_argument("--points", type=int, default=1000, help="Point budget (>= 3)")
+    args = parser.parse_args()
+    if args.points < 3:
+        parser.error("--points must be at least 3")
+
+    history = load_recording(args.recording)
+    t, xy = history.query(args.tokenID, args.start, args.end, args.points)
+    writer = csv.writer(sys.stdout)
+    writer.writerow(["t", "tokenID", "x", "y"])
+    for t_i, (x, y) in zip(t.tolist(), xy.tolist()):
+        writer.writerow([t_i, args.tokenID, round(x, 4), round(y, 4)])
+
+
+if __name__ == "__main__":
+    main()
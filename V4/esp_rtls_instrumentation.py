@@ -0,0 +1,144 @@
+"""
+Lightweight latency instrumentation for the host app (app.py)
+
+Description:
+- latency_histogram: fixed log-scale buckets (8 per power of 2) of durations in ns
+    - record() is O(1): a bit_length and a list increment
+    - Percentiles are read from the cumulative bucket counts (at most 12.5 % above the true value)
+- stage_timer: monotonic timestamps at the stage boundaries of the main loop
+    - lap(stage) records the time since the previous boundary into the histogram of the stage
+    - summary() gives count, p50, p99 and max per stage
+
+Usage:
+    timer = stage_timer(["read", "decode"])
+    timer.start()
+    ...read...
+    timer.lap("read")
+    ...decode...
+    timer.lap("decode")
+    print(timer.summary())
+"""
+
+import time
+
+_SUB_BUCKET_BITS = 3
+_SUB_BUCKETS = 1 << _SUB_BUCKET_BITS
+_N_BUCKETS = 64 * _SUB_BUCKETS
+
+
+def _bucket_index(value):
+    """Index of the bucket of a duration in ns (8 buckets per power of 2)"""
+    bits = value.bit_length()
+    if bits <= _SUB_BUCKET_BITS:
+        return value
+    return (bits - _SUB_BUCKET_BITS) * _SUB_BUCKETS + ((value >> (bits - _SUB_BUCKET_BITS - 1)) & (_SUB_BUCKETS - 1))
+
+
+def _bucket_upper(index):
+    """Upper bound in ns of a bucket (inverse of _bucket_index)"""
+    if index < _SUB_BUCKETS:
+        return index
+    octave, sub = divmod(index, _SUB_BUCKETS)
+    shift = octave - 1
+    return ((_SUB_BUCKETS + sub + 1) << shift) - 1
+
+
+class latency_histogram:
+    """
+    Description: Histogram of durations with fixed log-scale buckets
+
+    Attributes:
+    - counts     [List] => Count per bucket
+    - count      [Integer] => Number of recorded durations
+    - total      [Integer] => Sum of the recorded durations in ns
+    - max        [Integer] => Largest recorded duration in ns
+
+    Methods:
+    - record(ns) => Add a duration
+    - percentile(p) => Upper bound of the bucket holding the p-th percentile, in ns
+    - reset() => Clear the histogram
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * _N_BUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, ns):
+        self.counts[_bucket_index(ns)] += 1
+        self.count += 1
+        self.total += ns
+        if ns > self.max:
+            self.max = ns
+
+    def percentile(self, p):
+        if self.count == 0:
+            return 0
+        rank = p / 100 * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank and count:
+                return min(_bucket_upper(index), self.max)
+        return self.max
+
+    def buckets(self):
+        """Non-empty buckets as a list of (upper bound in ns, count)"""
+        return [(_bucket_upper(index), count) for index, count in enumerate(self.counts) if count]
+
+
+class stage_timer:
+    """
+    Description: Per-stage latency histograms of a processing loop
+
+    Attributes:
+    - histograms   [Dictionary] => stage => latency_histogram
+    - interval_s   [Float] => Time between periodic summaries (0 => never due)
+
+    Methods:
+    - start() => Timestamp the start of an iteration
+    - lap(stage) => Record the time since the last timestamp for a stage
+    - due() => True when the periodic summary should be printed
+    - summary() => Text table with count, p50, p99 and max per stage
+    """
+
+    def __init__(self, stages, interval_s=0):
+        self.histograms = {stage: latency_histogram() for stage in stages}
+        self.interval_s = interval_s
+        self.__last = time.perf_counter_ns()
+        self.__next_summary = time.monotonic() + interval_s
+
+    def start(self):
+        self.__last = time.perf_counter_ns()
+
+    def lap(self, stage):
+        now = time.perf_counter_ns()
+        self.histograms[stage].record(now - self.__last)
+        self.__last = now
+
+    def due(self):
+        if self.interval_s <= 0:
+            return False
+        now = time.monotonic()
+        if now < self.__next_summary:
+            return False
+        self.__next_summary = now + self.interval_s
+        return True
+
+    def summary(self):
+        lines = ["{:<10} {:>8} {:>10} {:>10} {:>10}".format("stage", "count", "p50 [us]", "p99 [us]", "max [us]")]
+        for stage, histogram in self.histograms.items():
+            lines.append(
+                "{:<10} {:>8} {:>10.1f} {:>10.1f} {:>10.1f}".format(
+                    stage,
+                    histogram.count,
+                    histogram.percentile(50) / 1000,
+                    histogram.percentile(99) / 1000,
+                    histogram.max / 1000,
+                )
+            )
+        return "\n".join(lines)
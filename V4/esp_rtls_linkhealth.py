@@ -0,0 +1,164 @@
+"""
+Streaming link-health detector: stuck, missing and shifted station-mobile links
+
+Description:
+- A dead or moved station keeps sending frozen or zero RSSI, and app.py keeps solving with it
+- Per link (mobile row x station), in fixed-size arrays, O(1) work per sample and link:
+    - Exponentially weighted Welford mean / variance, long and short window
+    - Run length of identical values, short variance when the run started,
+      time of the last valid (non-zero) value
+- Flags (bits) per link:
+    - STUCK: the same RSSI stuck_samples times in a row, after the link varied by at least
+      stuck_variance (short window) before the run: the variance collapsed
+        - RSSI is an integer: a quiet link (stationary tag, little shadowing) repeats its value
+          often, but then its variance was low already and it is not flagged
+    - MISSING: no valid RSSI for missing_s while the mobile keeps reporting (0 = not received)
+    - SHIFTED: short mean more than shift_sigma standard deviations (of the short mean) from the
+      long mean: step change of the level, e.g. a moved or turned station
+        - Movement of the mobile raises the long variance, so single links rarely trip it
+          and a whole station only when most of its links shift at once
+- A station is excluded when at least exclude_fraction of its links is flagged
+    - Flagged links per station are counted incrementally on flag changes
+- Solvers with more than 3 anchors can skip the excluded ones (mask of esp_rtls_solvercache.py)
+    - app.py has 3 stations and needs all of them for a fix: it only reports the flags
+
+Usage:
+    health = esp_rtls_link_health(n_stations=3)
+    flags, usable = health.update(t, tokenIDs, rssi)
+"""
+
+import numpy as np
+from esp_rtls_rows import esp_rtls_rows, occurrences
+
+# Flag bits
+STUCK = 1
+MISSING = 2
+SHIFTED = 4
+FLAG_NAMES = {STUCK: "stuck", MISSING: "missing", SHIFTED: "shifted"}
+
+
+class esp_rtls_link_health:
+    """
+    Description: Per-link anomaly detection and station exclusion
+
+    Attributes:
+    - n_stations        [Integer] => Number of stations
+    - links             [esp_rtls_rows] => Rows of the mobiles, the statistics and the flags per link:
+        - flags         [ndarray (rows, n_stations) uint8] => Flags per link
+    - usable            [ndarray (n_stations,) bool] => Stations that may be used for solving
+
+    Methods:
+    - update(t, tokenIDs, rssi) => Flags of the links of the samples and the usable stations
+    - report() => Flagged links as (tokenID, station index, [flag names])
+    """
+
+    def __init__(
+        self,
+        n_stations,
+        short_alpha=0.2,
+        long_alpha=0.01,
+        stuck_samples=30,
+        stuck_variance=1.0,
+        missing_s=3.0,
+        shift_sigma=5.0,
+        warmup=20,
+        min_variance=1.0,
+        exclude_fraction=0.5,
+    ):
+        self.n_stations = n_stations
+        self.short_alpha = short_alpha
+        self.long_alpha = long_alpha
+        self.stuck_samples = stuck_samples
+        self.stuck_variance = stuck_variance
+        self.missing_s = missing_s
+        self.shift_sigma = shift_sigma
+        self.warmup = warmup
+        self.min_variance = min_variance
+        self.exclude_fraction = exclude_fraction
+
+        self.links = esp_rtls_rows(capacity=8)
+        for name in ("mean_short", "mean_long", "variance", "variance_short", "run_variance", "last_valid"):
+            self.links.add(name, (n_stations,))
+        self.links.add("count", (n_stations,), dtype=np.int64)
+        self.links.add("last_value", (n_stations,), fill=-1)
+        self.links.add("run", (n_stations,), dtype=np.int64)
+        self.links.add("flags", (n_stations,), dtype=np.uint8)
+        self.__flagged = np.zeros(n_stations, dtype=np.int64)
+        self.usable = np.ones(n_stations, dtype=bool)
+
+    def update(self, t, tokenIDs, rssi):
+        """
+        Args:
+            t         [Float] => Time of the samples in s
+            tokenIDs  [List] => TokenIDs of the mobiles (M,)
+            rssi      [ndarray (M, K)] => RSSI (absolute value, 0 = not received)
+
+        Returns:
+            flags [ndarray (M, K) uint8], usable [ndarray (K,) bool]
+        """
+        n_rows = len(self.links.rows)
+        rows = self.links.get(tokenIDs)
+        # New links start their missing timer now
+        self.links.last_valid[rows[rows >= n_rows]] = t
+        rssi = np.asarray(rssi, dtype=float)
+        for batch in occurrences(rows):
+            self.__update_rows(t, rows[batch], rssi[batch])
+
+        # Station exclusion from the flagged links per station
+        self.usable = self.__flagged < self.exclude_fraction * max(len(self.links.rows), 1)
+        return self.links.flags[rows], self.usable
+
+    def report(self):
+        report = []
+        for tokenID, row in self.links.rows.items():
+            for k in np.nonzero(self.links.flags[row])[0].tolist():
+                flag = int(self.links.flags[row, k])
+                report.append((tokenID, k, [name for bit, name in FLAG_NAMES.items() if flag & bit]))
+        return report
+
+    def __update_rows(self, t, rows, rssi):
+        links = self.links
+        valid = rssi > 0
+
+        # Missing: time since the last valid value
+        last_valid = np.where(valid, t, links.last_valid[rows])
+        links.last_valid[rows] = last_valid
+        missing = t - last_valid > self.missing_s
+
+        # Run length of identical valid values, with the short variance before the run
+        same = valid & (rssi == links.last_value[rows])
+        run = np.where(same, links.run[rows] + 1, np.where(valid, 1, links.run[rows]))
+        run_variance = np.where(valid & ~same, links.variance_short[rows], links.run_variance[rows])
+        links.run[rows] = run
+        links.run_variance[rows] = run_variance
+        links.last_value[rows] = np.where(valid, rssi, links.last_value[rows])
+        stuck = (run >= self.stuck_samples) & (run_variance >= self.stuck_variance)
+
+        # Exponentially weighted Welford statistics of the valid values
+        count = links.count[rows] + valid
+        first = valid & (count == 1)
+        mean_long = links.mean_long[rows]
+        delta = rssi - mean_long
+        alpha_long = np.where(valid, np.maximum(self.long_alpha, 1 / np.maximum(count, 1)), 0)
+        alpha_short = np.where(valid, np.maximum(self.short_alpha, 1 / np.maximum(count, 1)), 0)
+        mean_long = np.where(first, rssi, mean_long + alpha_long * delta)
+        variance = np.where(first, 0, (1 - alpha_long) * (links.variance[rows] + alpha_long * delta ** 2))
+        delta_short = rssi - links.mean_short[rows]
+        mean_short = np.where(first, rssi, links.mean_short[rows] + alpha_short * delta_short)
+        variance_short = np.where(
+            first, 0, (1 - alpha_short) * (links.variance_short[rows] + alpha_short * delta_short ** 2)
+        )
+        links.variance_short[rows] = variance_short
+        links.count[rows] = count
+        links.mean_long[rows] = mean_long
+        links.variance[rows] = variance
+        links.mean_short[rows] = mean_short
+        # Standard deviation of the short mean of independent samples with the long variance
+        sigma_short = np.sqrt(np.maximum(variance, self.min_variance) * self.short_alpha / (2 - self.short_alpha))
+        shifted = (count >= self.warmup) & (np.abs(mean_short - mean_long) > self.shift_sigma * sigma_short)
+
+        flags = (stuck * STUCK | missing * MISSING | shifted * SHIFTED).astype(np.uint8)
+        # Flagged links per station, updated on changes only
+        changed = (flags != 0).astype(np.int64) - (links.flags[rows] != 0)
+        self.__flagged += changed.sum(axis=0)
+        links.flags[rows] = flags
@@ -0,0 +1,284 @@
+"""
+Floorplan-constrained map matching of the fixes from get_position
+
+Description:
+- Floorplan: occupancy raster, True = blocked (wall or outside the building)
+    - Loaded from a .npy file (bool) or an image (dark pixels are blocked)
+    - Described by a JSON file: {"raster": "plan.png", "origin": [x, y], "resolution": 0.05}
+- Precomputed once:
+    - Euclidean distance transform: distance of each cell to the nearest free cell
+    - Nearest free cell of each cell (feature transform)
+    - Summed-area table of the blocked cells
+    - Saved next to the raster (.mapmatch.npz) so the next start is instant
+        - With the shape and a hash of the raster: an edited raster rebuilds the tables
+- Per fix, O(1) table lookups:
+    - snap: infeasible fixes are moved to the nearest free cell, penalty = distance moved
+- Wall-crossing between consecutive fixes:
+    - Segments whose bounding box holds no blocked cell are accepted with one summed-area lookup
+    - The others are checked by sampling the raster along the segment (vectorized)
+    - Transitions through a wall are rejected, the mobile keeps its previous position
+    - Re-anchored to the new fix after max_rejections rejections in a row, or when the last
+      accepted fix is older than reanchor_s (a real long jump or a reconnect would lock the mobile)
+
+Usage:
+    matcher = load_floorplan("floorplan.json")
+    positions, accepted, penalty = matcher.update(tokenIDs, positions)
+"""
+
+import hashlib
+import json
+import os
+import time
+import numpy as np
+
+_INF = float("inf")
+
+
+def _edt_1d(f):
+    """
+    Squared distance transform of a 1D function (Felzenszwalb & Huttenlocher)
+
+    Args:
+        f  [List] => Squared distance per sample (inf => no site)
+
+    Returns:
+        d [List] => min_q (p - q)^2 + f[q], arg [List] => the minimizing q (-1 if none)
+    """
+    n = len(f)
+    sites = [q for q in range(n) if f[q] < _INF]
+    if not sites:
+        return [_INF] * n, [-1] * n
+    v = [0] * len(sites)
+    z = [0.0] * (len(sites) + 1)
+    k = 0
+    v[0] = sites[0]
+    z[0] = -_INF
+    z[1] = _INF
+    for q in sites[1:]:
+        fq = f[q] + q * q
+        s = (fq - (f[v[k]] + v[k] * v[k])) / (2 * q - 2 * v[k])
+        while s <= z[k]:
+            k -= 1
+            s = (fq - (f[v[k]] + v[k] * v[k])) / (2 * q - 2 * v[k])
+        k += 1
+        v[k] = q
+        z[k] = s
+        z[k + 1] = _INF
+    d = [0.0] * n
+    arg = [0] * n
+    k = 0
+    for p in range(n):
+        while z[k + 1] < p:
+            k += 1
+        d[p] = (p - v[k]) ** 2 + f[v[k]]
+        arg[p] = v[k]
+    return d, arg
+
+
+def distance_transform(blocked):
+    """
+    Exact Euclidean distance transform to the nearest free cell, with its index
+
+    Args:
+        blocked  [ndarray (ny, nx) bool] => Occupancy raster
+
+    Returns:
+        distance [ndarray (ny, nx)] in cells, nearest [ndarray (ny, nx) int] flat index of the nearest free cell
+    """
+    ny, nx = blocked.shape
+
+    # Pass 1: nearest free cell in the same column (vectorized over the columns)
+    row_of = np.full((ny, nx), -1, dtype=np.int64)
+    last = np.full(nx, -1, dtype=np.int64)
+    for y in range(ny):
+        last = np.where(~blocked[y], y, last)
+        row_of[y] = last
+    last = np.full(nx, -1, dtype=np.int64)
+    rows = np.arange(ny)
+    for y in range(ny - 1, -1, -1):
+        last = np.where(~blocked[y], y, last)
+        better = (last >= 0) & ((row_of[y] < 0) | (last - y < y - row_of[y]))
+        row_of[y] = np.where(better, last, row_of[y])
+    g = np.where(row_of >= 0, (rows[:, None] - row_of).astype(float) ** 2, _INF)
+
+    # Pass 2: lower envelope along the rows
+    distance = np.empty((ny, nx))
+    nearest = np.empty((ny, nx), dtype=np.int64)
+    for y in range(ny):
+        d, arg = _edt_1d(g[y].tolist())
+        arg = np.array(arg)
+        distance[y] = np.sqrt(d)
+        nearest[y] = np.where(arg >= 0, row_of[y, np.maximum(arg, 0)] * nx + arg, -1)
+    return distance, nearest
+
+
+def load_raster(filename):
+    """Occupancy raster from a .npy file or an image, row 0 at the lowest y"""
+    if filename.endswith(".npy"):
+        return np.load(filename).astype(bool)
+    import matplotlib.image
+
+    image = matplotlib.image.imread(filename)
+    if image.ndim == 3:
+        image = image[..., :3].mean(axis=2)
+    if image.dtype == np.uint8:
+        image = image / 255
+    # Images have row 0 at the top
+    return (image < 0.5)[::-1]
+
+
+def load_floorplan(filename, **kwargs):
+    """
+    Map matcher from a floorplan JSON file
+
+    Args:
+        filename  [String] => {"raster": "plan.png", "origin": [x, y], "resolution": 0.05}
+        kwargs    => Passed on to esp_rtls_mapmatch
+    """
+    with open(filename) as file:
+        config = json.load(file)
+    raster = os.path.join(os.path.dirname(filename), config["raster"])
+    return esp_rtls_mapmatch(
+        load_raster(raster), config.get("origin", [0, 0]), config.get("resolution", 0.05),
+        cache=raster + ".mapmatch.npz", **kwargs
+    )
+
+
+class esp_rtls_mapmatch:
+    """
+    Description: Snaps fixes to free space and rejects transitions through walls
+
+    Attributes:
+    - blocked      [ndarray (ny, nx) bool] => Occupancy raster
+    - origin       [ndarray (2,)] => Position of cell (0, 0) in m
+    - resolution   [Float] => Cell size in m
+    - max_jump     [Float] => Longer transitions between fixes are rejected in m
+    - max_rejections  [Integer] => Rejections in a row after which the new fix is accepted
+    - reanchor_s   [Float] => Seconds after the last accepted fix after which the new fix is accepted
+
+    Methods:
+    - snap(positions) => Fixes moved to free space and their penalty
+    - crosses_wall(start, end) => True for segments through a blocked cell
+    - update(tokenIDs, positions, t) => Snap + wall-crossing rejection against the previous fix
+    """
+
+    def __init__(
+        self, blocked, origin=(0, 0), resolution=0.05, max_jump=5.0, max_rejections=5, reanchor_s=10.0, cache=None
+    ):
+        self.blocked = np.asarray(blocked, dtype=bool)
+        self.origin = np.asarray(origin, dtype=float)
+        self.resolution = resolution
+        self.max_jump = max_jump
+        self.max_rejections = max_rejections
+        self.reanchor_s = reanchor_s
+        # tokenID => (last matched position, time of the last accepted fix, rejections in a row)
+        self.__last = {}
+
+        digest = hashlib.sha1(np.packbits(self.blocked).tobytes()).hexdigest()
+        tables = None
+        if cache and os.path.exists(cache):
+            tables = np.load(cache)
+            if (
+                "shape" not in tables
+                or tuple(tables["shape"]) != self.blocked.shape
+                or str(tables["digest"]) != digest
+            ):
+                tables = None
+        if tables is not None:
+            distance, nearest = tables["distance"], tables["nearest"]
+        else:
+            distance, nearest = distance_transform(self.blocked)
+            if cache:
+                np.savez_compressed(
+                    cache, distance=distance, nearest=nearest, shape=self.blocked.shape, digest=digest
+                )
+        self.__distance = (distance * resolution).astype(np.float32)
+        self.__nearest = nearest
+
+        # Summed-area table of blocked cells, with a zero row and column in front
+        self.__sat = np.zeros((self.blocked.shape[0] + 1, self.blocked.shape[1] + 1), dtype=np.int64)
+        self.__sat[1:, 1:] = self.blocked.cumsum(axis=0).cumsum(axis=1)
+
+    def snap(self, positions):
+        """
+        Args:
+            positions  [ndarray (M, 2)] => Fixes
+
+        Returns:
+            snapped [ndarray (M, 2)], penalty [ndarray (M,)] distance to free space in m
+        """
+        positions = np.asarray(positions, dtype=float)
+        ix, iy = self.__cells(positions)
+        penalty = self.__distance[iy, ix]
+        nearest = self.__nearest[iy, ix]
+        nx = self.blocked.shape[1]
+        centre = self.origin + (np.stack([nearest % nx, nearest // nx], axis=1) + 0.5) * self.resolution
+        infeasible = self.blocked[iy, ix] | ~self.__on_raster(positions)
+        snapped = np.where(infeasible[:, None] & (nearest[:, None] >= 0), centre, positions)
+        return snapped, np.where(infeasible, np.maximum(penalty, np.hypot(*(snapped - positions).T)), 0.0)
+
+    def crosses_wall(self, start, end):
+        """
+        Args:
+            start  [ndarray (M, 2)] => Previous fixes
+            end    [ndarray (M, 2)] => New fixes
+
+        Returns:
+            [ndarray (M,) bool] => True if the segment passes a blocked cell or is longer than max_jump
+        """
+        start = np.asarray(start, dtype=float)
+        end = np.asarray(end, dtype=float)
+        ix0, iy0 = self.__cells(start)
+        ix1, iy1 = self.__cells(end)
+        x_lo, x_hi = np.minimum(ix0, ix1), np.maximum(ix0, ix1) + 1
+        y_lo, y_hi = np.minimum(iy0, iy1), np.maximum(iy0, iy1) + 1
+        n_blocked = self.__sat[y_hi, x_hi] - self.__sat[y_lo, x_hi] - self.__sat[y_hi, x_lo] + self.__sat[y_lo, x_lo]
+
+        length = np.hypot(*(end - start).T)
+        crosses = length > self.max_jump
+        check = np.nonzero((n_blocked > 0) & ~crosses)[0]
+        if len(check):
+            n_samples = int(np.ceil(length[check].max() / (self.resolution / 2))) + 2
+            t = np.linspace(0, 1, n_samples)
+            samples = start[check, None, :] + (end[check] - start[check])[:, None, :] * t[None, :, None]
+            sx, sy = self.__cells(samples.reshape(-1, 2))
+            crosses[check] = self.blocked[sy, sx].reshape(len(check), n_samples).any(axis=1)
+        return crosses
+
+    def update(self, tokenIDs, positions, t=None):
+        """
+        Args:
+            tokenIDs   [List] => TokenIDs of the mobiles
+            positions  [ndarray (M, 2)] => Fixes from get_position
+            t          [Float] => Time of the fixes in s (default: time.monotonic())
+
+        Returns:
+            positions [ndarray (M, 2)], accepted [ndarray (M,) bool], penalty [ndarray (M,)]
+        """
+        if t is None:
+            t = time.monotonic()
+        snapped, penalty = self.snap(positions)
+        last = [self.__last.get(tokenID, (xy, t, 0)) for tokenID, xy in zip(tokenIDs, snapped.tolist())]
+        previous = np.array([xy for xy, _, _ in last]).reshape(-1, 2)
+        t_accepted = np.array([t_last for _, t_last, _ in last])
+        rejections = np.array([n for _, _, n in last], dtype=np.int64)
+
+        accepted = ~self.crosses_wall(previous, snapped)
+        # Re-anchor mobiles that would otherwise stay locked to a stale position
+        accepted |= (rejections >= self.max_rejections) | (t - t_accepted > self.reanchor_s)
+        matched = np.where(accepted[:, None], snapped, previous)
+        t_accepted = np.where(accepted, t, t_accepted)
+        rejections = np.where(accepted, 0, rejections + 1)
+        for tokenID, xy, t_last, n in zip(tokenIDs, matched.tolist(), t_accepted.tolist(), rejections.tolist()):
+            self.__last[tokenID] = (xy, t_last, n)
+        return matched, accepted, penalty
+
+    def __cells(self, positions):
+        cell = np.floor((positions - self.origin) / self.resolution).astype(np.int64)
+        ny, nx = self.blocked.shape
+        return np.clip(cell[:, 0], 0, nx - 1), np.clip(cell[:, 1], 0, ny - 1)
+
+    def __on_raster(self, positions):
+        cell = np.floor((positions - self.origin) / self.resolution)
+        ny, nx = self.blocked.shape
+        return (cell[:, 0] >= 0) & (cell[:, 0] < nx) & (cell[:, 1] >= 0) & (cell[:, 1] < ny)
@@ -0,0 +1,126 @@
+"""
+Metrics of the host app in the Prometheus text exposition format
+
+Description:
+- Counters: plain integers in a dictionary keyed by (name, label value)
+    - inc() is one dictionary update, no lock (one writer: the main loop)
+- Histograms: latency_histogram (esp_rtls_instrumentation.py), O(1) record()
+    - Exported with fixed power of 2 bucket bounds (1 us .. 16 s), which are exact
+      bucket boundaries of latency_histogram
+        - A latency_histogram bucket starts at 2^k ns, so le (<=) is 2^k - 1 ns
+- Gauges: functions that are evaluated when the metrics are scraped, so they cost
+  nothing on the hot path (e.g. number of stale mobiles)
+- render() builds the text format, handle() can be added as a route of esp_rtls_api
+
+Usage:
+    metrics = esp_rtls_metrics()
+    metrics.inc("esp_rtls_lines_total")
+    metrics.histogram("esp_rtls_cycle_seconds").record(ns)
+    api.add_route("/metrics", metrics.handle)
+"""
+
+from esp_rtls_instrumentation import latency_histogram, _bucket_index
+
+# Bucket bounds of the exported histograms: 2^10 .. 2^34 ns
+_BOUNDS_NS = [1 << k for k in range(10, 35, 2)]
+
+
+class esp_rtls_metrics:
+    """
+    Description: Registry of counters, histograms and gauges
+
+    Methods:
+    - describe(name, kind, help) => Type and help text of a metric
+    - inc(name, label, value) => Add to a counter
+    - histogram(name, label) => latency_histogram of a metric (created on first use)
+    - add_histogram(name, histogram, label) => Export an existing latency_histogram
+    - gauge(name, function) => function() returns a value or a dictionary label => value
+    - render() => Prometheus text format
+    - handle(query) => Route for esp_rtls_api
+    """
+
+    def __init__(self, label_name="tokenID"):
+        self.label_name = label_name
+        self.__help = {}
+        self.__counters = {}
+        self.__histograms = {}
+        self.__gauges = {}
+
+    def describe(self, name, kind, help):
+        self.__help[name] = (kind, help)
+
+    def inc(self, name, label=None, value=1):
+        key = (name, label)
+        self.__counters[key] = self.__counters.get(key, 0) + value
+
+    def histogram(self, name, label=None):
+        key = (name, label)
+        histogram = self.__histograms.get(key)
+        if histogram is None:
+            histogram = self.__histograms[key] = latency_histogram()
+        return histogram
+
+    def add_histogram(self, name, histogram, label=None):
+        self.__histograms[(name, label)] = histogram
+
+    def gauge(self, name, function):
+        self.__gauges[name] = function
+
+    def render(self):
+        lines = []
+        described = set()
+
+        def header(name, kind):
+            if name not in described:
+                described.add(name)
+                lines.append("# HELP " + name + " " + self.__help.get(name, (kind, name))[1])
+                lines.append("# TYPE " + name + " " + self.__help.get(name, (kind, name))[0])
+
+        for (name, label), value in sorted(list(self.__counters.items()), key=_sort_key):
+            header(name, "counter")
+            lines.append(name + self.__labels(label) + " " + str(value))
+
+        for (name, label), histogram in sorted(list(self.__histograms.items()), key=_sort_key):
+            header(name, "histogram")
+            counts = list(histogram.counts)
+            cumulative = 0
+            start = 0
+            for bound in _BOUNDS_NS:
+                # Buckets up to bound - 1 ns (bound is the first value of a bucket): le = bound - 1 ns
+                stop = _bucket_index(bound)
+                cumulative += sum(counts[start:stop])
+                start = stop
+                le = repr((bound - 1) / 1e9)
+                lines.append(name + "_bucket" + self.__labels(label, le=le) + " " + str(cumulative))
+            total = sum(counts)
+            lines.append(name + "_bucket" + self.__labels(label, le="+Inf") + " " + str(total))
+            lines.append(name + "_sum" + self.__labels(label) + " " + repr(histogram.total / 1e9))
+            lines.append(name + "_count" + self.__labels(label) + " " + str(total))
+
+        for name, function in list(self.__gauges.items()):
+            header(name, "gauge")
+            values = function()
+            if not isinstance(values, dict):
+                values = {None: values}
+            for label, value in values.items():
+                lines.append(name + self.__labels(label) + " " + repr(float(value)))
+        return "\n".join(lines) + "\n"
+
+    def handle(self, query):
+        return 200, "text/plain; version=0.0.4", self.render().encode("utf-8")
+
+    def __labels(self, label, le=None):
+        labels = []
+        if label is not None:
+            if isinstance(label, tuple):
+                labels.append(label[0] + '="' + str(label[1]) + '"')
+            else:
+                labels.append(self.label_name + '="' + str(label) + '"')
+        if le is not None:
+            labels.append('le="' + le + '"')
+        return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def _sort_key(item):
+    name, label = item[0]
+    return name, str(label)
@@ -0,0 +1,157 @@
+"""
+Incremental dwell-time and occupancy aggregator, fed by the position stream
+
+Description:
+- Input per frame: tokenIDs and (mobile index, zone index) membership pairs
+    - As returned by esp_rtls_zone_engine.classify
+- The time since the previous fix of a mobile is credited to the zones it was in
+    - Gaps longer than max_gap are not credited, and mobiles not seen for max_gap leave their zones
+- All state is kept in arrays (tags x n_zones), grown by doubling when a new tag arrives
+    - Current occupancy per zone
+    - Sliding window: ring of n_buckets buckets + running sum (the oldest bucket is subtracted on rotation)
+    - Tumbling window: accumulator of the current window + copy of the last completed window
+- Queries are O(1) array lookups, independent of the length of the history
+- Tags in a zone are kept in order of their last fix, so the stale ones are found at the front
+  without scanning all tags
+
+Usage:
+    occupancy = esp_rtls_occupancy(n_zones=len(engine.names))
+    occupancy.update(t, tokenIDs, *engine.classify(positions))
+    occupancy.dwell(tokenID, zone)
+"""
+
+import numpy as np
+from esp_rtls_rows import esp_rtls_rows
+
+
+class esp_rtls_occupancy:
+    """
+    Description: Per-zone occupancy and per-(tag, zone) dwell time over rolling windows
+
+    Attributes:
+    - n_zones      [Integer] => Number of zones
+    - capacity     [Integer] => Initial capacity of tags (tokenIDs), doubled when full
+    - window_s     [Float] => Length of the sliding window in s
+    - tumbling_s   [Float] => Length of the tumbling window in s
+    - max_gap      [Float] => Longest time between fixes that is credited in s
+
+    Methods:
+    - update(t, tokenIDs, mobile, zone) => Add a frame
+    - occupancy(zone) => Number of tags in the zone now
+    - mean_occupancy(zone) => Mean number of tags in the zone over the sliding window
+    - dwell(tokenID, zone) => Time of the tag in the zone over the sliding window
+    - tumbling_dwell(tokenID, zone, previous) => Time in the zone in the current (or last completed) tumbling window
+    """
+
+    def __init__(self, n_zones, capacity=64, window_s=300.0, n_buckets=30, tumbling_s=3600.0, max_gap=10.0):
+        self.n_zones = n_zones
+        self.capacity = capacity
+        self.window_s = window_s
+        self.tumbling_s = tumbling_s
+        self.max_gap = max_gap
+        # Rows of the tags in at least one zone, oldest fix first (dict keeps insertion order)
+        self.__members = {}
+        self.__bucket_s = window_s / n_buckets
+
+        self.__state = esp_rtls_rows(capacity)
+        self.__state.add("member", (n_zones,), dtype=bool)
+        self.__state.add("last_t", fill=np.nan)
+        self.__occupancy = np.zeros(n_zones, dtype=np.int32)
+
+        self.__state.add("buckets", (n_buckets, n_zones), dtype=np.float32, axis=1)
+        self.__state.add("dwell", (n_zones,), dtype=np.float32)
+        self.__zone_buckets = np.zeros((n_buckets, n_zones))
+        self.__zone_seconds = np.zeros(n_zones)
+        self.__bucket = 0
+        self.__bucket_end = None
+
+        self.__state.add("tumbling", (n_zones,), dtype=np.float32)
+        self.__state.add("tumbling_last", (n_zones,), dtype=np.float32)
+        self.__tumbling_end = None
+
+    def update(self, t, tokenIDs, mobile, zone):
+        """
+        Args:
+            t         [Float] => Time of the frame in s
+            tokenIDs  [List] => TokenIDs of the mobiles in the frame
+            mobile    [ndarray (P,)] => Index into tokenIDs of each membership pair
+            zone      [ndarray (P,)] => Zone index of each membership pair
+        """
+        self.__advance(t)
+        rows = self.__state.get(tokenIDs)
+
+        # Credit the time since the previous fix to the zones the tags were in
+        dt = t - self.__state.last_t[rows]
+        dt = np.where(np.isnan(dt) | (dt < 0) | (dt > self.max_gap), 0, dt)
+        member = self.__state.member[rows]
+        credit = member * dt[:, None].astype(np.float32)
+        self.__state.buckets[self.__bucket, rows] += credit
+        self.__state.dwell[rows] += credit
+        self.__state.tumbling[rows] += credit
+        zone_credit = credit.sum(axis=0)
+        self.__zone_buckets[self.__bucket] += zone_credit
+        self.__zone_seconds += zone_credit
+
+        # New membership
+        new_member = np.zeros_like(member)
+        new_member[np.asarray(mobile, dtype=np.int64), np.asarray(zone, dtype=np.int64)] = True
+        self.__occupancy += new_member.sum(axis=0, dtype=np.int32) - member.sum(axis=0, dtype=np.int32)
+        self.__state.member[rows] = new_member
+        self.__state.last_t[rows] = t
+        for row, inside in zip(rows.tolist(), new_member.any(axis=1).tolist()):
+            self.__members.pop(row, None)
+            if inside:
+                self.__members[row] = None
+
+        # Tags that were not seen for max_gap leave their zones
+        for row in list(self.__members):
+            if t - self.__state.last_t[row] <= self.max_gap:
+                break
+            del self.__members[row]
+            self.__occupancy -= self.__state.member[row].astype(np.int32)
+            self.__state.member[row] = False
+
+    def occupancy(self, zone):
+        return int(self.__occupancy[zone])
+
+    def mean_occupancy(self, zone):
+        return float(self.__zone_seconds[zone] / self.window_s)
+
+    def dwell(self, tokenID, zone):
+        row = self.__state.rows.get(tokenID)
+        return 0.0 if row is None else float(self.__state.dwell[row, zone])
+
+    def tumbling_dwell(self, tokenID, zone, previous=False):
+        row = self.__state.rows.get(tokenID)
+        if row is None:
+            return 0.0
+        return float((self.__state.tumbling_last if previous else self.__state.tumbling)[row, zone])
+
+    def __advance(self, t):
+        """Rotate the sliding buckets and the tumbling window up to time t"""
+        if self.__bucket_end is None:
+            self.__bucket_end = t + self.__bucket_s
+            self.__tumbling_end = t + self.tumbling_s
+            return
+
+        n_buckets = len(self.__state.buckets)
+        rotations = 0
+        while t >= self.__bucket_end and rotations < n_buckets:
+            self.__bucket = (self.__bucket + 1) % n_buckets
+            self.__state.dwell -= self.__state.buckets[self.__bucket]
+            self.__zone_seconds -= self.__zone_buckets[self.__bucket]
+            self.__state.buckets[self.__bucket] = 0
+            self.__zone_buckets[self.__bucket] = 0
+            self.__bucket_end += self.__bucket_s
+            rotations += 1
+        if t >= self.__bucket_end:
+            # Longer gap than the window: everything has expired
+            self.__state.dwell[:] = 0
+            self.__zone_seconds[:] = 0
+            self.__bucket_end = t + self.__bucket_s
+
+        if t >= self.__tumbling_end:
+            completed = t < self.__tumbling_end + self.tumbling_s
+            self.__state.tumbling_last[:] = self.__state.tumbling if completed else 0
+            self.__state.tumbling[:] = 0
+            self.__tumbling_end += self.tumbling_s * (1 + (t - self.__tumbling_end) // self.tumbling_s)
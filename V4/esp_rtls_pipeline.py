@@ -0,0 +1,299 @@
+"""
+Multiprocess ingest / solve / render pipeline over shared memory ring buffers
+
+Description:
+- app.py does everything on one thread; here each stage is its own process:
+    - ingest: reads and parses the lines of the COM port => RSSI records
+    - solve: distances, moving average per mobile and trilateration, batched => position records
+    - render: plots, prints and/or publishes (esp_rtls_api) the positions
+- The stages are connected by esp_rtls_ring (shared memory, single producer / single consumer)
+    - Fixed-size NumPy records, no pickling
+    - A full ring drops records instead of blocking: a render stall never blocks solving,
+      and a solve stall never blocks reading the COM port
+- The solver processes all waiting records at once, vectorized (esp_rtls_solver)
+- Same processing as app.py: get_distance(rssi, 58, 2.5), moving average with the previous
+  distances of the mobile, fixes only if the 3 distances are not 0
+
+Usage:
+    python esp_rtls_pipeline.py [port] [--render plot|print|none] [--api PORT] [--resample HZ [--delay S]]
+    - port: COM port or pyserial URL (default: COM3), e.g. socket://localhost:7777
+    - --resample: render all mobiles on a fixed clock (esp_rtls_resampler.py)
+        - print: tokenID, tick, x, y, extrapolated
+        - plot: the resampled positions instead of the last fixes
+        - The API (--api) keeps serving the fixes, with their covariance
+"""
+
+import argparse
+import signal
+import time
+import numpy as np
+import multiprocessing
+from esp_rtls_positioning import (
+    RSSI_AT_1_METER,
+    PATH_LOSS_EXPONENT,
+    calc_anchor_position,
+    distance_sigma,
+    get_distance,
+    get_position_covariance,
+    parse_line,
+)
+from esp_rtls_ring import esp_rtls_ring
+from esp_rtls_rows import esp_rtls_rows, occurrences
+from esp_rtls_solvercache import esp_rtls_solver_cache
+
+# Record types of the rings
+RSSI_RECORD = np.dtype([("t", "f8"), ("tokenID", "i8"), ("rssi", "f4", (3,))])
+POSITION_RECORD = np.dtype(
+    [
+        ("t", "f8"),
+        ("tokenID", "i8"),
+        ("position", "f8", (2,)),
+        ("covariance", "f8", (2, 2)),
+        ("gdop", "f8"),
+        ("rssi", "f4", (3,)),
+    ]
+)
+
+
+class esp_rtls_solver:
+    """
+    Description: Batched version of the solve stage of app.py
+
+    Attributes:
+    - anchors      [ndarray (3, 2)] => Positions of the stations
+    - rssi_sigma   [Float] => RSSI noise in dB, for the covariance
+
+    Methods:
+    - solve(records) => Position records of an array of RSSI records
+    - state() => tokenIDs and last filtered distances (to move the solver to another process)
+    - restore(tokenIDs, d_last) => Continue from a state
+    """
+
+    def __init__(self, anchors, rssi_at_1_meter=RSSI_AT_1_METER, n=PATH_LOSS_EXPONENT, rssi_sigma=2.0):
+        self.anchors = np.asarray(anchors, dtype=float)
+        self.rssi_at_1_meter = rssi_at_1_meter
+        self.n = n
+        self.rssi_sigma = rssi_sigma
+        self.__state = esp_rtls_rows(capacity=64)
+        self.__state.add("d_last", (3,))
+        self.__cache = esp_rtls_solver_cache(self.anchors)
+
+    def solve(self, records):
+        """
+        Args:
+            records  [ndarray of RSSI_RECORD] => In order of arrival
+
+        Returns:
+            [ndarray of POSITION_RECORD] => Fixes of the records with 3 distances
+        """
+        rows = self.__state.get(records["tokenID"].tolist())
+        d = get_distance(records["rssi"].astype(float), self.rssi_at_1_meter, self.n)
+
+        # Moving average per mobile, in order: a mobile may occur more than once in a batch
+        for batch in occurrences(rows):
+            d[batch] = (d[batch] + self.__state.d_last[rows[batch]]) / 2
+            self.__state.d_last[rows[batch]] = d[batch]
+
+        valid = np.all(d != 0, axis=1)
+        positions = self.__cache.solve(d[valid])
+        sigma_d = distance_sigma(d[valid], self.rssi_sigma, self.n)
+        covariance, gdop = get_position_covariance(self.anchors, positions, sigma_d)
+
+        out = np.empty(int(valid.sum()), dtype=POSITION_RECORD)
+        out["t"] = records["t"][valid]
+        out["tokenID"] = records["tokenID"][valid]
+        out["position"] = positions
+        out["covariance"] = covariance
+        out["gdop"] = gdop
+        out["rssi"] = records["rssi"][valid]
+        return out
+
+    def state(self):
+        tokenIDs = np.array(list(self.__state.rows.keys()), dtype=np.int64)
+        rows = np.array(list(self.__state.rows.values()), dtype=np.int64)
+        return tokenIDs, self.__state.d_last[rows]
+
+    def restore(self, tokenIDs, d_last):
+        rows = self.__state.get(np.asarray(tokenIDs).tolist())
+        self.__state.d_last[rows] = d_last
+
+
+def _ignore_interrupt():
+    # Ctrl+C goes to the whole process group, the main process stops the stages
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _terminate(signum, frame):
+    raise KeyboardInterrupt
+
+
+def ingest(port, ring_name, capacity, stop, batch_size=64, batch_s=0.01):
+    """Stage 1: COM port => RSSI records"""
+    import serial
+
+    _ignore_interrupt()
+    ring = esp_rtls_ring(RSSI_RECORD, capacity, ring_name)
+    ser = serial.serial_for_url(port, 115200, timeout=0.1)
+    ser.reset_input_buffer()
+    batch = np.empty(batch_size, dtype=RSSI_RECORD)
+    n = 0
+    n_lines = 0
+    n_errors = 0
+    buffer = bytearray()
+    deadline = time.monotonic() + batch_s
+    while not stop.is_set():
+        # readline() returns part of a line on timeout: keep the rest until its "\n" arrives
+        buffer += ser.read(max(ser.in_waiting, 1))
+        *complete, rest = buffer.split(b"\n")
+        buffer[:] = rest
+        for line in complete:
+            n_lines += 1
+            if line.endswith(b"\r"):
+                line = line[:-1]
+            try:
+                parsed = parse_line(line.decode("utf-8"))
+            except ValueError:
+                parsed = None
+                n_errors += 1
+            if parsed is not None:
+                batch[n] = (time.time(), parsed[0], parsed[1:])
+                n += 1
+                if n == batch_size:
+                    ring.push(batch[:n])
+                    n = 0
+        if n and time.monotonic() >= deadline:
+            ring.push(batch[:n])
+            n = 0
+        if n == 0:
+            deadline = time.monotonic() + batch_s
+    ser.close()
+    print("ingest: lines =", n_lines, "decode errors =", n_errors, "dropped =", ring.dropped)
+    ring.close()
+
+
+def solve(in_name, out_name, capacity, stop, anchors, rssi_sigma):
+    """Stage 2: RSSI records => position records"""
+    _ignore_interrupt()
+    ring_in = esp_rtls_ring(RSSI_RECORD, capacity, in_name)
+    ring_out = esp_rtls_ring(POSITION_RECORD, capacity, out_name)
+    solver = esp_rtls_solver(anchors, rssi_sigma=rssi_sigma)
+    n_fixes = 0
+    while not stop.is_set():
+        records = ring_in.pop()
+        if len(records) == 0:
+            time.sleep(0.001)
+            continue
+        fixes = solver.solve(records)
+        n_fixes += len(fixes)
+        ring_out.push(fixes)
+    print("solve: fixes =", n_fixes, "dropped =", ring_out.dropped)
+    ring_in.close()
+    ring_out.close()
+
+
+def render(in_name, capacity, stop, mode, anchors, api_port=0, resample=0, delay=0.0, refresh_s=0.1):
+    """Stage 3: position records => plot, stdout and/or HTTP API"""
+    _ignore_interrupt()
+    ring = esp_rtls_ring(POSITION_RECORD, capacity, in_name)
+    resampler = None
+    if resample:
+        from esp_rtls_resampler import esp_rtls_resampler
+
+        resampler = esp_rtls_resampler(resample, delay)
+    state_index = None
+    if api_port:
+        from esp_rtls_api import esp_rtls_state_index, esp_rtls_api
+
+        state_index = esp_rtls_state_index()
+        esp_rtls_api(state_index, port=api_port).start()
+    if mode == "plot":
+        import matplotlib.pyplot as plt
+
+        fig = plt.figure()
+        ax = fig.add_subplot(111)
+    latest = {}
+    next_refresh = time.monotonic()
+    while not stop.is_set():
+        fixes = ring.pop()
+        if len(fixes) == 0:
+            time.sleep(0.001)
+        if resampler is not None:
+            # Fixed clock: all mobiles per tick, extrapolated samples flagged
+            resampler.update(fixes["t"], fixes["tokenID"].tolist(), fixes["position"])
+            for tick in resampler.ticks(time.time()):
+                tokenIDs, positions, extrapolated = resampler.sample(tick)
+                if mode == "print":
+                    for tokenID, (x, y), flag in zip(tokenIDs.tolist(), positions.tolist(), extrapolated.tolist()):
+                        print(tokenID, round(tick, 3), x, y, int(flag))
+                elif mode == "plot":
+                    latest.update(zip(tokenIDs.tolist(), positions.tolist()))
+        elif mode == "print":
+            for fix in fixes:
+                print(fix["tokenID"], fix["t"], fix["position"][0], fix["position"][1], fix["gdop"])
+        if state_index is not None and len(fixes):
+            state_index.update(
+                fixes["tokenID"].tolist(), fixes["position"], fixes["covariance"], fixes["rssi"], fixes["t"][-1]
+            )
+        if mode == "plot":
+            if resampler is None:
+                latest.update(zip(fixes["tokenID"].tolist(), fixes["position"].tolist()))
+            if time.monotonic() >= next_refresh and latest:
+                next_refresh = time.monotonic() + refresh_s
+                ax.clear()
+                ax.grid()
+                ax.set_aspect("equal")
+                ax.scatter(anchors[:, 0], anchors[:, 1], c="r", marker="o")
+                positions = np.array(list(latest.values()))
+                ax.scatter(positions[:, 0], positions[:, 1], c="black", marker="o")
+                plt.pause(0.001)
+    ring.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest, solve and render in separate processes")
+    parser.add_argument("port", nargs="?", default="COM3", help="COM port or pyserial URL")
+    parser.add_argument("--render", choices=["plot", "print", "none"], default="plot", help="Output of the render stage")
+    parser.add_argument("--api", type=int, default=0, help="Port of the local HTTP API (0 => off)")
+    parser.add_argument("--rssi-sigma", type=float, default=2.0, help="RSSI noise in dB")
+    parser.add_argument("--capacity", type=int, default=4096, help="Records per ring buffer")
+    parser.add_argument("--resample", type=float, default=0, help="Output all mobiles at this rate in Hz (0 => off)")
+    parser.add_argument("--delay", type=float, default=0.0, help="Delay of the resampled output in s")
+    args = parser.parse_args()
+    if args.resample and args.render == "none":
+        parser.error("--resample needs --render plot or print")
+
+    x2, y2, x3, y3 = calc_anchor_position(0, 0, 6, 6, 6)
+    anchors = np.array([[0, 0], [x2, y2], [x3, y3]])
+
+    ring_rssi = esp_rtls_ring(RSSI_RECORD, args.capacity)
+    ring_positions = esp_rtls_ring(POSITION_RECORD, args.capacity)
+    stop = multiprocessing.Event()
+    stages = [
+        multiprocessing.Process(target=ingest, args=(args.port, ring_rssi.name, args.capacity, stop)),
+        multiprocessing.Process(
+            target=solve, args=(ring_rssi.name, ring_positions.name, args.capacity, stop, anchors, args.rssi_sigma)
+        ),
+        multiprocessing.Process(
+            target=render,
+            args=(ring_positions.name, args.capacity, stop, args.render, anchors, args.api, args.resample, args.delay),
+        ),
+    ]
+    for stage in stages:
+        stage.start()
+    signal.signal(signal.SIGTERM, _terminate)
+    try:
+        while all(stage.is_alive() for stage in stages):
+            time.sleep(0.2)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        for stage in stages:
+            stage.join()
+        for ring in (ring_rssi, ring_positions):
+            ring.close()
+            ring.unlink()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+"""
+Station placement planner: search station layouts that minimize the GDOP over a floor
+
+Description:
+- Input: floor polygon and a candidate placement grid (JSON file)
+    - {"floor": [[x, y], ...], "candidates": [[x, y], ...]}  ("candidates" optional)
+- GDOP of range based (RSSI) positioning in 2D, for a test point p and anchors a_i:
+    - u_i = (p - a_i) / |p - a_i|   (only anchors within max_range)
+    - GDOP = sqrt(trace((H^T H)^-1)), H = [u_1; u_2; ...]
+    - The expected position error is about GDOP * range error
+- H^T H is a sum over the anchors, so the contribution of every candidate to every
+  test point is precomputed once, and a layout is scored by summing K contributions
+- Search: greedy (add the best station one by one) + local refinement
+  (move one station to the best other candidate, until no move improves the score)
+    - All candidates of a step are scored at once, split over a pool of worker processes
+- Output: layout, coverage (fraction of the floor with GDOP <= threshold), GDOP map
+
+Usage:
+    python esp_rtls_planner.py floor.json --stations 10 --plot layout.png
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import numpy as np
+from esp_rtls_positioning import point_in_polygon
+
+# State of the pool worker processes (set by _init_worker, never used in the parent)
+_WORKER = {}
+
+
+def grid_in_polygon(polygon, spacing):
+    """
+    Regular grid of points inside a polygon
+
+    Args:
+        polygon  [ndarray (V, 2)] => Vertices of the polygon
+        spacing  [Float] => Distance between the grid points in m
+
+    Returns:
+        [ndarray (N, 2)] => Grid points inside the polygon
+    """
+    min_xy = polygon.min(axis=0)
+    max_xy = polygon.max(axis=0)
+    xs = np.arange(min_xy[0] + spacing / 2, max_xy[0], spacing)
+    ys = np.arange(min_xy[1] + spacing / 2, max_xy[1], spacing)
+    grid = np.stack(np.meshgrid(xs, ys), axis=-1).reshape(-1, 2)
+    return grid[point_in_polygon(grid, polygon)]
+
+
+def gdop_contributions(anchors, points, max_range):
+    """
+    Contribution of each anchor to H^T H of each test point
+
+    Args:
+        anchors    [ndarray (C, 2)] => Candidate anchor positions
+        points     [ndarray (P, 2)] => Test points
+        max_range  [Float] => Anchors further away than this do not contribute
+
+    Returns:
+        [ndarray (4, C, P) float32] => uxx, uxy, uyy and in-range count
+    """
+    delta = points[None, :, :] - anchors[:, None, :]
+    distance = np.hypot(delta[..., 0], delta[..., 1])
+    in_range = (distance <= max_range) & (distance > 1e-6)
+    distance = np.where(in_range, distance, 1.0)
+    ux = np.where(in_range, delta[..., 0] / distance, 0.0)
+    uy = np.where(in_range, delta[..., 1] / distance, 0.0)
+    return np.stack([ux * ux, ux * uy, uy * uy, in_range]).astype(np.float32)
+
+
+def point_gdop(sums):
+    """
+    GDOP per test point from the summed contributions
+
+    Args:
+        sums  [ndarray (4, ..., P)] => Summed uxx, uxy, uyy and in-range count
+
+    Returns:
+        [ndarray (..., P)] => GDOP (inf where less than 3 anchors are in range)
+    """
+    sxx, sxy, syy, count = sums
+    det = sxx * syy - sxy * sxy
+    ok = (count >= 3) & (det > 1e-6)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        gdop = np.sqrt((sxx + syy) / det)
+    return np.where(ok, gdop, np.inf)
+
+
+def point_score(sums, gdop_max):
+    """
+    Score per test point, lower is better
+
+    Description:
+    - Covered points (>= 3 anchors in range): GDOP, capped at gdop_max
+    - Uncovered points: gdop_max + number of missing anchors
+        - So the first stations of the greedy search are placed to cover the floor
+    """
+    gdop = np.minimum(point_gdop(sums), gdop_max)
+    missing = np.maximum(3 - sums[3], 0)
+    return np.where(missing > 0, gdop_max + missing, gdop)
+
+
+def _init_worker(contributions, gdop_max):
+    _WORKER["contributions"] = contributions
+    _WORKER["gdop_max"] = gdop_max
+
+
+def score_candidates(contributions, gdop_max, base, start, stop):
+    """Mean score over the test points of base + each candidate in [start, stop)"""
+    sums = base[:, None, :] + contributions[:, start:stop, :]
+    return point_score(sums, gdop_max).mean(axis=-1)
+
+
+def _score_candidates(task):
+    """score_candidates in a pool worker, on the contributions of _init_worker"""
+    base, start, stop = task
+    return score_candidates(_WORKER["contributions"], _WORKER["gdop_max"], base, start, stop)
+
+
+class esp_rtls_planner:
+    """
+    Description: Greedy + local refinement search of station layouts
+
+    Attributes:
+    - floor        [ndarray (V, 2)] => Floor polygon
+    - candidates   [ndarray (C, 2)] => Candidate station positions
+    - points       [ndarray (P, 2)] => Test points on the floor
+    - max_range    [Float] => Range of a station in m
+    - gdop_max     [Float] => GDOP cap of the score
+    - workers      [Integer] => Number of worker processes (1 => no pool)
+
+    Methods:
+    - greedy(n_stations) => Layout built by adding the best station one by one
+    - refine(layout) => Layout improved by moving single stations
+    - optimize(n_stations) => greedy + refine
+    - evaluate(layout, threshold) => GDOP map and coverage of a layout
+    """
+
+    def __init__(
+        self,
+        floor,
+        candidates=None,
+        candidate_spacing=1.0,
+        test_spacing=0.5,
+        max_range=20.0,
+        gdop_max=10.0,
+        workers=None,
+    ):
+        self.floor = np.asarray(floor, dtype=float)
+        if candidates is None:
+            candidates = grid_in_polygon(self.floor, candidate_spacing)
+        self.candidates = np.asarray(candidates, dtype=float)
+        self.points = grid_in_polygon(self.floor, test_spacing)
+        self.max_range = max_range
+        self.gdop_max = gdop_max
+        self.workers = workers or os.cpu_count() or 1
+        self.__contributions = gdop_contributions(self.candidates, self.points, max_range)
+        self.__pool = None
+
+    def __enter__(self):
+        if self.workers > 1:
+            self.__pool = multiprocessing.Pool(
+                self.workers, _init_worker, (self.__contributions, self.gdop_max)
+            )
+        return self
+
+    def __exit__(self, *exc):
+        if self.__pool is not None:
+            self.__pool.close()
+            self.__pool.join()
+            self.__pool = None
+
+    def greedy(self, n_stations):
+        layout = []
+        sums = np.zeros((4, len(self.points)), dtype=np.float32)
+        for _ in range(n_stations):
+            scores = self.__score_all(sums)
+            scores[layout] = np.inf
+            best = int(np.argmin(scores))
+            layout.append(best)
+            sums += self.__contributions[:, best, :]
+        return layout
+
+    def refine(self, layout, max_passes=20):
+        layout = list(layout)
+        sums = self.__contributions[:, layout, :].sum(axis=1)
+        score = point_score(sums, self.gdop_max).mean()
+        for _ in range(max_passes):
+            improved = False
+            for i in range(len(layout)):
+                base = sums - self.__contributions[:, layout[i], :]
+                scores = self.__score_all(base)
+                scores[layout] = np.inf
+                best = int(np.argmin(scores))
+                if scores[best] < score - 1e-6:
+                    layout[i] = best
+                    sums = base + self.__contributions[:, best, :]
+                    score = scores[best]
+                    improved = True
+            if not improved:
+                break
+        return layout
+
+    def optimize(self, n_stations):
+        return self.refine(self.greedy(n_stations))
+
+    def evaluate(self, layout, threshold=3.0):
+        """
+        Args:
+            layout     [List] => Indices of the candidates used as stations
+            threshold  [Float] => GDOP at which a point counts as covered
+
+        Returns:
+            [Dictionary] => stations, gdop (per test point), coverage, mean/p95 GDOP of covered points
+        """
+        gdop = point_gdop(self.__contributions[:, layout, :].sum(axis=1))
+        covered = gdop <= threshold
+        finite = gdop[np.isfinite(gdop)]
+        return {
+            "stations": self.candidates[layout].tolist(),
+            "gdop": gdop,
+            "coverage": float(covered.mean()),
+            "gdop_mean": float(finite.mean()) if len(finite) else float("inf"),
+            "gdop_p95": float(np.percentile(finite, 95)) if len(finite) else float("inf"),
+        }
+
+    def plot(self, layout, filename):
+        """Save the GDOP map of a layout as an image"""
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+
+        gdop = np.minimum(point_gdop(self.__contributions[:, layout, :].sum(axis=1)), self.gdop_max)
+        fig, ax = plt.subplots()
+        sc = ax.scatter(self.points[:, 0], self.points[:, 1], c=gdop, s=4, marker="s", cmap="viridis_r")
+        fig.colorbar(sc, ax=ax, label="GDOP")
+        floor = np.vstack([self.floor, self.floor[:1]])
+        ax.plot(floor[:, 0], floor[:, 1], "k-")
+        stations = self.candidates[layout]
+        ax.scatter(stations[:, 0], stations[:, 1], c="r", marker="^")
+        ax.set_aspect("equal")
+        fig.savefig(filename, dpi=150)
+        plt.close(fig)
+
+    def __score_all(self, base):
+        """Mean score of base + each candidate, for all candidates"""
+        n_candidates = len(self.candidates)
+        if self.__pool is None:
+            return score_candidates(self.__contributions, self.gdop_max, base, 0, n_candidates)
+        chunk = max(1, -(-n_candidates // (4 * self.workers)))
+        tasks = [(base, start, min(start + chunk, n_candidates)) for start in range(0, n_candidates, chunk)]
+        return np.concatenate(self.__pool.map(_score_candidates, tasks))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Station placement planner (GDOP)")
+    parser.add_argument("floorplan", help="JSON file with floor polygon and optional candidates")
+    parser.add_argument("--stations", type=int, default=3, help="Number of stations")
+    parser.add_argument("--candidate-spacing", type=float, default=1.0, help="Candidate grid spacing in m")
+    parser.add_argument("--test-spacing", type=float, default=0.5, help="Test point grid spacing in m")
+    parser.add_argument("--max-range", type=float, default=20.0, help="Range of a station in m")
+    parser.add_argument("--threshold", type=float, default=3.0, help="GDOP threshold for coverage")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--plot", default=None, help="Save the GDOP map to this image")
+    args = parser.parse_args()
+
+    with open(args.floorplan) as file:
+        floorplan = json.load(file)
+
+    planner = esp_rtls_planner(
+        floorplan["floor"],
+        floorplan.get("candidates"),
+        args.candidate_spacing,
+        args.test_spacing,
+        args.max_range,
+        workers=args.workers,
+    )
+    with planner:
+        layout = planner.optimize(args.stations)
+    result = planner.evaluate(layout, args.threshold)
+
+    print("Stations:")
+    for i, (x, y) in enumerate(result["stations"]):
+        print("    " + str(i + 1) + ": (" + str(round(x, 2)) + ", " + str(round(y, 2)) + ")")
+    print("Coverage (GDOP <= " + str(args.threshold) + "): " + str(round(100 * result["coverage"], 1)) + " %")
+    print("GDOP mean: " + str(round(result["gdop_mean"], 2)) + ", p95: " + str(round(result["gdop_p95"], 2)))
+    if args.plot:
+        planner.plot(layout, args.plot)
+
+
+if __name__ == "__main__":
+    main()
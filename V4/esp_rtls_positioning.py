@@ -0,0 +1,318 @@
+"""
+Positioning functions used by the host app (app.py)
+
+Description:
+- Conversion of RSSI to distance (log-distance path loss model)
+- Placement of the anchors (stations) from the distances between them
+- Trilateration of the position of a mobile from 3 distances
+    - Batched least squares for many mobiles and >= 3 anchors (get_positions)
+    - 3D: anchors with mounting heights, (x, y, z) or (x, y) at a known tag height
+- Quality of a fix: covariance, GDOP and confidence ellipse (vectorized over the mobiles)
+- Moving average filter on the distances
+- Point in polygon test for floors and zones
+- Parsing of the lines printed by station 1 on the COM port
+    - Untagged format: (rssi1, rssi2, rssi3)
+    - Tagged format:   tokenID:(rssi1, rssi2, rssi3)
+"""
+
+import json
+import math
+import numpy as np
+
+# Default log-distance model parameters (as used by app.py)
+RSSI_AT_1_METER = 58
+PATH_LOSS_EXPONENT = 2.5
+
+# TokenID used for lines in the untagged format (station 1 prints mobile 1)
+DEFAULT_TOKEN_ID = 1
+
+
+# Functions
+def get_distance(rssi, rssi_at_1_meter=60, n=2.0):
+    distance = 10 ** (((-rssi_at_1_meter) - (-rssi)) / (10 * n))
+    
+    return distance
+
+def get_rssi(distance, rssi_at_1_meter=60, n=2.0):
+    # Inverse of get_distance
+    rssi = rssi_at_1_meter + 10 * n * math.log10(distance)
+
+    return rssi
+
+def calc_anchor_position(x1,y1, d_1_2, d_1_3, d_2_3):
+    x2 = x1 - d_2_3/2
+    x3 = x1 + d_2_3/2
+    y2 = y1 - math.sqrt(d_1_2**2 - x2**2)
+    y3 = y1 - math.sqrt(d_1_3**2 - x3**2)
+    return x2, y2, x3, y3
+
+def get_position(x1, y1, x2, y2, x3, y3, d1, d2, d3):
+    
+    A = 2 * x2 - 2 * x1
+    B = 2 * y2 - 2 * y1
+    C = d1 ** 2 - d2 ** 2 - x1 ** 2 + x2 ** 2 - y1 ** 2 + y2 ** 2
+    D = 2 * x3 - 2 * x2
+    E = 2 * y3 - 2 * y2
+    F = d2 ** 2 - d3 ** 2 - x2 ** 2 + x3 ** 2 - y2 ** 2 + y3 ** 2
+    x = (C * E - F * B) / (E * A - B * D)
+    y = (C * D - A * F) / (B * D - A * E)
+    return x, y, d1, d2, d3
+
+# Batched trilateration (linear least squares, anchor 1 as reference)
+def get_positions(anchors, d):
+    """
+    Position of many mobiles from the distances to K >= 3 anchors
+
+    Args:
+        anchors  [ndarray (K, 2)] => Positions of the anchors
+        d        [ndarray (M, K)] => Distances of the mobiles to the anchors
+
+    Returns:
+        [ndarray (M, 2)] => Positions (same as get_position for K = 3)
+    """
+    anchors = np.asarray(anchors, dtype=float)
+    d = np.asarray(d, dtype=float)
+    A = 2 * (anchors[1:] - anchors[0])
+    b = (
+        d[:, :1] ** 2
+        - d[:, 1:] ** 2
+        + np.sum(anchors[1:] ** 2, axis=1)
+        - np.sum(anchors[0] ** 2)
+    )
+    return b @ np.linalg.pinv(A).T
+
+# Batched 3D trilateration (linear least squares, anchor 1 as reference)
+def get_positions_3d(anchors, d, below=True):
+    """
+    Position (x, y, z) of many mobiles from the distances to K >= 4 anchors
+
+    Description:
+    - Same linear system as get_positions with a z column
+    - Stations are usually mounted at (about) the same height: z is then not observable
+      from the linear system, only |z - z_anchors| is
+        - (x, y) is solved in the plane of the anchors from the projected system
+        - z = z_anchors -+ sqrt(d^2 - horizontal distance^2), averaged over the anchors
+        - below: the mobiles are below the anchors (ceiling mounted stations)
+        - Works with K = 3 anchors too
+    - Other anchor sets that don't determine z (K < 4, or all anchors in one tilted plane)
+      raise ValueError: use get_positions_at_height with a known tag height
+
+    Args:
+        anchors  [ndarray (K, 3)] => Positions of the anchors
+        d        [ndarray (M, K)] => Distances of the mobiles to the anchors
+        below    [Boolean] => Side of the anchor plane for coplanar anchors
+
+    Returns:
+        [ndarray (M, 3)] => Positions
+    """
+    anchors = np.asarray(anchors, dtype=float)
+    d = np.asarray(d, dtype=float)
+    A = 2 * (anchors[1:] - anchors[0])
+    b = (
+        d[:, :1] ** 2
+        - d[:, 1:] ** 2
+        + np.sum(anchors[1:] ** 2, axis=1)
+        - np.sum(anchors[0] ** 2)
+    )
+    if len(anchors) >= 4 and np.linalg.matrix_rank(A) == 3:
+        return b @ np.linalg.pinv(A).T
+    if not np.allclose(anchors[:, 2], anchors[0, 2]):
+        raise ValueError(
+            "z is not observable from these " + str(len(anchors)) + " anchors: "
+            "use 4 non-coplanar anchors, anchors at one height, or get_positions_at_height"
+        )
+
+    # Coplanar anchors (in a horizontal plane): the z column of A is zero
+    xy = b @ np.linalg.pinv(A[:, :2]).T
+    delta = xy[:, None, :] - anchors[None, :, :2]
+    dz2 = d ** 2 - delta[..., 0] ** 2 - delta[..., 1] ** 2
+    dz = np.sqrt(np.maximum(np.mean(dz2, axis=1), 0))
+    z = np.mean(anchors[:, 2]) + (-dz if below else dz)
+    return np.concatenate([xy, z[:, None]], axis=1)
+
+# Horizontal distances from 3D distances at a known height
+def horizontal_distances(anchors, d, tag_height):
+    """
+    Projection of the distances on the floor plane, for get_positions / get_position
+
+    Args:
+        anchors     [ndarray (K, 3)] => Positions of the anchors (z = mounting height)
+        d           [ndarray (M, K)] => Distances of the mobiles to the anchors
+        tag_height  [ndarray (M,) or Float] => Height of the mobiles
+
+    Returns:
+        [ndarray (M, K)] => sqrt(d^2 - (z_anchor - tag_height)^2), 0 if the range is shorter
+        than the height difference
+    """
+    dz = np.asarray(anchors, dtype=float)[:, 2] - np.asarray(tag_height, dtype=float)[..., None]
+    return np.sqrt(np.maximum(np.asarray(d, dtype=float) ** 2 - dz ** 2, 0))
+
+# Batched trilateration of mobiles at a known height
+def get_positions_at_height(anchors, d, tag_height):
+    """
+    Position (x, y) of many mobiles at a known height (same cost as get_positions)
+
+    Args:
+        anchors     [ndarray (K, 3)] => Positions of the anchors
+        d           [ndarray (M, K)] => 3D distances of the mobiles to the anchors
+        tag_height  [ndarray (M,) or Float] => Height of the mobiles (e.g. floor + 1.2 m)
+
+    Returns:
+        [ndarray (M, 2)] => Positions
+    """
+    anchors = np.asarray(anchors, dtype=float)
+    return get_positions(anchors[:, :2], horizontal_distances(anchors, d, tag_height))
+
+# Floor of a height
+def floor_of(z, floor_levels):
+    """
+    Args:
+        z             [ndarray (M,)] => Heights of the mobiles
+        floor_levels  [List] => Height of each floor, ascending
+
+    Returns:
+        [ndarray (M,)] => Index of the floor the mobiles stand on (0 below the first floor)
+    """
+    return np.maximum(np.searchsorted(floor_levels, z, side="right") - 1, 0)
+
+# Anchor configuration
+def load_anchors(filename):
+    """
+    Anchor configuration from a JSON file
+
+    Args:
+        filename  [String] => {"anchors": [[x, y, z], ...], "tag_height": 1.2, "floors": [0, 3.5]}
+            - z, tag_height and floors are optional (z = 0, tag_height = None, floors = [0])
+
+    Returns:
+        anchors [ndarray (K, 3)], tag_height [Float or None], floor_levels [List]
+    """
+    with open(filename) as file:
+        config = json.load(file)
+    anchors = np.zeros((len(config["anchors"]), 3))
+    for k, anchor in enumerate(config["anchors"]):
+        anchors[k, : len(anchor)] = anchor
+    return anchors, config.get("tag_height"), config.get("floors", [0])
+
+# Standard deviation of a distance from the standard deviation of the RSSI
+def distance_sigma(d, rssi_sigma=2.0, n=2.0):
+    # d = 10^((rssi - rssi_at_1_meter) / (10 n))  =>  dd/drssi = d * ln(10) / (10 n)
+    return np.asarray(d) * math.log(10) / (10 * n) * rssi_sigma
+
+# Covariance and GDOP of fixes
+def get_position_covariance(anchors, positions, sigma_d):
+    """
+    Covariance of the position from measurement noise and anchor geometry
+
+    Description:
+    - H: unit vectors from the anchors to the position (Jacobian of the ranges)
+    - Covariance = (H^T W H)^-1, W = diag(1 / sigma_d^2)
+    - GDOP = sqrt(trace((H^T H)^-1))
+
+    Args:
+        anchors    [ndarray (K, 2)] => Positions of the anchors
+        positions  [ndarray (M, 2)] => Solved positions of the mobiles
+        sigma_d    [ndarray (M, K) or Float] => Standard deviation of the distances
+
+    Returns:
+        covariance [ndarray (M, 2, 2)], gdop [ndarray (M,)] (inf for degenerate geometry)
+    """
+    delta = np.asarray(positions, dtype=float)[:, None, :] - np.asarray(anchors, dtype=float)[None, :, :]
+    r = np.maximum(np.hypot(delta[..., 0], delta[..., 1]), 1e-9)
+    ux = delta[..., 0] / r
+    uy = delta[..., 1] / r
+    w = 1 / np.broadcast_to(np.asarray(sigma_d, dtype=float), r.shape) ** 2
+
+    # Closed form inverse of the 2x2 normal matrices
+    def inverse(sxx, sxy, syy):
+        det = sxx * syy - sxy * sxy
+        with np.errstate(divide="ignore", invalid="ignore"):
+            inv = np.stack([syy, -sxy, -sxy, sxx], axis=-1).reshape(-1, 2, 2) / det[:, None, None]
+        inv[det <= 1e-12] = np.inf
+        return inv
+
+    covariance = inverse(np.sum(w * ux * ux, 1), np.sum(w * ux * uy, 1), np.sum(w * uy * uy, 1))
+    dop = inverse(np.sum(ux * ux, 1), np.sum(ux * uy, 1), np.sum(uy * uy, 1))
+    gdop = np.sqrt(dop[:, 0, 0] + dop[:, 1, 1])
+    return covariance, gdop
+
+# Confidence ellipse of a covariance
+def confidence_ellipse(covariance, confidence=0.95):
+    """
+    Args:
+        covariance  [ndarray (M, 2, 2)] => Covariance of the fixes
+        confidence  [Float] => Probability inside the ellipse
+
+    Returns:
+        semi-major [ndarray (M,)], semi-minor [ndarray (M,)], angle of the major axis in rad [ndarray (M,)]
+    """
+    # Chi-square quantile with 2 degrees of freedom
+    scale = -2 * math.log(1 - confidence)
+    sxx = covariance[:, 0, 0]
+    sxy = covariance[:, 0, 1]
+    syy = covariance[:, 1, 1]
+    mean = (sxx + syy) / 2
+    radius = np.hypot((sxx - syy) / 2, sxy)
+    major = np.sqrt(scale * (mean + radius))
+    minor = np.sqrt(scale * np.maximum(mean - radius, 0))
+    angle = 0.5 * np.arctan2(2 * sxy, sxx - syy)
+    return major, minor, angle
+
+def swap_position_of_2_anchors(x1, y1, x2, y2):
+    x1, x2 = x2, x1
+    y1, y2 = y2, y1
+    return x1, y1, x2, y2
+
+# Moving average filter
+def moving_average_filter(d, d_last):
+    d_filtered = (d + d_last) / 2
+    return d_filtered
+
+# Moving average on 3 distances
+def moving_average_on_3_distances(d1, d2, d3, d_1_last, d_2_last, d_3_last):
+    d1_filtered = moving_average_filter(d1, d_1_last)
+    d2_filtered = moving_average_filter(d2, d_2_last)
+    d3_filtered = moving_average_filter(d3, d_3_last)
+    return d1_filtered, d2_filtered, d3_filtered
+
+# Parse a line from the COM port
+def parse_line(line):
+    """
+    Parse a decoded line from the COM port
+
+    Args:
+        line    [String] => "(r1, r2, r3)" or "tokenID:(r1, r2, r3)"
+
+    Returns:
+        (tokenID, rssi1, rssi2, rssi3) or None if the line is empty
+    """
+    line = line.strip()
+    if line == "":
+        return None
+    tokenID = DEFAULT_TOKEN_ID
+    if line[0] != "(":
+        tag, line = line.split(":", 1)
+        tokenID = int(tag)
+    rssi1, rssi2, rssi3 = line.strip()[1:-1].split(",")
+    return tokenID, int(rssi1), int(rssi2), int(rssi3)
+
+# Point in polygon (vectorized over the points)
+def point_in_polygon(points, polygon):
+    """
+    Crossing number test of many points against one polygon
+
+    Args:
+        points   [ndarray (N, 2)] => Points to test
+        polygon  [ndarray (V, 2)] => Vertices of the polygon
+
+    Returns:
+        [ndarray (N,) bool] => True if the point is inside
+    """
+    x = points[:, 0:1]
+    y = points[:, 1:2]
+    xa, ya = polygon[:, 0], polygon[:, 1]
+    xb, yb = np.roll(xa, -1), np.roll(ya, -1)
+    crosses = (ya > y) != (yb > y)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x_cross = xa + (y - ya) * (xb - xa) / (yb - ya)
+    return np.count_nonzero(crosses & (x < x_cross), axis=1) % 2 == 1
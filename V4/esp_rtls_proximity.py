@@ -0,0 +1,124 @@
+"""
+Mobile-to-mobile proximity: which mobiles are within a radius of each other, and for how long
+
+Description:
+- Spatial hash grid with the radius as cell size, rebuilt every frame
+    - Positions sorted by cell key, each cell is a contiguous range of the sorted array
+    - Close pairs can only be in the same or a neighbouring cell
+    - Half of the neighbourhood is searched (same cell + 4 neighbours), so each pair is found once
+- Pairs are expanded and filtered on distance in vectorized passes
+    - The cost grows near-linearly with the number of mobiles (for a bounded density)
+- Contacts are tracked over frames: start time per pair, duration, ended contacts
+
+Usage:
+    proximity = esp_rtls_proximity(radius=2.0)
+    contacts, ended = proximity.update(tokenIDs, positions, t)
+"""
+
+import numpy as np
+
+# Cell coordinates are packed in one int64 key: 21 bits per axis, offset to be positive
+_CELL_BITS = 21
+_CELL_OFFSET = 1 << (_CELL_BITS - 1)
+
+# Half neighbourhood: same cell and 4 of the 8 neighbours
+_NEIGHBOURS = [(0, 0), (1, -1), (1, 0), (1, 1), (0, 1)]
+
+
+def _cell_key(cx, cy):
+    return ((cx + _CELL_OFFSET) << _CELL_BITS) | (cy + _CELL_OFFSET)
+
+
+def close_pairs(positions, radius):
+    """
+    All pairs of positions closer than radius
+
+    Args:
+        positions  [ndarray (M, 2)] => Positions of the mobiles
+        radius     [Float] => Contact radius in m
+
+    Returns:
+        i [ndarray (P,)], j [ndarray (P,)], distance [ndarray (P,)] with i < j (indices into positions)
+    """
+    positions = np.asarray(positions, dtype=float)
+    cell = np.floor(positions / radius).astype(np.int64)
+    keys = _cell_key(cell[:, 0], cell[:, 1])
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+
+    first = []
+    second = []
+    for dx, dy in _NEIGHBOURS:
+        neighbour_keys = _cell_key(cell[order, 0] + dx, cell[order, 1] + dy)
+        lo = np.searchsorted(sorted_keys, neighbour_keys, side="left")
+        hi = np.searchsorted(sorted_keys, neighbour_keys, side="right")
+        if dx == 0 and dy == 0:
+            # Same cell: only the points after this one
+            lo = np.arange(len(sorted_keys)) + 1
+        count = np.maximum(hi - lo, 0)
+        a = np.repeat(np.arange(len(sorted_keys)), count)
+        offset = np.arange(len(a)) - np.repeat(np.cumsum(count) - count, count)
+        first.append(a)
+        second.append(np.repeat(lo, count) + offset)
+
+    a = order[np.concatenate(first)]
+    b = order[np.concatenate(second)]
+    delta = positions[a] - positions[b]
+    distance = np.hypot(delta[:, 0], delta[:, 1])
+    close = distance <= radius
+    a, b, distance = a[close], b[close], distance[close]
+    return np.minimum(a, b), np.maximum(a, b), distance
+
+
+class esp_rtls_proximity:
+    """
+    Description: Tracks contacts between mobiles over frames
+
+    Attributes:
+    - radius   [Float] => Contact radius in m
+
+    Methods:
+    - update(tokenIDs, positions, t) => Current and ended contacts
+    """
+
+    def __init__(self, radius=2.0):
+        self.radius = radius
+        # Contacts sorted by key = tokenA << 32 | tokenB (tokenA < tokenB)
+        self.__keys = np.zeros(0, dtype=np.int64)
+        self.__start = np.zeros(0)
+
+    def update(self, tokenIDs, positions, t):
+        """
+        Args:
+            tokenIDs   [ndarray (M,)] => TokenIDs of the mobiles
+            positions  [ndarray (M, 2)] => Solved positions of the mobiles
+            t          [Float] => Time of the frame in s
+
+        Returns:
+            contacts: (pairs [ndarray (P, 2)] tokenIDs, durations [ndarray (P,)]) of the current contacts
+            ended:    (pairs [ndarray (E, 2)] tokenIDs, durations [ndarray (E,)]) of the contacts that ended
+        """
+        tokenIDs = np.asarray(tokenIDs, dtype=np.int64)
+        i, j, _ = close_pairs(positions, self.radius)
+        token_a = np.minimum(tokenIDs[i], tokenIDs[j])
+        token_b = np.maximum(tokenIDs[i], tokenIDs[j])
+        keys = np.unique((token_a << 32) | token_b)
+
+        # Start times: kept for running contacts, t for new ones
+        index = np.searchsorted(self.__keys, keys)
+        known = index < len(self.__keys)
+        known[known] = self.__keys[index[known]] == keys[known]
+        start = np.full(len(keys), float(t))
+        start[known] = self.__start[index[known]]
+
+        ended = ~np.isin(self.__keys, keys, assume_unique=True)
+        ended_keys = self.__keys[ended]
+        ended_durations = t - self.__start[ended]
+
+        self.__keys = keys
+        self.__start = start
+        return (_unpack(keys), t - start), (_unpack(ended_keys), ended_durations)
+
+
+def _unpack(keys):
+    return np.stack([keys >> 32, keys & 0xFFFFFFFF], axis=1)
@@ -0,0 +1,223 @@
+"""
+Probabilistic ranging: precomputed P(rssi | distance) likelihood tables per link
+
+Description:
+- get_distance turns an RSSI into one distance and throws away the uncertainty
+- Per link (tokenID, stationID) a log-distance model is fitted to calibration data:
+    - rssi = a + 10 n log10(d) + N(0, sigma^2)
+    - Links with too few calibration samples use the default link (index 0)
+- Precomputed once per link, over the integer RSSI values 0..255 and a linear distance grid:
+    - log P(rssi | d)                        [links, 256, D]
+    - Posterior mean and variance of d       [links, 256]   (uniform prior over the grid)
+    - Built in float32, a few links at a time, so the temporaries stay small next to the table
+- Solvers and filters index the tables instead of evaluating exponentials:
+    - distance(links, rssi) => mean and variance of the distance (O(1))
+    - log_likelihood(links, rssi) => log P(rssi | d) over the distance grid
+    - position_log_likelihood(...) => log likelihood of candidate positions, vectorized over mobiles
+- Calibration data (CSV): tokenID, stationID, distance, rssi
+
+Usage:
+    python esp_rtls_ranging.py calibration.csv ranging.npz
+    ranging = esp_rtls_ranging.load("ranging.npz")
+"""
+
+import argparse
+import csv
+import math
+import numpy as np
+from esp_rtls_positioning import RSSI_AT_1_METER, PATH_LOSS_EXPONENT
+
+# Key of the default link
+DEFAULT_LINK = (0, 0)
+
+
+class esp_rtls_ranging:
+    """
+    Description: Likelihood tables of the RSSI given the distance, per link
+
+    Attributes:
+    - links      [Dictionary] => (tokenID, stationID) => link index (0 => default link)
+    - params     [ndarray (L, 3)] => a, n, sigma per link
+    - d_min      [Float] => First distance of the grid in m
+    - d_step     [Float] => Step of the distance grid in m
+    - distances  [ndarray (D,)] => Distance grid
+
+    Methods:
+    - fit(samples) => Fit the links to calibration samples and build the tables
+    - link_index(tokenIDs, stationIDs) => Link indices (default link if not calibrated)
+    - distance(links, rssi) => Posterior mean and variance of the distance
+    - log_likelihood(links, rssi) => log P(rssi | d) over the distance grid
+    - position_log_likelihood(links, rssi, anchors, points) => log likelihood of positions
+    - save(filename), load(filename)
+    """
+
+    def __init__(
+        self,
+        rssi_at_1_meter=RSSI_AT_1_METER,
+        n=PATH_LOSS_EXPONENT,
+        sigma=4.0,
+        d_min=0.1,
+        d_max=40.0,
+        d_step=0.1,
+    ):
+        self.links = {DEFAULT_LINK: 0}
+        self.params = np.array([[rssi_at_1_meter, n, sigma]], dtype=float)
+        self.__grid(d_min, d_max, d_step)
+        self.__build()
+
+    def fit(self, samples, min_samples=20, min_sigma=1.0):
+        """
+        Args:
+            samples      [List] => (tokenID, stationID, distance, rssi) calibration samples
+            min_samples  [Integer] => Links with fewer samples use the default link
+            min_sigma    [Float] => Lower limit of the fitted sigma in dB
+        """
+        per_link = {}
+        for tokenID, stationID, distance, rssi in samples:
+            per_link.setdefault((int(tokenID), int(stationID)), []).append((float(distance), float(rssi)))
+
+        # The default link is fitted to all samples
+        all_samples = [sample for link in per_link.values() for sample in link]
+        self.links = {DEFAULT_LINK: 0}
+        params = [self.__fit_link(all_samples, min_sigma) if len(all_samples) >= min_samples else self.params[0]]
+        for key, link in per_link.items():
+            if len(link) >= min_samples:
+                self.links[key] = len(params)
+                params.append(self.__fit_link(link, min_sigma))
+        self.params = np.array(params, dtype=float)
+        self.__build()
+
+    def link_index(self, tokenIDs, stationIDs):
+        return np.array(
+            [self.links.get((tokenID, stationID), 0) for tokenID, stationID in zip(tokenIDs, stationIDs)],
+            dtype=np.int64,
+        )
+
+    def distance(self, links, rssi):
+        """
+        Args:
+            links  [ndarray (...)] => Link indices
+            rssi   [ndarray (...)] => RSSI (absolute value, as send by the stations)
+
+        Returns:
+            mean [ndarray (...)], variance [ndarray (...)] of the distance in m
+        """
+        rssi = np.clip(np.rint(rssi), 0, 255).astype(np.int64)
+        return self.mean[links, rssi], self.variance[links, rssi]
+
+    def log_likelihood(self, links, rssi):
+        """
+        Returns:
+            [ndarray (..., D)] => log P(rssi | d) over the distance grid
+        """
+        rssi = np.clip(np.rint(rssi), 0, 255).astype(np.int64)
+        return self.table[links, rssi]
+
+    def position_log_likelihood(self, links, rssi, anchors, points):
+        """
+        Log likelihood of candidate positions, vectorized over the mobiles
+
+        Args:
+            links    [ndarray (M, K)] => Link index of each mobile-station pair
+            rssi     [ndarray (M, K)] => RSSI of each mobile-station pair
+            anchors  [ndarray (K, 2)] => Positions of the stations
+            points   [ndarray (P, 2)] => Candidate positions
+
+        Returns:
+            [ndarray (M, P)] => Sum over the stations of log P(rssi | |point - anchor|)
+        """
+        links = np.asarray(links)
+        rssi = np.clip(np.rint(rssi), 0, 255).astype(np.int64)
+        points = np.asarray(points, dtype=float)
+        anchors = np.asarray(anchors, dtype=float)
+        total = np.zeros((links.shape[0], len(points)), dtype=np.float32)
+        for k in range(anchors.shape[0]):
+            grid_index = self.grid_index(np.hypot(*(points - anchors[k]).T))
+            total += self.table[links[:, k], rssi[:, k]][:, grid_index]
+        return total
+
+    def grid_index(self, distance):
+        """Index of the nearest distance of the grid (O(1))"""
+        index = np.rint((np.asarray(distance) - self.d_min) / self.d_step).astype(np.int64)
+        return np.clip(index, 0, len(self.distances) - 1)
+
+    def save(self, filename):
+        keys = np.array(list(self.links.keys()), dtype=np.int64).reshape(-1, 2)
+        np.savez_compressed(
+            filename,
+            keys=keys,
+            index=np.array(list(self.links.values()), dtype=np.int64),
+            params=self.params,
+            grid=np.array([self.d_min, self.distances[-1], self.d_step]),
+        )
+
+    @classmethod
+    def load(cls, filename):
+        data = np.load(filename)
+        d_min, d_max, d_step = data["grid"]
+        # Tables are built once, for the loaded links (not for the default link first)
+        ranging = cls.__new__(cls)
+        ranging.__grid(d_min, d_max, d_step)
+        ranging.links = {tuple(key): int(index) for key, index in zip(data["keys"].tolist(), data["index"])}
+        ranging.params = data["params"]
+        ranging.__build()
+        return ranging
+
+    def __fit_link(self, samples, min_sigma):
+        """Least squares fit of a, n and the residual sigma"""
+        data = np.array(samples)
+        X = np.stack([np.ones(len(data)), 10 * np.log10(np.maximum(data[:, 0], 1e-3))], axis=1)
+        (a, n), *_ = np.linalg.lstsq(X, data[:, 1], rcond=None)
+        sigma = max(float(np.std(data[:, 1] - X @ [a, n])), min_sigma)
+        return [a, n, sigma]
+
+    def __grid(self, d_min, d_max, d_step):
+        self.d_min = d_min
+        self.d_step = d_step
+        self.distances = np.arange(d_min, d_max + d_step / 2, d_step)
+
+    def __build(self, chunk=8):
+        """Likelihood tables and posterior moments of all links, chunk links at a time"""
+        n_links = len(self.params)
+        self.table = np.empty((n_links, 256, len(self.distances)), dtype=np.float32)
+        self.mean = np.empty((n_links, 256))
+        self.variance = np.empty((n_links, 256))
+        rssi = np.arange(256, dtype=np.float32)[None, :, None]
+        log_d = np.log10(self.distances).astype(np.float32)[None, None, :]
+        for start in range(0, n_links, chunk):
+            a, n, sigma = (self.params[start : start + chunk, i].astype(np.float32)[:, None, None] for i in range(3))
+            log_lik = self.table[start : start + chunk]
+            np.subtract(rssi, a + 10 * n * log_d, out=log_lik)
+            log_lik /= sigma
+            np.square(log_lik, out=log_lik)
+            log_lik *= -0.5
+            log_lik -= np.log(sigma * np.float32(math.sqrt(2 * math.pi)))
+
+            # Posterior over the grid with a uniform prior
+            weights = log_lik - log_lik.max(axis=2, keepdims=True)
+            np.exp(weights, out=weights)
+            weights /= weights.sum(axis=2, keepdims=True)
+            mean = weights @ self.distances
+            self.mean[start : start + chunk] = mean
+            self.variance[start : start + chunk] = np.maximum(weights @ self.distances ** 2 - mean ** 2, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build ranging likelihood tables from calibration data")
+    parser.add_argument("calibration", help="CSV: tokenID, stationID, distance, rssi")
+    parser.add_argument("output", help="Tables (.npz)")
+    parser.add_argument("--min-samples", type=int, default=20, help="Samples needed to calibrate a link")
+    args = parser.parse_args()
+
+    with open(args.calibration, newline="") as file:
+        samples = [row for row in csv.reader(file) if row and not row[0].startswith("token")]
+    ranging = esp_rtls_ranging()
+    ranging.fit(samples, args.min_samples)
+    ranging.save(args.output)
+    for key, index in ranging.links.items():
+        a, n, sigma = ranging.params[index]
+        print(str(key) + ": a = " + str(round(a, 1)) + ", n = " + str(round(n, 2)) + ", sigma = " + str(round(sigma, 1)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Fixed-rate resampling of the fixes of all mobiles
+
+Description:
+- Fixes arrive irregularly: once per ring cycle per mobile
+- The resampler emits the positions of all mobiles on a fixed clock (e.g. 10 Hz),
+  ticks at multiples of 1 / rate
+- Per mobile the last n_history fixes are kept in fixed-size arrays (mobile row x history)
+- Per tick, vectorized over all mobiles, at t_out = tick - delay:
+    - Fix before and after t_out known => linear interpolation
+    - Only fixes before t_out => constant velocity prediction from the last 2 fixes,
+      marked as extrapolated
+    - Mobiles without a fix for max_extrapolation seconds are left out
+- delay trades latency for interpolation: with delay >= ring cycle time most samples are interpolated
+
+Usage:
+    resampler = esp_rtls_resampler(rate=10)
+    resampler.update(t, tokenIDs, positions)
+    for tick in resampler.ticks(t_now):
+        tokenIDs, positions, extrapolated = resampler.sample(tick)
+"""
+
+import math
+import numpy as np
+from esp_rtls_rows import esp_rtls_rows, occurrences
+
+
+class esp_rtls_resampler:
+    """
+    Description: Interpolates / extrapolates the fixes of all mobiles to a fixed clock
+
+    Attributes:
+    - rate                [Float] => Output rate in Hz
+    - delay               [Float] => Output lags the clock by delay s
+    - max_extrapolation   [Float] => Longest prediction after the last fix in s
+    - n_history           [Integer] => Fixes kept per mobile
+
+    Methods:
+    - update(t, tokenIDs, positions) => Add fixes
+    - ticks(t) => Ticks of the clock up to t that were not emitted yet
+    - sample(tick) => tokenIDs, positions and extrapolated flags of all mobiles at tick - delay
+    """
+
+    def __init__(self, rate=10.0, delay=0.0, max_extrapolation=2.0, n_history=4):
+        self.rate = rate
+        self.delay = delay
+        self.max_extrapolation = max_extrapolation
+        self.n_history = n_history
+        self.__state = esp_rtls_rows(capacity=64)
+        self.__state.add("tokenIDs", dtype=np.int64)
+        self.__state.add("t", (n_history,), fill=-np.inf)
+        self.__state.add("p", (n_history, 2))
+        self.__next_tick = None
+
+    def update(self, t, tokenIDs, positions):
+        """
+        Args:
+            t          [Float or ndarray (M,)] => Time of the fixes in s
+            tokenIDs   [List] => TokenIDs of the mobiles (M,)
+            positions  [ndarray (M, 2)] => Positions
+        """
+        t = np.broadcast_to(np.asarray(t, dtype=float), (len(tokenIDs),))
+        positions = np.asarray(positions, dtype=float)
+        state = self.__state
+        rows = state.get(tokenIDs)
+        state.tokenIDs[rows] = tokenIDs
+        # A mobile may occur more than once: shift in its fixes in order
+        for batch in occurrences(rows):
+            r = rows[batch]
+            state.t[r, :-1] = state.t[r, 1:]
+            state.p[r, :-1] = state.p[r, 1:]
+            state.t[r, -1] = t[batch]
+            state.p[r, -1] = positions[batch]
+
+    def ticks(self, t):
+        """Ticks (multiples of 1 / rate) after the last emitted tick, up to t"""
+        period = 1 / self.rate
+        if self.__next_tick is None:
+            self.__next_tick = math.floor(t / period)
+        last = math.floor(t / period)
+        ticks = [k * period for k in range(self.__next_tick, last + 1)]
+        self.__next_tick = max(self.__next_tick, last + 1)
+        return ticks
+
+    def sample(self, tick):
+        """
+        Args:
+            tick  [Float] => Time of the clock in s
+
+        Returns:
+            tokenIDs [ndarray (M,)], positions [ndarray (M, 2)], extrapolated [ndarray (M,) bool]
+        """
+        n = len(self.__state.rows)
+        t_out = tick - self.delay
+        t = self.__state.t[:n]
+        p = self.__state.p[:n]
+        m = np.arange(n)
+        last = self.n_history - 1
+
+        # First fix after t_out (n_history if none), the fix before it must exist
+        after = t > t_out
+        j = np.where(after.any(axis=1), np.argmax(after, axis=1), self.n_history)
+        known = (j > 0) & np.isfinite(t[m, np.maximum(j - 1, 0)])
+        extrapolate = known & (j == self.n_history)
+
+        # Segment: fixes j - 1 and j, or the last 2 fixes for extrapolation
+        i1 = np.minimum(j, last)
+        i0 = np.maximum(i1 - 1, 0)
+        span = t[m, i1] - t[m, i0]
+        moving = np.isfinite(span) & (span > 0)
+        velocity = np.where(moving[:, None], (p[m, i1] - p[m, i0]) / np.where(moving, span, 1)[:, None], 0)
+
+        # Interpolate from fix j - 1, extrapolate from the last fix
+        base = np.where(extrapolate, i1, i0)
+        dt = t_out - t[m, base]
+        dt = np.where(extrapolate, np.minimum(dt, self.max_extrapolation), dt)
+        positions = p[m, base] + velocity * np.where(known, dt, 0)[:, None]
+
+        keep = known & ~(extrapolate & (t_out - t[m, last] > self.max_extrapolation))
+        return self.__state.tokenIDs[:n][keep], positions[keep], extrapolate[keep]
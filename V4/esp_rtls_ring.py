@@ -0,0 +1,107 @@
+"""
+Single-producer / single-consumer ring buffer of fixed-size records in shared memory
+
+Description:
+- Records are a NumPy structured dtype, stored in a multiprocessing.shared_memory block
+    - No pickling: push copies the records into the block, pop copies them out
+- Layout of the block:
+    - head (int64, offset 0): records consumed, written only by the consumer
+    - tail (int64, offset 64): records produced, written only by the producer
+      (own cache line, so producer and consumer don't share one)
+    - capacity records from offset 128
+- head and tail only grow, slot = counter % capacity
+- The producer writes the records before it publishes the new tail, the consumer reads
+  them before it publishes the new head, so no lock is needed with one writer per counter
+- push never blocks: records that don't fit are dropped and counted
+  (a slow consumer can't stall the producer)
+
+Usage:
+    ring = esp_rtls_ring(RSSI_RECORD, 4096)               # Producer side, creates the block
+    other = esp_rtls_ring(RSSI_RECORD, 4096, ring.name)   # Consumer side (other process)
+    ring.push(records)
+    records = other.pop()
+"""
+
+import numpy as np
+from multiprocessing import shared_memory
+
+_HEAD = 0
+_TAIL = 8
+_HEADER = 128 // 8
+
+
+def _attach(name):
+    """Shared memory block created by another process, not unlinked by this one"""
+    try:
+        return shared_memory.SharedMemory(name=name, create=False, track=False)
+    except TypeError:
+        # Python < 3.13: child processes share the resource tracker of the creator,
+        # which registered the block already
+        return shared_memory.SharedMemory(name=name, create=False)
+
+
+class esp_rtls_ring:
+    """
+    Description: SPSC ring of structured records in shared memory
+
+    Attributes:
+    - dtype      [numpy.dtype] => Record type
+    - capacity   [Integer] => Number of records
+    - name       [String] => Name of the shared memory block (to attach from another process)
+    - dropped    [Integer] => Records dropped by push in this process because the ring was full
+
+    Methods:
+    - push(records) => Number of records written
+    - pop(max_records) => Array of the records read (may be empty)
+    - size() => Records waiting
+    - close() => Detach, unlink() => Remove the block (creator)
+    """
+
+    def __init__(self, dtype, capacity, name=None):
+        self.dtype = np.dtype(dtype)
+        self.capacity = capacity
+        size = _HEADER * 8 + capacity * self.dtype.itemsize
+        if name is None:
+            self.__block = shared_memory.SharedMemory(create=True, size=size)
+            self.__block.buf[: _HEADER * 8] = bytes(_HEADER * 8)
+        else:
+            self.__block = _attach(name)
+        self.name = self.__block.name
+        self.__counters = np.ndarray((_HEADER,), dtype=np.int64, buffer=self.__block.buf)
+        self.__records = np.ndarray((capacity,), dtype=self.dtype, buffer=self.__block.buf, offset=_HEADER * 8)
+        self.dropped = 0
+
+    def push(self, records):
+        records = np.asarray(records, dtype=self.dtype)
+        tail = int(self.__counters[_TAIL])
+        free = self.capacity - (tail - int(self.__counters[_HEAD]))
+        n = min(len(records), free)
+        self.dropped += len(records) - n
+        if n > 0:
+            start = tail % self.capacity
+            first = min(n, self.capacity - start)
+            self.__records[start : start + first] = records[:first]
+            self.__records[: n - first] = records[first:n]
+            self.__counters[_TAIL] = tail + n
+        return n
+
+    def pop(self, max_records=None):
+        head = int(self.__counters[_HEAD])
+        n = int(self.__counters[_TAIL]) - head
+        if max_records is not None:
+            n = min(n, max_records)
+        start = head % self.capacity
+        first = min(n, self.capacity - start)
+        records = np.concatenate([self.__records[start : start + first], self.__records[: n - first]])
+        self.__counters[_HEAD] = head + n
+        return records
+
+    def size(self):
+        return int(self.__counters[_TAIL]) - int(self.__counters[_HEAD])
+
+    def close(self):
+        del self.__counters, self.__records
+        self.__block.close()
+
+    def unlink(self):
+        self.__block.unlink()
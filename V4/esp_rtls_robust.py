@@ -0,0 +1,185 @@
+"""
+Robust positioning: RANSAC over anchor subsets and innovation gating
+
+Description:
+- Used when more than 3 anchors (stations) are available: one reflected or blocked link
+  should not drag the solution metres off
+- RANSAC, batched as matrix operations:
+    - All 3-anchor subsets are enumerated once; the pseudo-inverse of the linear
+      trilateration system of each subset is precomputed
+    - Every subset is solved for every mobile at once: (M, S, 2) positions
+    - Residuals |p - a_k| - d_k against all anchors: (M, S, K)
+    - The subset with most inliers (ties: smallest truncated squared residual) wins
+    - The inliers are refined with a few weighted Gauss-Newton steps
+    - Mobiles without a subset of 3 valid ranges (e.g. after gating) get no fix (NaN)
+- Innovation gating against a tracker prediction (x_pred, P_pred):
+    - nu = d - |x_pred - a|, S = h^T P_pred h + sigma_d^2
+    - A measurement is rejected when nu^2 / S > gate (chi-square, 1 degree of freedom)
+- Rejected measurements are counted per link (mobile x station), fixes without a position
+  per mobile
+
+Usage:
+    robust = esp_rtls_robust(anchors)
+    positions, inliers = robust.solve(tokenIDs, d, sigma_d, x_pred, P_pred)
+    robust.report()
+"""
+
+import itertools
+import numpy as np
+from esp_rtls_rows import esp_rtls_rows
+
+# Chi-square 99 % quantile with 1 degree of freedom
+GATE_99 = 6.63
+
+
+class esp_rtls_robust:
+    """
+    Description: RANSAC + Mahalanobis gating of range measurements
+
+    Attributes:
+    - anchors      [ndarray (K, 2)] => Positions of the stations (K > 3)
+    - threshold    [Float] => Residual in m below which a range is an inlier
+    - gate         [Float] => Gate on the squared normalized innovation
+    - links        [esp_rtls_rows] => Rows of the mobiles and their counters:
+        - rejected [ndarray (rows, K)] => Rejected measurements per link
+        - total    [ndarray (rows, K)] => Measurements per link
+        - unsolved [ndarray (rows,)] => Fixes without a valid subset per mobile
+        - fixes    [ndarray (rows,)] => Fixes per mobile
+
+    Methods:
+    - ransac(d) => Positions and inlier mask from the best anchor subset
+    - gating(d, sigma_d, x_pred, P_pred) => Mask of measurements inside the gate
+    - solve(tokenIDs, d, sigma_d, x_pred, P_pred) => Gated RANSAC fix, counts rejections
+    - report() => Rejection counts per link and unsolved fixes per mobile
+    """
+
+    def __init__(self, anchors, threshold=1.5, gate=GATE_99, refine_iterations=3):
+        self.anchors = np.asarray(anchors, dtype=float)
+        self.threshold = threshold
+        self.gate = gate
+        self.refine_iterations = refine_iterations
+        n_anchors = len(self.anchors)
+        self.links = esp_rtls_rows(capacity=8)
+        self.links.add("rejected", (n_anchors,), dtype=np.int64)
+        self.links.add("total", (n_anchors,), dtype=np.int64)
+        self.links.add("unsolved", dtype=np.int64)
+        self.links.add("fixes", dtype=np.int64)
+
+        # Pseudo-inverses of the linear trilateration systems of all 3-anchor subsets
+        self.__subsets = np.array(list(itertools.combinations(range(n_anchors), 3)))
+        a = self.anchors[self.__subsets]
+        A = 2 * (a[:, 1:] - a[:, :1])
+        self.__pinv = np.linalg.pinv(A)
+        self.__norm = np.sum(a[:, 1:] ** 2, axis=2) - np.sum(a[:, :1] ** 2, axis=2)
+
+    def ransac(self, d, valid=None):
+        """
+        Args:
+            d      [ndarray (M, K)] => Distances to the anchors
+            valid  [ndarray (M, K) bool] => Measurements that may be used (e.g. inside the gate)
+
+        Returns:
+            positions [ndarray (M, 2)] (NaN without a subset of 3 valid ranges),
+            inliers [ndarray (M, K) bool]
+        """
+        d = np.asarray(d, dtype=float)
+        if valid is None:
+            valid = np.isfinite(d)
+        d_sub = d[:, self.__subsets]
+        b = d_sub[:, :, :1] ** 2 - d_sub[:, :, 1:] ** 2 + self.__norm
+        candidates = np.einsum("sij,msj->msi", self.__pinv, b)
+
+        # Residuals of every candidate against every anchor
+        delta = candidates[:, :, None, :] - self.anchors[None, None, :, :]
+        residual = np.abs(np.hypot(delta[..., 0], delta[..., 1]) - d[:, None, :])
+        residual = np.where(valid[:, None, :] & np.isfinite(residual), residual, np.inf)
+        inlier = residual <= self.threshold
+        subset_ok = valid[:, self.__subsets].all(axis=2)
+        count = np.where(subset_ok, inlier.sum(axis=2), -1)
+        cost = np.minimum(residual, self.threshold) ** 2
+        cost = np.where(valid[:, None, :], cost, 0).sum(axis=2)
+        # Most inliers first, then the smallest cost (cost < K threshold^2 + 1)
+        best = np.argmax(count * (len(self.anchors) * self.threshold ** 2 + 1) - cost, axis=1)
+
+        m = np.arange(len(d))
+        # No subset of valid ranges: argmax picked a subset with gated-out ranges
+        solved = subset_ok.any(axis=1)
+        positions = np.where(solved[:, None], candidates[m, best], np.nan)
+        inliers = inlier[m, best] & solved[:, None]
+        positions[solved] = self.__refine(positions[solved], d[solved], inliers[solved])
+        return positions, inliers
+
+    def gating(self, d, sigma_d, x_pred, P_pred):
+        """
+        Args:
+            d        [ndarray (M, K)] => Distances to the anchors
+            sigma_d  [ndarray (M, K) or Float] => Standard deviation of the distances
+            x_pred   [ndarray (M, 2)] => Predicted positions of the tracker
+            P_pred   [ndarray (M, 2, 2)] => Covariance of the predictions
+
+        Returns:
+            [ndarray (M, K) bool] => True if the innovation is inside the gate
+        """
+        delta = np.asarray(x_pred, dtype=float)[:, None, :] - self.anchors[None, :, :]
+        r = np.maximum(np.hypot(delta[..., 0], delta[..., 1]), 1e-9)
+        h = delta / r[..., None]
+        nu = np.asarray(d, dtype=float) - r
+        S = np.einsum("mki,mij,mkj->mk", h, P_pred, h) + np.asarray(sigma_d, dtype=float) ** 2
+        return nu ** 2 / S <= self.gate
+
+    def solve(self, tokenIDs, d, sigma_d=None, x_pred=None, P_pred=None):
+        """
+        Args:
+            tokenIDs  [List] => TokenIDs of the mobiles (M,)
+            d         [ndarray (M, K)] => Distances to the anchors
+            sigma_d   [ndarray (M, K) or Float] => Standard deviation of the distances (for gating)
+            x_pred    [ndarray (M, 2)] => Predicted positions (None => no gating)
+            P_pred    [ndarray (M, 2, 2)] => Covariance of the predictions
+
+        Returns:
+            positions [ndarray (M, 2)], inliers [ndarray (M, K) bool]
+        """
+        d = np.asarray(d, dtype=float)
+        valid = np.isfinite(d)
+        if x_pred is not None:
+            valid &= self.gating(d, sigma_d, x_pred, P_pred)
+        positions, inliers = self.ransac(d, valid)
+
+        rows = self.links.get(tokenIDs)
+        measured = np.isfinite(d)
+        np.add.at(self.links.total, rows, measured)
+        np.add.at(self.links.rejected, rows, measured & ~inliers)
+        np.add.at(self.links.fixes, rows, 1)
+        np.add.at(self.links.unsolved, rows, np.isnan(positions[:, 0]))
+        return positions, inliers
+
+    def report(self):
+        """
+        Returns:
+            [Dictionary] => (tokenID, station index) => (rejected, total) for links with rejections,
+                            (tokenID, None) => (unsolved, fixes) for mobiles with unsolved fixes
+        """
+        report = {}
+        links = self.links
+        for tokenID, row in links.rows.items():
+            if links.unsolved[row]:
+                report[(tokenID, None)] = (int(links.unsolved[row]), int(links.fixes[row]))
+            for k in np.nonzero(links.rejected[row])[0].tolist():
+                report[(tokenID, k)] = (int(links.rejected[row, k]), int(links.total[row, k]))
+        return report
+
+    def __refine(self, positions, d, inliers):
+        """Weighted Gauss-Newton steps on the inliers"""
+        w = inliers.astype(float)
+        d = np.where(inliers, d, 0)
+        for _ in range(self.refine_iterations):
+            delta = positions[:, None, :] - self.anchors[None, :, :]
+            r = np.maximum(np.hypot(delta[..., 0], delta[..., 1]), 1e-9)
+            J = delta / r[..., None]
+            JtJ = np.einsum("mk,mki,mkj->mij", w, J, J)
+            Jtr = np.einsum("mk,mki,mk->mi", w, J, r - d)
+            ok = np.linalg.det(JtJ) > 1e-9
+            step = np.zeros_like(positions)
+            step[ok] = np.linalg.solve(JtJ[ok], Jtr[ok][..., None])[..., 0]
+            positions = positions - step
+        return positions
@@ -0,0 +1,101 @@
+"""
+Per-mobile state arrays: rows by tokenID, grown by doubling
+
+Description:
+- The streaming stages keep their per-mobile (or per-link) state in arrays with one row per tokenID
+    - A new tokenID gets the next row, rows never move, so one row indexes all arrays
+    - When the arrays are full, all of them are doubled at once
+- A batch may hold the same mobile more than once (several lines in one read)
+    - A vectorized update of its row keeps only the last value: state[rows] = ...
+    - occurrences(rows) splits the batch into rounds in which every row occurs at most once,
+      round k holds the k-th occurrence of each row, so the rounds keep the order of the batch
+
+Usage:
+    state = esp_rtls_rows(capacity=64)
+    state.add("d_last", (3,))
+    rows = state.get(tokenIDs)
+    for batch in occurrences(rows):
+        state.d_last[rows[batch]] = ...
+"""
+
+import numpy as np
+
+
+class esp_rtls_rows:
+    """
+    Description: Rows of the tokenIDs in a set of arrays that grow together
+
+    Attributes:
+    - rows       [Dictionary] => tokenID => row
+    - capacity   [Integer] => Rows of the arrays, doubled when full
+    - <name>     [ndarray] => Each array added with add(name, ...)
+
+    Methods:
+    - add(name, shape, dtype, fill, axis) => Add an array of capacity rows on axis
+    - get(tokenIDs) => Rows of the tokenIDs, new tokenIDs get new rows
+    """
+
+    def __init__(self, capacity=64):
+        self.rows = {}
+        self.capacity = capacity
+        self.__arrays = {}
+
+    def add(self, name, shape=(), dtype=float, fill=0, axis=0):
+        """
+        Args:
+            name   [String] => Attribute of the array
+            shape  [Tuple] => Shape of the array without the rows
+            dtype  [Type] => Type of the elements
+            fill   [Scalar or ndarray] => Value of new rows (broadcast to the shape of a row)
+            axis   [Integer] => Axis of the rows
+        """
+        self.__arrays[name] = (tuple(shape), dtype, fill, axis)
+        setattr(self, name, self.__new(name, self.capacity))
+
+    def get(self, tokenIDs):
+        """
+        Args:
+            tokenIDs  [List] => TokenIDs of the mobiles (M,)
+
+        Returns:
+            [ndarray (M,)] => Rows of the mobiles
+        """
+        rows = np.empty(len(tokenIDs), dtype=np.int64)
+        for i, tokenID in enumerate(tokenIDs):
+            row = self.rows.get(tokenID)
+            if row is None:
+                row = len(self.rows)
+                self.rows[tokenID] = row
+                if row >= self.capacity:
+                    self.__grow()
+            rows[i] = row
+        return rows
+
+    def __new(self, name, n):
+        shape, dtype, fill, axis = self.__arrays[name]
+        if axis == 0:
+            return np.full((n,) + shape, fill, dtype=dtype)
+        # Rows on another axis: fill is a scalar
+        return np.full(shape[:axis] + (n,) + shape[axis:], fill, dtype=dtype)
+
+    def __grow(self):
+        for name, (_, _, _, axis) in self.__arrays.items():
+            setattr(self, name, np.concatenate([getattr(self, name), self.__new(name, self.capacity)], axis=axis))
+        self.capacity *= 2
+
+
+def occurrences(rows):
+    """
+    Args:
+        rows  [ndarray (M,)] => Rows of a batch
+
+    Returns:
+        [List of ndarray (M,) bool] => Masks of the rounds, each row at most once per round
+    """
+    occurrence = np.zeros(len(rows), dtype=np.int64)
+    if len(rows) != len(np.unique(rows)):
+        seen = {}
+        for i, row in enumerate(rows.tolist()):
+            occurrence[i] = seen.get(row, 0)
+            seen[row] = occurrence[i] + 1
+    return [occurrence == k for k in range(int(occurrence.max(initial=-1)) + 1)]
@@ -0,0 +1,213 @@
+"""
+Synthetic trajectory and RSSI stream generator for load testing the host app (app.py)
+
+Description:
+- Mobiles move through the floor with a random waypoint model
+- Ranges to the anchors are converted to RSSI with the same log-distance model as get_distance
+    - Plus gaussian shadowing noise (in dB)
+- Every ring cycle produces one line per mobile, in the format of station 1
+    - Untagged format: (rssi1, rssi2, rssi3)          => only for a single mobile
+    - Tagged format:   tokenID:(rssi1, rssi2, rssi3)  => for many mobiles
+- Seeded: the same seed gives the same stream
+
+Usage:
+    python esp_rtls_simulator.py --mobiles 100 --tagged --serve 7777
+    python app.py socket://localhost:7777
+"""
+
+import argparse
+import socket
+import sys
+import time
+import numpy as np
+from esp_rtls_positioning import calc_anchor_position, point_in_polygon, RSSI_AT_1_METER, PATH_LOSS_EXPONENT
+
+# String table for RSSI values (RSSI is send as a single byte by the stations)
+_RSSI_STR = [str(rssi) for rssi in range(256)]
+
+
+def default_anchors():
+    """Anchors as placed by app.py: station 1 in (0, 0), 6 m between the stations"""
+    x2, y2, x3, y3 = calc_anchor_position(0, 0, 6, 6, 6)
+    return np.array([[0, 0], [x2, y2], [x3, y3]], dtype=float)
+
+
+class esp_rtls_simulator:
+    """
+    Description: Simulates the trajectories of mobiles and the RSSI measured by the stations
+
+    Attributes:
+    - anchors          [ndarray (K, 2)] => Positions of the stations
+    - floor            [ndarray (V, 2)] => Floor polygon, the mobiles stay inside it
+    - position         [ndarray (M, 2)] => Current position of the mobiles
+    - tokenIDs         [ndarray (M,)]   => TokenIDs of the mobiles (1..M)
+
+    Methods:
+    - step(dt) => Move the mobiles dt seconds
+    - rssi() => RSSI of all mobiles to all stations
+    - lines(tagged) => One ring cycle as lines in the serial format
+    - stream(...) => Generator of ring cycles
+    """
+
+    def __init__(
+        self,
+        n_mobiles,
+        anchors=None,
+        floor=None,
+        speed=(0.5, 1.5),
+        rssi_at_1_meter=RSSI_AT_1_METER,
+        n=PATH_LOSS_EXPONENT,
+        shadowing_sigma=2.0,
+        seed=None,
+    ):
+        self.anchors = default_anchors() if anchors is None else np.asarray(anchors, dtype=float)
+        if floor is None:
+            # Bounding box of the anchors with a margin of 2 m
+            min_xy = self.anchors.min(axis=0) - 2
+            max_xy = self.anchors.max(axis=0) + 2
+            floor = [min_xy, [max_xy[0], min_xy[1]], max_xy, [min_xy[0], max_xy[1]]]
+        self.floor = np.asarray(floor, dtype=float)
+        self.rssi_at_1_meter = rssi_at_1_meter
+        self.n = n
+        self.shadowing_sigma = shadowing_sigma
+        self.speed_range = speed
+        self.tokenIDs = np.arange(1, n_mobiles + 1)
+
+        self.__rng = np.random.default_rng(seed)
+        self.__min_xy = self.floor.min(axis=0)
+        self.__max_xy = self.floor.max(axis=0)
+        self.position = self.__random_points(n_mobiles)
+        self.__target = self.__random_points(n_mobiles)
+        self.__speed = self.__rng.uniform(speed[0], speed[1], n_mobiles)
+
+    def step(self, dt):
+        """
+        Move the mobiles towards their waypoint, a new waypoint is drawn when reached
+
+        Args:
+            dt  [Float] => Time step in seconds
+        """
+        delta = self.__target - self.position
+        dist = np.hypot(delta[:, 0], delta[:, 1])
+        move = self.__speed * dt
+        reached = dist <= move
+        scale = np.divide(move, dist, out=np.zeros_like(dist), where=~reached)
+        self.position += delta * scale[:, None]
+        self.position[reached] = self.__target[reached]
+
+        n_reached = int(reached.sum())
+        if n_reached:
+            self.__target[reached] = self.__random_points(n_reached)
+            self.__speed[reached] = self.__rng.uniform(
+                self.speed_range[0], self.speed_range[1], n_reached
+            )
+
+    def rssi(self):
+        """
+        RSSI of all mobiles to all stations (inverse of get_distance plus shadowing)
+
+        Returns:
+            [ndarray (M, K) uint8] => RSSI as send by the stations (absolute value)
+        """
+        delta = self.position[:, None, :] - self.anchors[None, :, :]
+        distance = np.maximum(np.hypot(delta[..., 0], delta[..., 1]), 0.1)
+        rssi = self.rssi_at_1_meter + 10 * self.n * np.log10(distance)
+        if self.shadowing_sigma > 0:
+            rssi += self.__rng.normal(0, self.shadowing_sigma, rssi.shape)
+        return np.clip(np.rint(rssi), 0, 255).astype(np.uint8)
+
+    def lines(self, tagged=True):
+        """
+        One ring cycle in the serial format
+
+        Args:
+            tagged  [Boolean] => Prefix the lines with the tokenID
+
+        Returns:
+            [String] => All lines of the ring cycle, terminated with \\r\\n
+        """
+        rssi = self.rssi().tolist()
+        if tagged:
+            return "".join(
+                [
+                    str(tokenID) + ":(" + ", ".join([_RSSI_STR[r] for r in row]) + ")\r\n"
+                    for tokenID, row in zip(self.tokenIDs.tolist(), rssi)
+                ]
+            )
+        if len(rssi) != 1:
+            raise ValueError("Untagged format only supports a single mobile")
+        return "(" + ", ".join([_RSSI_STR[r] for r in rssi[0]]) + ")\r\n"
+
+    def stream(self, cycle_time=0.5, tagged=True, n_cycles=None):
+        """
+        Generator of ring cycles
+
+        Args:
+            cycle_time  [Float] => Simulated time of one ring cycle in seconds
+            tagged      [Boolean] => Use the tagged format
+            n_cycles    [Integer] => Number of cycles (None => endless)
+        """
+        cycle = 0
+        while n_cycles is None or cycle < n_cycles:
+            yield self.lines(tagged)
+            self.step(cycle_time)
+            cycle += 1
+
+    def __random_points(self, count):
+        """Uniform random points inside the floor polygon (rejection sampling)"""
+        points = np.empty((count, 2))
+        filled = 0
+        while filled < count:
+            candidates = self.__rng.uniform(self.__min_xy, self.__max_xy, (2 * (count - filled) + 8, 2))
+            candidates = candidates[point_in_polygon(candidates, self.floor)]
+            take = min(len(candidates), count - filled)
+            points[filled:filled + take] = candidates[:take]
+            filled += take
+        return points
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic RSSI stream for app.py")
+    parser.add_argument("--mobiles", type=int, default=1, help="Number of mobiles")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of the generator")
+    parser.add_argument("--tagged", action="store_true", help="Prefix lines with the tokenID")
+    parser.add_argument("--sigma", type=float, default=2.0, help="Shadowing noise in dB")
+    parser.add_argument("--cycle-time", type=float, default=0.5, help="Simulated ring cycle time in s")
+    parser.add_argument("--cycles", type=int, default=None, help="Number of ring cycles (default: endless)")
+    parser.add_argument("--realtime", action="store_true", help="Sleep the cycle time between cycles")
+    parser.add_argument("--serve", type=int, default=None, help="Serve on a TCP port (socket:// in app.py)")
+    args = parser.parse_args()
+
+    simulator = esp_rtls_simulator(
+        args.mobiles, shadowing_sigma=args.sigma, seed=args.seed
+    )
+    tagged = args.tagged or args.mobiles > 1
+
+    if args.serve is not None:
+        server = socket.create_server(("localhost", args.serve))
+        print("Waiting for app.py on socket://localhost:" + str(args.serve), file=sys.stderr)
+        conn = [server.accept()[0]]
+
+        def write(data):
+            # Wait for the next client when one disconnects, like a port that is reopened
+            while True:
+                try:
+                    conn[0].sendall(data.encode())
+                    return
+                except (BrokenPipeError, ConnectionResetError):
+                    conn[0].close()
+                    conn[0] = server.accept()[0]
+    else:
+        write = lambda data: sys.stdout.write(data)
+
+    try:
+        for cycle in simulator.stream(args.cycle_time, tagged, args.cycles):
+            write(cycle)
+            if args.realtime:
+                time.sleep(args.cycle_time)
+    except (BrokenPipeError, ConnectionResetError, KeyboardInterrupt):
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""
+Offline Rauch-Tung-Striebel trajectory smoother for recorded sessions
+
+Description:
+- Constant velocity model, state [x, y, vx, vy], per mobile
+- Forward pass: Kalman filter over the fixes (missing fixes => prediction only)
+- Backward pass: RTS smoother, so every fix uses the fixes before and after it
+- Each mobile runs on its own time: a sample predicts and updates only the mobiles with a fix
+  in it (time step = time since the previous fix of that mobile), vectorized across them
+    - Work is O(fixes), not O(samples x mobiles): recordings with a timestamp per fix have
+      one fix per sample
+- Streams in chunks with a fixed lag in seconds, so memory stays bounded on very long recordings
+    - The forward results of the last lag_s seconds are kept between chunks
+    - A fix is emitted when the buffer holds lag_s seconds of data after it
+    - The backward gain decays with the time between fixes (faster with larger q / smaller sigma):
+      fixes more than a few seconds later barely change a fix, so a lag of a few seconds
+      is close to the full RTS smoother, but not equal to it
+
+Input recording (CSV, sorted by time): t, tokenID, x, y
+Output (CSV): t, tokenID, x, y, vx, vy
+    - One row per fix of the recording (smoothed at the time of the fix)
+    - --all-frames: a row for every mobile at every time in the recording
+      (predicted between its fixes)
+
+Usage:
+    python esp_rtls_smoother.py session.csv smoothed.csv [--lag 10] [--all-frames]
+"""
+
+import argparse
+import collections
+import csv
+import numpy as np
+
+
+def _transition(dt):
+    """Transitions (N, 4, 4) over the time steps dt (N,)"""
+    F = np.tile(np.eye(4), (len(dt), 1, 1))
+    F[:, 0, 2] = F[:, 1, 3] = dt
+    return F
+
+
+def _process_noise(dt, q):
+    """Process noise (N, 4, 4) of white noise acceleration with spectral density q over dt (N,)"""
+    Q = np.zeros((len(dt), 4, 4))
+    Q[:, 0, 0] = Q[:, 1, 1] = dt ** 3 / 3 * q
+    Q[:, 0, 2] = Q[:, 2, 0] = Q[:, 1, 3] = Q[:, 3, 1] = dt ** 2 / 2 * q
+    Q[:, 2, 2] = Q[:, 3, 3] = dt * q
+    return Q
+
+
+class esp_rtls_smoother:
+    """
+    Description: Fixed-lag chunked forward Kalman + backward RTS smoother
+
+    Attributes:
+    - n_mobiles    [Integer] => Number of mobiles (columns of the fixes)
+    - q            [Float] => Acceleration noise density in m^2/s^3
+    - sigma        [Float] => Standard deviation of a fix in m (when no covariance is given)
+    - lag_s        [Float] => Time after a sample before it is emitted in s
+
+    Methods:
+    - process(t, z, R) => Add a chunk, returns the smoothed fixes that are final
+    - finish() => Smoothed remaining fixes
+    """
+
+    def __init__(self, n_mobiles, q=0.5, sigma=1.0, lag_s=10.0):
+        self.n_mobiles = n_mobiles
+        self.q = q
+        self.sigma = sigma
+        self.lag_s = lag_s
+
+        self.__x = np.zeros((n_mobiles, 4))
+        self.__P = np.tile(np.diag([1e6, 1e6, 1e2, 1e2]), (n_mobiles, 1, 1))
+        self.__t_last = np.full(n_mobiles, np.nan)
+
+        # Forward results of the samples not emitted yet, only of the mobiles with a fix
+        self.__buffer = {"t": [], "mobile": [], "F": [], "x_pred": [], "P_pred": [], "x": [], "P": []}
+
+    def process(self, t, z, R=None):
+        """
+        Args:
+            t  [ndarray (T,)] => Time of the samples in s (increasing)
+            z  [ndarray (T, M, 2)] => Fixes (NaN => no fix of the mobile in this sample)
+            R  [ndarray (T, M, 2, 2)] => Covariance of the fixes (None => sigma^2 I)
+
+        Returns:
+            t [ndarray (N,)], mobile [ndarray (N,)], x [ndarray (N, 4)], P [ndarray (N, 4, 4)]
+            of the final fixes, in order of time
+        """
+        z = np.asarray(z, dtype=float)
+        for k in range(len(t)):
+            self.__forward(t[k], z[k], None if R is None else R[k])
+        if not self.__buffer["t"]:
+            return self.__smooth(0)
+        # Samples with lag_s of data after them
+        return self.__smooth(int(np.searchsorted(self.__buffer["t"], self.__buffer["t"][-1] - self.lag_s, "right")))
+
+    def finish(self):
+        return self.__smooth(len(self.__buffer["t"]))
+
+    def __forward(self, t, z, R):
+        mobile = np.nonzero(~np.isnan(z[:, 0]))[0]
+        if len(mobile) == 0:
+            return
+        # Prediction of each mobile from its own previous fix
+        dt = np.nan_to_num(t - self.__t_last[mobile])
+        F = _transition(dt)
+        x_pred = np.einsum("mij,mj->mi", F, self.__x[mobile])
+        P_pred = F @ self.__P[mobile] @ F.transpose(0, 2, 1) + _process_noise(dt, self.q)
+
+        if R is None:
+            R_obs = np.tile(np.eye(2) * self.sigma ** 2, (len(mobile), 1, 1))
+        else:
+            R_obs = R[mobile]
+        y = z[mobile] - x_pred[:, :2]
+        S = P_pred[:, :2, :2] + R_obs
+        # K = P H^T S^-1 (H selects x, y)
+        K = np.linalg.solve(S, P_pred[:, :2, :]).transpose(0, 2, 1)
+        x = x_pred + np.einsum("mij,mj->mi", K, y)
+        P = P_pred - K @ P_pred[:, :2, :]
+
+        self.__x[mobile] = x
+        self.__P[mobile] = P
+        self.__t_last[mobile] = t
+        buffer = self.__buffer
+        buffer["t"].append(t)
+        buffer["mobile"].append(mobile)
+        buffer["F"].append(F)
+        buffer["x_pred"].append(x_pred)
+        buffer["P_pred"].append(P_pred)
+        buffer["x"].append(x)
+        buffer["P"].append(P)
+
+    def __smooth(self, n_emit):
+        """RTS backward pass over the buffer, per mobile along its own fixes, emits the first n_emit samples"""
+        buffer = self.__buffer
+        n = len(buffer["t"])
+        n_emit = max(0, min(n_emit, n))
+        if n_emit == 0:
+            return np.zeros(0), np.zeros(0, dtype=np.int64), np.zeros((0, 4)), np.zeros((0, 4, 4))
+
+        # Smoothed state and prediction of the next fix of each mobile (walking backwards)
+        has_next = np.zeros(self.n_mobiles, dtype=bool)
+        x_s = np.zeros((self.n_mobiles, 4))
+        P_s = np.zeros((self.n_mobiles, 4, 4))
+        F_next = np.zeros((self.n_mobiles, 4, 4))
+        x_pred_next = np.zeros((self.n_mobiles, 4))
+        P_pred_next = np.zeros((self.n_mobiles, 4, 4))
+        out = []
+        for k in range(n - 1, -1, -1):
+            mobile = buffer["mobile"][k]
+            x = buffer["x"][k].copy()
+            P = buffer["P"][k].copy()
+            later = has_next[mobile]
+            if later.any():
+                m = mobile[later]
+                # C = P_f F^T P_pred^-1
+                C = np.linalg.solve(P_pred_next[m], F_next[m] @ P[later]).transpose(0, 2, 1)
+                x[later] += np.einsum("mij,mj->mi", C, x_s[m] - x_pred_next[m])
+                P[later] += C @ (P_s[m] - P_pred_next[m]) @ C.transpose(0, 2, 1)
+            x_s[mobile] = x
+            P_s[mobile] = P
+            F_next[mobile] = buffer["F"][k]
+            x_pred_next[mobile] = buffer["x_pred"][k]
+            P_pred_next[mobile] = buffer["P_pred"][k]
+            has_next[mobile] = True
+            if k < n_emit:
+                out.append((np.full(len(mobile), buffer["t"][k]), mobile, x, P))
+
+        out.reverse()
+        for key in buffer:
+            del buffer[key][:n_emit]
+        return tuple(np.concatenate([part[i] for part in out]) for i in range(4))
+
+
+def smooth_session(t, z, R=None, q=0.5, sigma=1.0, lag_s=10.0, chunk=1000):
+    """
+    Smooth a whole session held in memory (see esp_rtls_smoother for the arguments)
+
+    Returns:
+        x [ndarray (T, M, 4)], P [ndarray (T, M, 4, 4)] (NaN where a mobile has no fix)
+    """
+    t = np.asarray(t, dtype=float)
+    smoother = esp_rtls_smoother(z.shape[1], q, sigma, lag_s)
+    parts = []
+    for start in range(0, len(t), chunk):
+        stop = start + chunk
+        parts.append(smoother.process(t[start:stop], z[start:stop], None if R is None else R[start:stop]))
+    parts.append(smoother.finish())
+    x = np.full((len(t), z.shape[1], 4), np.nan)
+    P = np.full((len(t), z.shape[1], 4, 4), np.nan)
+    for t_fix, mobile, x_fix, P_fix in parts:
+        # Samples have distinct times
+        sample = np.searchsorted(t, t_fix)
+        x[sample, mobile] = x_fix
+        P[sample, mobile] = P_fix
+    return x, P
+
+
+def _read_frames(filename, columns):
+    """Frames (t, z) of a CSV recording sorted by time, z NaN for missing mobiles"""
+    frame_t = None
+    frame_z = None
+    with open(filename, newline="") as file:
+        for row in csv.reader(file):
+            if not row or row[0].startswith("t"):
+                continue
+            t = float(row[0])
+            if t != frame_t:
+                if frame_t is not None:
+                    yield frame_t, frame_z
+                frame_t = t
+                frame_z = np.full((len(columns), 2), np.nan)
+            frame_z[columns[int(row[1])]] = (float(row[2]), float(row[3]))
+    if frame_t is not None:
+        yield frame_t, frame_z
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RTS smoothing of a recorded session")
+    parser.add_argument("recording", help="CSV: t, tokenID, x, y (sorted by t)")
+    parser.add_argument("output", help="CSV: t, tokenID, x, y, vx, vy")
+    parser.add_argument("--q", type=float, default=0.5, help="Acceleration noise density")
+    parser.add_argument("--sigma", type=float, default=1.0, help="Standard deviation of a fix in m")
+    parser.add_argument("--lag", type=float, default=10.0, help="Fixed lag in s")
+    parser.add_argument("--chunk", type=int, default=1000, help="Samples per chunk")
+    parser.add_argument("--all-frames", action="store_true", help="Write every mobile at every time of the recording")
+    args = parser.parse_args()
+
+    # First pass: the mobiles in the recording
+    tokenIDs = set()
+    with open(args.recording, newline="") as file:
+        for row in csv.reader(file):
+            if row and not row[0].startswith("t"):
+                tokenIDs.add(int(row[1]))
+    tokenIDs = sorted(tokenIDs)
+    columns = {tokenID: i for i, tokenID in enumerate(tokenIDs)}
+
+    smoother = esp_rtls_smoother(len(tokenIDs), args.q, args.sigma, args.lag)
+    with open(args.output, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["t", "tokenID", "x", "y", "vx", "vy"])
+
+        # Times of the recording not written yet, last smoothed fix per mobile (--all-frames)
+        pending = collections.deque()
+        last_t = np.full(len(tokenIDs), np.nan)
+        last_x = np.zeros((len(tokenIDs), 4))
+
+        def write(result):
+            for t, mobile, x in zip(result[0].tolist(), result[1].tolist(), result[2]):
+                if args.all_frames:
+                    # Earlier times: every mobile without a fix then, predicted from its last fix
+                    while pending and pending[0] < t:
+                        write_predicted(pending.popleft())
+                last_t[mobile] = t
+                last_x[mobile] = x
+                writer.writerow([t, tokenIDs[mobile]] + [round(v, 4) for v in x.tolist()])
+
+        def write_predicted(t):
+            mobile = np.nonzero(last_t < t)[0]
+            x = np.einsum("mij,mj->mi", _transition(t - last_t[mobile]), last_x[mobile])
+            for m, state in zip(mobile.tolist(), x.tolist()):
+                writer.writerow([t, tokenIDs[m]] + [round(v, 4) for v in state])
+
+        chunk_t, chunk_z = [], []
+        for t, z in _read_frames(args.recording, columns):
+            chunk_t.append(t)
+            chunk_z.append(z)
+            if args.all_frames:
+                pending.append(t)
+            if len(chunk_t) == args.chunk:
+                write(smoother.process(np.array(chunk_t), np.array(chunk_z)))
+                chunk_t, chunk_z = [], []
+        if chunk_t:
+            write(smoother.process(np.array(chunk_t), np.array(chunk_z)))
+        write(smoother.finish())
+        if args.all_frames:
+            for t in pending:
+                write_predicted(t)
+
+
+if __name__ == "__main__":
+    main()
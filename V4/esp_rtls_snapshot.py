@@ -0,0 +1,134 @@
+"""
+Periodic snapshots of the tracker state, for a warm restart of the host app
+
+Description:
+- State: a dictionary of NumPy arrays (filters, calibration, anchors), saved with np.savez
+- Writes are atomic: a temporary file in the same directory, fsync, then os.replace
+    - A crash while writing leaves the previous snapshot intact
+- The main loop only copies the (small) arrays when a snapshot is due,
+  compressing and writing is done by a background thread
+    - Only the latest state waits to be written, older pending states are dropped
+- Helpers to turn per-tokenID dictionaries into arrays and back
+
+Usage:
+    snapshotter = esp_rtls_snapshotter("state.npz", interval_s=10)
+    state = load_snapshot("state.npz")
+    ...
+    if snapshotter.due():
+        snapshotter.submit({"anchors": anchors, ...})
+"""
+
+import os
+import queue
+import stat
+import tempfile
+import threading
+import time
+import numpy as np
+
+
+def save_snapshot(filename, state):
+    """
+    Args:
+        filename  [String] => Snapshot file (.npz)
+        state     [Dictionary] => name => ndarray
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    handle, temporary = tempfile.mkstemp(prefix=".snapshot-", suffix=".npz", dir=directory)
+    try:
+        with os.fdopen(handle, "wb") as file:
+            np.savez_compressed(file, **state)
+            file.flush()
+            os.fsync(file.fileno())
+        # mkstemp creates the file with mode 0600: keep the mode of the snapshot it replaces
+        try:
+            mode = stat.S_IMODE(os.stat(filename).st_mode)
+        except FileNotFoundError:
+            mode = 0o644
+        os.chmod(temporary, mode)
+        os.replace(temporary, filename)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def load_snapshot(filename):
+    """
+    Returns:
+        [Dictionary] => name => ndarray, or None if there is no (valid) snapshot
+    """
+    if not os.path.exists(filename):
+        return None
+    try:
+        with np.load(filename) as data:
+            return {name: data[name] for name in data.files}
+    except (OSError, ValueError):
+        return None
+
+
+def table_to_arrays(table, width):
+    """tokenID => tuple of width values, as arrays: tokenIDs (N,), values (N, width)"""
+    tokenIDs = np.array(list(table.keys()), dtype=np.int64)
+    values = np.array(list(table.values()), dtype=float).reshape(len(tokenIDs), width)
+    return tokenIDs, values
+
+
+def arrays_to_table(tokenIDs, values):
+    """Inverse of table_to_arrays"""
+    return {tokenID: tuple(row) for tokenID, row in zip(tokenIDs.tolist(), values.tolist())}
+
+
+class esp_rtls_snapshotter:
+    """
+    Description: Periodic atomic snapshots written by a background thread
+
+    Attributes:
+    - filename     [String] => Snapshot file (.npz)
+    - interval_s   [Float] => Time between snapshots in s
+
+    Methods:
+    - due() => True when a snapshot should be taken
+    - submit(state) => Copy the state and hand it to the writer thread
+    - close() => Write the pending snapshot and stop the thread
+    """
+
+    def __init__(self, filename, interval_s=10.0):
+        self.filename = filename
+        self.interval_s = interval_s
+        self.__next = time.monotonic() + interval_s
+        self.__pending = queue.Queue(maxsize=1)
+        self.__thread = threading.Thread(target=self.__write, name="esp_rtls_snapshot", daemon=True)
+        self.__thread.start()
+
+    def due(self):
+        now = time.monotonic()
+        if now < self.__next:
+            return False
+        self.__next = now + self.interval_s
+        return True
+
+    def submit(self, state):
+        state = {name: np.array(value) for name, value in state.items()}
+        # Replace a state that is still waiting
+        try:
+            self.__pending.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            self.__pending.put_nowait(state)
+        except queue.Full:
+            pass
+
+    def close(self):
+        self.__pending.put(None)
+        self.__thread.join()
+
+    def __write(self):
+        while True:
+            state = self.__pending.get()
+            if state is None:
+                return
+            try:
+                save_snapshot(self.filename, state)
+            except OSError as error:
+                print("snapshot failed: ", error)
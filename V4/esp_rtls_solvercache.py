@@ -0,0 +1,154 @@
+"""
+Cache of the trilateration pseudo-inverses per anchor subset
+
+Description:
+- The linear system of get_positions only depends on the anchors:
+    - A = 2 * (anchors[1:] - anchors[0]), c = |anchors[1:]|^2 - |anchors[0]|^2
+    - Position = (d[0]^2 - d[1:]^2 + c) @ pinv(A).T
+- pinv(A).T and c are computed once per anchor subset (mask of the used anchors, e.g. without
+  the stations excluded by esp_rtls_linkhealth.py), a fix is then a small matrix-vector product
+- Entries are keyed by the mask (bitmask of the anchor indices)
+    - set_anchors drops the entries that use a moved or removed (NaN) anchor
+    - At most 2^K entries for K anchors
+- Same positions as get_positions (and get_position for 3 anchors)
+- Single fixes (app.py, one line at a time): solve_one
+    - 3 anchors: closed form of get_position with the coefficients A, B, D, E, the
+      constants and the determinant cached per mask, as plain floats (no NumPy call per fix)
+    - More anchors: pseudo-inverse of the mask
+
+Usage:
+    cache = esp_rtls_solver_cache(anchors)
+    positions = cache.solve(d)                 # All anchors
+    positions = cache.solve(d, usable)         # Mask per anchor (K,) or per fix (M, K)
+    x, y = cache.solve_one((d1, d2, d3))       # One fix
+"""
+
+import numpy as np
+
+
+class esp_rtls_solver_cache:
+    """
+    Description: Trilateration with cached pseudo-inverses per anchor subset
+
+    Attributes:
+    - anchors   [ndarray (K, 2)] => Positions of the anchors (NaN = removed)
+    - entries   [Dictionary] => mask => (pinv(A).T, c, reference anchor index, anchor indices)
+
+    Methods:
+    - set_anchors(anchors) => Change the anchors, drop the entries that use changed anchors
+    - solve(d, mask) => Positions of the fixes, NaN for fixes with fewer than 3 usable anchors
+    - solve_one(d, mask) => Position (x, y) of one fix, NaN with fewer than 3 usable anchors
+    """
+
+    def __init__(self, anchors):
+        self.anchors = np.asarray(anchors, dtype=float).copy()
+        self.entries = {}
+        # mask => closed form coefficients (3 anchors) or None (solved with the pseudo-inverse)
+        self.__closed_form = {}
+        self.__available = self.__available_bits()
+
+    def set_anchors(self, anchors):
+        anchors = np.asarray(anchors, dtype=float)
+        if anchors.shape != self.anchors.shape:
+            self.anchors = anchors.copy()
+            self.entries.clear()
+            self.__closed_form.clear()
+            self.__available = self.__available_bits()
+            return
+        changed = np.any(anchors != self.anchors, axis=1) | np.any(np.isnan(anchors), axis=1)
+        if not changed.any():
+            return
+        changed_bits = int(np.sum(1 << np.nonzero(changed)[0].astype(np.int64)))
+        for key in [key for key in self.entries if key & changed_bits]:
+            del self.entries[key]
+        for key in [key for key in self.__closed_form if key & changed_bits]:
+            del self.__closed_form[key]
+        self.anchors = anchors.copy()
+        self.__available = self.__available_bits()
+
+    def solve(self, d, mask=None):
+        """
+        Args:
+            d     [ndarray (M, K)] => Distances of the mobiles to the anchors
+            mask  [ndarray (K,) or (M, K) bool] => Anchors to use (default: all that are not removed)
+
+        Returns:
+            [ndarray (M, 2)] => Positions (NaN with fewer than 3 usable anchors)
+        """
+        d = np.asarray(d, dtype=float)
+        usable = ~np.any(np.isnan(self.anchors), axis=1)
+        if mask is not None:
+            usable = usable & np.asarray(mask, dtype=bool)
+        bits = 1 << np.arange(d.shape[1], dtype=np.int64)
+        if usable.ndim == 1:
+            # Same anchors for all fixes: one product, no grouping
+            entry = self.__entry(int(usable @ bits))
+            if entry is None:
+                return np.full((len(d), 2), np.nan)
+            pinv_t, c, reference, others = entry
+            return (d[:, reference, None] ** 2 - d[:, others] ** 2 + c) @ pinv_t
+
+        keys = usable @ bits
+        positions = np.full((len(d), 2), np.nan)
+        for key in np.unique(keys).tolist():
+            entry = self.__entry(key)
+            if entry is None:
+                continue
+            pinv_t, c, reference, others = entry
+            rows = d[keys == key]
+            positions[keys == key] = (rows[:, reference, None] ** 2 - rows[:, others] ** 2 + c) @ pinv_t
+        return positions
+
+    def solve_one(self, d, mask=None):
+        """
+        Args:
+            d     [Sequence (K,)] => Distances of the mobile to the anchors
+            mask  [Sequence (K,) bool] => Anchors to use (default: all that are not removed)
+
+        Returns:
+            (x, y) [Float] => Position (NaN with fewer than 3 usable anchors)
+        """
+        key = self.__available
+        if mask is not None:
+            key &= sum(1 << k for k, used in enumerate(mask) if used)
+        if key not in self.__closed_form:
+            self.__closed_form[key] = self.__closed_form_entry(key)
+        entry = self.__closed_form[key]
+        if entry is None:
+            x, y = self.solve(np.asarray(d, dtype=float)[None], (key >> np.arange(len(self.anchors))) & 1)[0]
+            return float(x), float(y)
+        i, j, k, A, B, D, E, c1, c2, det = entry
+        C = d[i] ** 2 - d[j] ** 2 + c1
+        F = d[j] ** 2 - d[k] ** 2 + c2
+        return (C * E - F * B) / det, (A * F - C * D) / det
+
+    def __closed_form_entry(self, key):
+        """Coefficients of get_position for a mask of exactly 3 anchors with a regular system"""
+        used = [k for k in range(len(self.anchors)) if key >> k & 1]
+        if len(used) != 3:
+            return None
+        (x1, y1), (x2, y2), (x3, y3) = self.anchors[used].tolist()
+        A = 2 * x2 - 2 * x1
+        B = 2 * y2 - 2 * y1
+        D = 2 * x3 - 2 * x2
+        E = 2 * y3 - 2 * y2
+        det = E * A - B * D
+        if det == 0:
+            return None
+        return (*used, A, B, D, E, -x1 ** 2 + x2 ** 2 - y1 ** 2 + y2 ** 2, -x2 ** 2 + x3 ** 2 - y2 ** 2 + y3 ** 2, det)
+
+    def __available_bits(self):
+        return sum(1 << k for k in np.nonzero(~np.any(np.isnan(self.anchors), axis=1))[0].tolist())
+
+    def __entry(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            used = np.nonzero((key >> np.arange(len(self.anchors))) & 1)[0]
+            if len(used) < 3:
+                return None
+            anchors = self.anchors[used]
+            A = 2 * (anchors[1:] - anchors[0])
+            c = np.sum(anchors[1:] ** 2, axis=1) - np.sum(anchors[0] ** 2)
+            entry = (np.linalg.pinv(A).T, c, used[0], used[1:])
+            self.entries[key] = entry
+        return entry
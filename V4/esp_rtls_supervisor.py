@@ -0,0 +1,352 @@
+"""
+Multi-site supervisor: the ingest and solve pipelines of several sites on a pool of workers
+
+Description:
+- Sites (buildings) are described in a JSON file:
+    [{"name": "building-a", "port": "COM3", "anchors": [[x, y], ...]}, ...]
+    - anchors is optional (default: calc_anchor_position(0, 0, 6, 6, 6) as in app.py)
+    - Exactly 3 anchors per site (RSSI_RECORD holds 3 RSSI values), others are rejected
+- n_workers worker processes; each reads the ports of its sites (non-blocking) and solves
+  their lines with one esp_rtls_solver per site
+- Load of a site = lines per second, counted by the worker in a shared array
+- Assignment of the sites to the workers: longest processing time first (LPT)
+    - Heaviest site first, always to the least loaded worker
+    - Re-computed every rebalance_s; applied when it lowers the most loaded worker
+      by more than the imbalance factor
+    - A site is moved with its solver state: the old worker releases it (closes the port,
+      sends the state back), then the new worker opens it
+    - Ports that can't be opened are retried every second
+    - A worker that doesn't answer a release within reply_timeout is considered dead:
+      it is restarted and its sites are assigned again without their solver state
+- Output: each worker has an esp_rtls_ring (SPSC, shared memory) to the supervisor, the
+  supervisor merges them into one stream of records with a site index
+- Metrics per site (fixes, load, worker) through esp_rtls_metrics
+
+Usage:
+    python esp_rtls_supervisor.py sites.json [--workers N] [--metrics PORT]
+    - Prints the merged stream as CSV: site, t, tokenID, x, y, gdop
+"""
+
+import argparse
+import json
+import queue
+import signal
+import sys
+import time
+import numpy as np
+import multiprocessing
+from esp_rtls_positioning import calc_anchor_position, parse_line
+from esp_rtls_pipeline import RSSI_RECORD, POSITION_RECORD, esp_rtls_solver
+from esp_rtls_ring import esp_rtls_ring
+
+# Record of the merged stream
+SITE_RECORD = np.dtype(POSITION_RECORD.descr + [("site", "i4")])
+
+
+def lpt(loads, n_workers):
+    """
+    Longest processing time first assignment
+
+    Args:
+        loads      [List] => Load per site
+        n_workers  [Integer] => Number of workers
+
+    Returns:
+        [ndarray (sites,)] => Worker of each site
+    """
+    assignment = np.zeros(len(loads), dtype=np.int64)
+    worker_load = np.zeros(n_workers)
+    for site in np.argsort(-np.asarray(loads, dtype=float), kind="stable").tolist():
+        worker = int(np.argmin(worker_load))
+        assignment[site] = worker
+        worker_load[worker] += loads[site]
+    return assignment
+
+
+def worker_load(assignment, loads, n_workers):
+    """Total load per worker"""
+    return np.bincount(assignment, weights=loads, minlength=n_workers)
+
+
+def site_anchors(site):
+    if "anchors" in site:
+        return np.asarray(site["anchors"], dtype=float)[:, :2]
+    x2, y2, x3, y3 = calc_anchor_position(0, 0, 6, 6, 6)
+    return np.array([[0, 0], [x2, y2], [x3, y3]])
+
+
+def _worker(index, sites, commands, replies, ring_name, capacity, lines, stop):
+    """Reads and solves the sites assigned to this worker"""
+    import serial
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    ring = esp_rtls_ring(SITE_RECORD, capacity, ring_name)
+    active = {}  # site => (port, buffer, solver)
+    opening = {}  # site => (solver, time of the next attempt to open the port)
+    while not stop.is_set():
+        # Control messages: ("assign", site, state) or ("release", site)
+        try:
+            while True:
+                command = commands.get_nowait()
+                site = command[1]
+                if command[0] == "assign":
+                    solver = esp_rtls_solver(site_anchors(sites[site]))
+                    if command[2] is not None:
+                        solver.restore(*command[2])
+                    opening[site] = (solver, 0)
+                elif site in active:
+                    ser, _, solver = active.pop(site)
+                    ser.close()
+                    replies.put(("released", site, solver.state()))
+                elif site in opening:
+                    solver, _ = opening.pop(site)
+                    replies.put(("released", site, solver.state()))
+                else:
+                    # Assigned to the worker this process replaced
+                    replies.put(("released", site, None))
+        except queue.Empty:
+            pass
+
+        for site, (solver, retry) in list(opening.items()):
+            if time.monotonic() < retry:
+                continue
+            try:
+                ser = serial.serial_for_url(sites[site]["port"], 115200, timeout=0)
+            except serial.SerialException as error:
+                print("worker", index, ":", error, file=sys.stderr)
+                opening[site] = (solver, time.monotonic() + 1)
+                continue
+            del opening[site]
+            active[site] = (ser, bytearray(), solver)
+
+        idle = True
+        for site, (ser, buffer, solver) in active.items():
+            data = ser.read(4096)
+            if not data:
+                continue
+            idle = False
+            buffer += data
+            *complete, rest = buffer.split(b"\n")
+            buffer[:] = rest
+            records = np.empty(len(complete), dtype=RSSI_RECORD)
+            n = 0
+            now = time.time()
+            for line in complete:
+                try:
+                    parsed = parse_line(line.decode("utf-8"))
+                except ValueError:
+                    parsed = None
+                if parsed is not None:
+                    records[n] = (now, parsed[0], parsed[1:])
+                    n += 1
+            lines[site] += len(complete)
+            if n:
+                fixes = solver.solve(records[:n])
+                out = np.empty(len(fixes), dtype=SITE_RECORD)
+                for name in POSITION_RECORD.names:
+                    out[name] = fixes[name]
+                out["site"] = site
+                ring.push(out)
+        if idle:
+            time.sleep(0.001)
+
+    for ser, _, _ in active.values():
+        ser.close()
+    print("worker", index, ": dropped =", ring.dropped, file=sys.stderr)
+    ring.close()
+
+
+class esp_rtls_supervisor:
+    """
+    Description: Shards sites over worker processes and merges their output
+
+    Attributes:
+    - sites        [List] => Site configurations
+    - n_workers    [Integer] => Number of worker processes
+    - assignment   [ndarray (sites,)] => Worker of each site
+    - load         [ndarray (sites,)] => Lines per second of each site (last rebalance interval)
+
+    Methods:
+    - start() => Start the workers and assign the sites
+    - poll() => Records of all sites received since the last poll (SITE_RECORD, sorted by t)
+    - rebalance() => Measure the load and move sites if that helps
+    - stop() => Stop the workers
+    """
+
+    def __init__(
+        self, sites, n_workers=2, capacity=8192, rebalance_s=30.0, imbalance=1.25, reply_timeout=5.0, metrics=None
+    ):
+        for site in sites:
+            if len(site_anchors(site)) != 3:
+                raise ValueError("Site " + str(site.get("name")) + ": exactly 3 anchors are supported")
+        self.sites = sites
+        self.n_workers = n_workers
+        self.capacity = capacity
+        self.rebalance_s = rebalance_s
+        self.imbalance = imbalance
+        self.reply_timeout = reply_timeout
+        self.metrics = metrics
+        self.assignment = lpt([1.0] * len(sites), n_workers)
+        self.load = np.zeros(len(sites))
+        self.__lines = multiprocessing.Array("q", len(sites), lock=False)
+        self.__lines_last = np.zeros(len(sites))
+        self.__t_last = time.monotonic()
+        self.__next_rebalance = self.__t_last + rebalance_s
+        self.__stop = multiprocessing.Event()
+        self.__replies = multiprocessing.Queue()
+        self.__commands = [multiprocessing.Queue() for _ in range(n_workers)]
+        self.__rings = [esp_rtls_ring(SITE_RECORD, capacity) for _ in range(n_workers)]
+        self.__workers = []
+        if metrics is not None:
+            metrics.describe("esp_rtls_site_fixes_total", "counter", "Fixes per site")
+            metrics.describe("esp_rtls_site_load", "gauge", "Lines per second per site")
+            metrics.describe("esp_rtls_site_worker", "gauge", "Worker of each site")
+            metrics.gauge("esp_rtls_site_load", lambda: {("site", s["name"]): l for s, l in zip(sites, self.load)})
+            metrics.gauge(
+                "esp_rtls_site_worker", lambda: {("site", s["name"]): w for s, w in zip(sites, self.assignment)}
+            )
+
+    def start(self):
+        for index in range(self.n_workers):
+            self.__workers.append(self.__spawn(index))
+        for site, worker in enumerate(self.assignment.tolist()):
+            self.__commands[worker].put(("assign", site, None))
+
+    def poll(self):
+        records = np.concatenate([ring.pop() for ring in self.__rings])
+        records = records[np.argsort(records["t"], kind="stable")]
+        if self.metrics is not None and len(records):
+            for site, count in zip(*np.unique(records["site"], return_counts=True)):
+                self.metrics.inc("esp_rtls_site_fixes_total", ("site", self.sites[site]["name"]), int(count))
+        if time.monotonic() >= self.__next_rebalance:
+            self.rebalance()
+        return records
+
+    def rebalance(self):
+        now = time.monotonic()
+        lines = np.frombuffer(self.__lines, dtype=np.int64).astype(float)
+        self.load = (lines - self.__lines_last) / max(now - self.__t_last, 1e-9)
+        self.__lines_last = lines
+        self.__t_last = now
+        self.__next_rebalance = now + self.rebalance_s
+
+        proposed = lpt(self.load, self.n_workers)
+        current_max = worker_load(self.assignment, self.load, self.n_workers).max()
+        proposed_max = worker_load(proposed, self.load, self.n_workers).max()
+        if proposed_max * self.imbalance >= current_max:
+            return
+        # Keep the worker numbering closest to the current assignment
+        proposed = self.__match_workers(proposed)
+        for site in np.nonzero(proposed != self.assignment)[0].tolist():
+            self.__commands[self.assignment[site]].put(("release", site))
+            try:
+                _, released, state = self.__replies.get(timeout=self.reply_timeout)
+            except queue.Empty:
+                self.__restart(int(self.assignment[site]), proposed)
+                released, state = site, None
+            self.__commands[proposed[released]].put(("assign", released, state))
+        self.assignment = proposed
+
+    def stop(self):
+        self.__stop.set()
+        for worker in self.__workers:
+            worker.join()
+        for ring in self.__rings:
+            ring.close()
+            ring.unlink()
+
+    def __spawn(self, index):
+        worker = multiprocessing.Process(
+            target=_worker,
+            args=(
+                index,
+                self.sites,
+                self.__commands[index],
+                self.__replies,
+                self.__rings[index].name,
+                self.capacity,
+                self.__lines,
+                self.__stop,
+            ),
+        )
+        worker.start()
+        return worker
+
+    def __restart(self, index, proposed):
+        """Replace a dead (hung or crashed) worker, re-assign the sites it keeps without their state"""
+        print("worker", index, ": no reply, restarting", file=sys.stderr)
+        self.__workers[index].terminate()
+        self.__workers[index].join(1)
+        if self.__workers[index].is_alive():
+            self.__workers[index].kill()
+            self.__workers[index].join()
+        try:
+            while True:
+                self.__commands[index].get_nowait()
+        except queue.Empty:
+            pass
+        self.__workers[index] = self.__spawn(index)
+        for site in np.nonzero((self.assignment == index) & (proposed == index))[0].tolist():
+            self.__commands[index].put(("assign", site, None))
+
+    def __match_workers(self, proposed):
+        """Relabel the workers of an assignment, so as few sites as possible move"""
+        labels = np.full(self.n_workers, -1)
+        free = list(range(self.n_workers))
+        overlap = np.zeros((self.n_workers, self.n_workers), dtype=np.int64)
+        np.add.at(overlap, (proposed, self.assignment), 1)
+        for new in np.argsort(-overlap.max(axis=1), kind="stable").tolist():
+            best = max(free, key=lambda old: overlap[new, old])
+            labels[new] = best
+            free.remove(best)
+        return labels[proposed]
+
+
+def _terminate(signum, frame):
+    raise KeyboardInterrupt
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the pipelines of several sites on a pool of workers")
+    parser.add_argument("sites", help='JSON file: [{"name": ..., "port": ..., "anchors": [[x, y], ...]}, ...]')
+    parser.add_argument("--workers", type=int, default=2, help="Number of worker processes")
+    parser.add_argument("--rebalance", type=float, default=30, help="Seconds between load measurements")
+    parser.add_argument("--metrics", type=int, default=0, help="Port of the Prometheus metrics (0 => off)")
+    args = parser.parse_args()
+
+    with open(args.sites) as file:
+        sites = json.load(file)
+    metrics = None
+    if args.metrics:
+        from esp_rtls_api import esp_rtls_api, esp_rtls_state_index
+        from esp_rtls_metrics import esp_rtls_metrics
+
+        metrics = esp_rtls_metrics()
+        api = esp_rtls_api(esp_rtls_state_index(), port=args.metrics)
+        api.add_route("/metrics", metrics.handle)
+        api.start()
+
+    supervisor = esp_rtls_supervisor(sites, args.workers, rebalance_s=args.rebalance, metrics=metrics)
+    supervisor.start()
+    signal.signal(signal.SIGTERM, _terminate)
+    names = [site["name"] for site in sites]
+    try:
+        while True:
+            records = supervisor.poll()
+            if len(records) == 0:
+                time.sleep(0.01)
+            for record in records:
+                print(
+                    names[record["site"]], round(float(record["t"]), 3), int(record["tokenID"]),
+                    round(float(record["position"][0]), 3), round(float(record["position"][1]), 3),
+                    round(float(record["gdop"]), 2), sep=",",
+                )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        supervisor.stop()
+        print("assignment =", dict(zip(names, supervisor.assignment.tolist())), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
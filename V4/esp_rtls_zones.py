@@ -0,0 +1,164 @@
+"""
+Streaming geofence/zone engine: enter/exit events when mobiles cross zones
+
+Description:
+- Zones are polygons, indexed once in a uniform grid
+    - Each grid cell holds the zones whose bounding box overlaps the cell (CSR arrays)
+- Each frame all positions are classified in one vectorized pass:
+    - Grid cell of each position => candidate (mobile, zone) pairs
+    - Crossing number test of all pairs at once (padded edge arrays)
+    - The cost depends on the number of mobiles (and the few candidates per cell),
+      not on the total number of zones
+- Hysteresis: a mobile has to be observed inside (outside) a zone for enter_frames
+  (exit_frames) consecutive frames before an enter (exit) event is emitted
+- Only state changes are emitted: (tokenID, zone name, "enter" or "exit")
+
+Usage:
+    engine = esp_rtls_zone_engine({"kitchen": [[0, 0], [4, 0], [4, 3], [0, 3]]})
+    events = engine.update(tokenIDs, positions)
+"""
+
+import numpy as np
+
+EVENT_ENTER = "enter"
+EVENT_EXIT = "exit"
+
+
+class esp_rtls_zone_engine:
+    """
+    Description: Classifies positions against many zones and tracks enter/exit
+
+    Attributes:
+    - names          [List] => Names of the zones (zone index => name)
+    - cell_size      [Float] => Size of the grid cells in m
+    - enter_frames   [Integer] => Frames inside before an enter event
+    - exit_frames    [Integer] => Frames outside before an exit event
+
+    Methods:
+    - classify(positions) => (mobile index, zone index) of all pairs with the position inside the zone
+    - update(tokenIDs, positions) => enter/exit events of one frame
+    - zones_of(tokenID) => Names of the zones a mobile is in
+    """
+
+    def __init__(self, zones, cell_size=None, enter_frames=2, exit_frames=2):
+        self.names = list(zones.keys())
+        polygons = [np.asarray(zones[name], dtype=float) for name in self.names]
+        self.enter_frames = enter_frames
+        self.exit_frames = exit_frames
+
+        # Edges of all zones, padded with NaN (a NaN edge never crosses)
+        n_vertices = max(len(polygon) for polygon in polygons)
+        self.__edges = np.full((len(polygons), n_vertices, 4), np.nan)
+        for z, polygon in enumerate(polygons):
+            self.__edges[z, : len(polygon), 0:2] = polygon
+            self.__edges[z, : len(polygon), 2:4] = np.roll(polygon, -1, axis=0)
+
+        # Uniform grid over the bounding boxes of the zones
+        box_min = np.array([polygon.min(axis=0) for polygon in polygons])
+        box_max = np.array([polygon.max(axis=0) for polygon in polygons])
+        if cell_size is None:
+            cell_size = float(np.median(np.max(box_max - box_min, axis=1)))
+        self.cell_size = max(cell_size, 1e-3)
+        self.__origin = box_min.min(axis=0)
+        self.__shape = (np.floor((box_max.max(axis=0) - self.__origin) / self.cell_size).astype(int) + 1)
+
+        cell_lists = [[] for _ in range(self.__shape[0] * self.__shape[1])]
+        first = np.floor((box_min - self.__origin) / self.cell_size).astype(int)
+        last = np.floor((box_max - self.__origin) / self.cell_size).astype(int)
+        for z in range(len(polygons)):
+            for cx in range(first[z, 0], last[z, 0] + 1):
+                for cy in range(first[z, 1], last[z, 1] + 1):
+                    cell_lists[cx * self.__shape[1] + cy].append(z)
+        self.__cell_start = np.zeros(len(cell_lists) + 1, dtype=np.int64)
+        self.__cell_start[1:] = np.cumsum([len(cell) for cell in cell_lists])
+        self.__cell_zones = np.array([z for cell in cell_lists for z in cell], dtype=np.int64)
+
+        # Hysteresis state of the active (mobile, zone) pairs, sorted by key = tokenID * Z + zone
+        self.__keys = np.zeros(0, dtype=np.int64)
+        self.__inside = np.zeros(0, dtype=bool)
+        self.__count = np.zeros(0, dtype=np.int32)
+
+    def classify(self, positions):
+        """
+        Args:
+            positions  [ndarray (M, 2)] => Positions of the mobiles
+
+        Returns:
+            mobile index [ndarray (P,)], zone index [ndarray (P,)] of the pairs with the mobile inside the zone
+        """
+        positions = np.asarray(positions, dtype=float)
+        cell = np.floor((positions - self.__origin) / self.cell_size).astype(np.int64)
+        on_grid = np.all((cell >= 0) & (cell < self.__shape), axis=1)
+        cell_index = np.where(on_grid, cell[:, 0] * self.__shape[1] + cell[:, 1], 0)
+        start = self.__cell_start[cell_index]
+        count = np.where(on_grid, self.__cell_start[cell_index + 1] - start, 0)
+
+        # Expand to candidate pairs
+        mobile = np.repeat(np.arange(len(positions)), count)
+        offset = np.arange(len(mobile)) - np.repeat(np.cumsum(count) - count, count)
+        zone = self.__cell_zones[np.repeat(start, count) + offset]
+
+        # Crossing number test of all pairs
+        x = positions[mobile, 0:1]
+        y = positions[mobile, 1:2]
+        edges = self.__edges[zone]
+        xa, ya, xb, yb = edges[..., 0], edges[..., 1], edges[..., 2], edges[..., 3]
+        crosses = (ya > y) != (yb > y)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x_cross = xa + (y - ya) * (xb - xa) / (yb - ya)
+        inside = np.count_nonzero(crosses & (x < x_cross), axis=1) % 2 == 1
+        return mobile[inside], zone[inside]
+
+    def update(self, tokenIDs, positions):
+        """
+        Args:
+            tokenIDs   [ndarray (M,)] => TokenIDs of the mobiles in this frame
+            positions  [ndarray (M, 2)] => Positions of the mobiles
+
+        Returns:
+            [List] => (tokenID, zone name, "enter" or "exit") for each state change
+        """
+        tokenIDs = np.asarray(tokenIDs, dtype=np.int64)
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        n_zones = len(self.names)
+        mobile, zone = self.classify(positions)
+        observed_keys = np.unique(tokenIDs[mobile] * n_zones + zone)
+
+        # Active pairs of the mobiles in this frame are re-evaluated, the others are kept
+        present = np.isin(self.__keys // n_zones, tokenIDs)
+        keys = np.union1d(self.__keys[present], observed_keys)
+        observed = np.isin(keys, observed_keys, assume_unique=True)
+        index = np.searchsorted(self.__keys, keys)
+        known = index < len(self.__keys)
+        known[known] = self.__keys[index[known]] == keys[known]
+        inside = np.zeros(len(keys), dtype=bool)
+        count = np.zeros(len(keys), dtype=np.int32)
+        inside[known] = self.__inside[index[known]]
+        count[known] = self.__count[index[known]]
+
+        # Hysteresis
+        count = np.where(observed != inside, count + 1, 0)
+        enter = ~inside & (count >= self.enter_frames)
+        leave = inside & (count >= self.exit_frames)
+        flip = enter | leave
+        inside = inside ^ flip
+        count[flip] = 0
+
+        events = [
+            (int(key // n_zones), self.names[key % n_zones], EVENT_ENTER if entered else EVENT_EXIT)
+            for key, entered in zip(keys[flip].tolist(), enter[flip].tolist())
+        ]
+
+        # Keep the pairs that are inside or pending, plus the pairs of absent mobiles
+        keep = inside | (count > 0)
+        keys = np.concatenate([keys[keep], self.__keys[~present]])
+        order = np.argsort(keys, kind="stable")
+        self.__keys = keys[order]
+        self.__inside = np.concatenate([inside[keep], self.__inside[~present]])[order]
+        self.__count = np.concatenate([count[keep], self.__count[~present]])[order]
+        return events
+
+    def zones_of(self, tokenID):
+        n_zones = len(self.names)
+        keys = self.__keys[self.__inside]
+        return [self.names[key % n_zones] for key in keys[keys // n_zones == tokenID].tolist()]
@@ -0,0 +1,12 @@
+"""
+Regression tests of the host modules
+
+Usage (headless, no COM port needed):
+    pytest V4/tests
+"""
+
+import os
+import sys
+
+# The host modules live next to app.py
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
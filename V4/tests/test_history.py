@@ -0,0 +1,37 @@
+"""
+Regression tests of esp_rtls_history and its API route
+"""
+
+import json
+import numpy as np
+import pytest
+from esp_rtls_api import esp_rtls_api, esp_rtls_state_index
+from esp_rtls_history import esp_rtls_history
+
+
+def track():
+    history = esp_rtls_history(factor=4, n_levels=3)
+    for k in range(500):
+        history.append(k * 0.1, [1], [[np.cos(k / 20), np.sin(k / 20)]])
+    return history
+
+
+@pytest.mark.parametrize("points", [3, 10, 100])
+def test_query_keeps_the_point_budget(points):
+    t, xy = track().query(1, max_points=points)
+    assert 3 <= len(t) <= points and t[0] == 0 and t[-1] == pytest.approx(49.9)
+
+
+def test_budget_below_3_is_a_bad_request():
+    history = track()
+    with pytest.raises(ValueError):
+        history.query(1, max_points=1)
+    api = esp_rtls_api(esp_rtls_state_index(), port=0, history=history)
+    api.start()
+    try:
+        for points in ("0", "1", "2"):
+            status, _, body = api.handle("/mobiles/1/history?points=" + points)
+            assert status == 400 and "points" in json.loads(body)["error"]
+        assert api.handle("/mobiles/1/history?points=3")[0] == 200
+    finally:
+        api.stop()
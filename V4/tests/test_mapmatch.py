@@ -0,0 +1,45 @@
+"""
+Regression tests of esp_rtls_mapmatch
+"""
+
+import os
+import numpy as np
+from esp_rtls_mapmatch import esp_rtls_mapmatch
+
+
+def wall_floorplan():
+    # 10 x 10 m, 0.1 m cells, wall at x = 5 m
+    blocked = np.zeros((100, 100), dtype=bool)
+    blocked[:, 50] = True
+    return blocked
+
+
+def test_rejected_transition_does_not_lock_the_mobile():
+    matcher = esp_rtls_mapmatch(wall_floorplan(), resolution=0.1, max_rejections=3, reanchor_s=60)
+    matcher.update([1], [[2, 2]], t=0)
+    # The mobile really moved through the door behind the wall: rejected a few times, then followed
+    accepted = [bool(matcher.update([1], [[8, 2]], t=1 + k)[1][0]) for k in range(5)]
+    assert accepted == [False, False, False, True, True]
+    positions, accepted, _ = matcher.update([1], [[8.2, 2]], t=7)
+    assert accepted[0] and np.allclose(positions[0], [8.25, 2.05], atol=0.1)
+
+
+def test_reanchor_after_a_gap():
+    matcher = esp_rtls_mapmatch(wall_floorplan(), resolution=0.1, reanchor_s=10)
+    matcher.update([1], [[2, 2]], t=0)
+    assert not matcher.update([1], [[8, 2]], t=1)[1][0]
+    # Reconnect after a gap: the stale position is dropped
+    positions, accepted, _ = matcher.update([1], [[8, 2]], t=20)
+    assert accepted[0] and positions[0][0] > 5
+
+
+def test_cache_is_rebuilt_for_an_edited_raster(tmp_path):
+    cache = str(tmp_path / "plan.mapmatch.npz")
+    blocked = wall_floorplan()
+    esp_rtls_mapmatch(blocked, resolution=0.1, cache=cache)
+    assert os.path.exists(cache)
+    # New wall at x = 3 m: the cached distance field of the old raster must not be used
+    blocked[:, 30] = True
+    matcher = esp_rtls_mapmatch(blocked, resolution=0.1, cache=cache)
+    snapped, penalty = matcher.snap([[3.05, 5.05]])
+    assert penalty[0] > 0 and not np.isclose(snapped[0][0], 3.05)
@@ -0,0 +1,25 @@
+"""
+Regression tests of esp_rtls_rows
+"""
+
+import numpy as np
+from esp_rtls_rows import esp_rtls_rows, occurrences
+
+
+def test_growth_keeps_rows_and_fills_new_ones():
+    state = esp_rtls_rows(capacity=2)
+    state.add("P", (2, 2), fill=np.eye(2) * 5)
+    state.add("buckets", (3, 4), dtype=np.float32, axis=1)
+    rows = state.get([7, 9])
+    state.P[rows] = 1
+    assert state.get([11, 9, 13, 7]).tolist() == [2, 1, 3, 0]
+    assert state.capacity == 4 and state.P.shape == (4, 2, 2) and state.buckets.shape == (3, 4, 4)
+    assert (state.P[:2] == 1).all() and np.allclose(state.P[2:], np.eye(2) * 5)
+
+
+def test_occurrences_keep_the_order_of_a_batch():
+    rows = np.array([4, 1, 4, 4, 1, 2])
+    batches = occurrences(rows)
+    assert [rows[batch].tolist() for batch in batches] == [[4, 1, 2], [4, 1], [4]]
+    assert np.nonzero(batches[1])[0].tolist() == [2, 4]
+    assert occurrences(np.zeros(0, dtype=np.int64)) == []